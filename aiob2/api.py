@@ -17,6 +17,11 @@ class API():
     upload_large = '/b2_start_large_file'
     upload_large_part = '/b2_get_upload_part_url'
     upload_large_finish = '/b2_finish_large_file'
+    upload_large_cancel = '/b2_cancel_large_file'
+    list_parts = '/b2_list_parts'
+    list_unfinished_large_files = '/b2_list_unfinished_large_files'
+    copy_file = '/b2_copy_file'
+    copy_part = '/b2_copy_part'
     create_bucket = '/b2_create_bucket'
     delete_bucket = '/b2_delete_bucket'
     list_all_buckets = '/b2_list_buckets'
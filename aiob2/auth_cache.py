@@ -0,0 +1,165 @@
+from hashlib import sha256
+import asyncio
+import json
+import os
+import tempfile
+import time
+import weakref
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'aiob2',
+                            'auth.json')
+
+# Fields of the b2_authorize_account response that are kept.
+CACHED_FIELDS = (
+    'accountId',
+    'authorizationToken',
+    'apiUrl',
+    'downloadUrl',
+    'recommendedPartSize',
+    'absoluteMinimumPartSize',
+)
+
+# Seconds between attempts to take the lock while another process holds it.
+LOCK_POLL_INTERVAL = 0.05
+
+# Per event loop, an asyncio.Lock per cache path, so clients of one process
+# wait for each other without each taking an executor thread.
+_process_locks = weakref.WeakKeyDictionary()
+
+
+class AuthCache():
+    """ An on-disk cache of b2_authorize_account results, shared by every
+    process that uses the same file.
+
+    Entries are keyed by a hash of the key ID and application key, so the
+    keys themselves are never written to disk. The file is only readable by
+    its owner, and access is serialized with an exclusive lock on a
+    companion `.lock` file (where `fcntl` is available), so that processes
+    starting at the same time make a single b2_authorize_account call between
+    them.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.lock_path = path + '.lock'
+
+    def lock(self):
+        """ Hold the cache lock in an `async with` block.
+
+        Tasks of this process using the same path queue on an asyncio.Lock,
+        and the file lock is polled without blocking, so waiting never takes
+        up an executor thread.
+        """
+        return _CacheLock(self)
+
+    def acquire(self, blocking=True):
+        """ Take the file lock, returning the lock file to pass to release(),
+        or None if `blocking` is False and another process holds it.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        lock_file = open(self.lock_path, 'a')
+        if fcntl is not None:
+            flags = fcntl.LOCK_EX
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock_file.fileno(), flags)
+            except BlockingIOError:
+                lock_file.close()
+                return None
+        return lock_file
+
+    def release(self, lock_file):
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        lock_file.close()
+
+    def load(self, key_id, application_key):
+        """ Returns the cached response JSON and the UNIX time it was
+        authorized at, or (None, None).
+        """
+        entry = self._read().get(_cache_key(key_id, application_key))
+        if entry is None:
+            return None, None
+        return entry['response'], entry['authorizedAt']
+
+    def store(self, key_id, application_key, response_json,
+              authorized_at=None):
+        entries = self._read()
+        entries[_cache_key(key_id, application_key)] = {
+            'response': {field: response_json[field]
+                         for field in CACHED_FIELDS if field in response_json},
+            'authorizedAt': authorized_at or time.time(),
+        }
+        self._write(entries)
+
+    def clear(self, key_id, application_key):
+        entries = self._read()
+        if entries.pop(_cache_key(key_id, application_key), None):
+            self._write(entries)
+
+    def _read(self):
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, entries):
+        # Write to a private temporary file and move it into place, so other
+        # readers never see a partially written cache.
+        directory = os.path.dirname(self.path) or '.'
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.auth-')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(entries, file)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+
+class _CacheLock():
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.process_lock = None
+        self.lock_file = None
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        locks = _process_locks.setdefault(loop, {})
+        path = os.path.abspath(self.cache.lock_path)
+        self.process_lock = locks.setdefault(path, asyncio.Lock())
+        await self.process_lock.acquire()
+        try:
+            while True:
+                self.lock_file = await loop.run_in_executor(
+                    None, lambda: self.cache.acquire(blocking=False))
+                if self.lock_file is not None:
+                    return self
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+        except BaseException:
+            self.process_lock.release()
+            raise
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.cache.release,
+                                       self.lock_file)
+        finally:
+            self.process_lock.release()
+        return False
+
+
+def _cache_key(key_id, application_key):
+    return sha256('{}:{}'.format(key_id, application_key).encode()).hexdigest()
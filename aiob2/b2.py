@@ -1,15 +1,64 @@
+from aiob2.api import API
+from aiob2.bucket import B2Bucket
 from aiob2.exceptions import B2ApplicationKeyNotSet, B2KeyIDNotSet
+from aiob2.exceptions import B2InvalidBucketName, B2InvalidBucketConfiguration
 from aiob2.connector import B2Connector
-import aiohttp
+from aiob2.pool import DEFAULT_POOL_SIZE
+from aiob2.transport import TransportConfig, pool_stats
 import os
 import json
 
 
 class B2():
 
-    def __init__(self, loop=None):
-        self.session = aiohttp.ClientSession(loop=loop)
-        self.connector = B2Connector(self.session)
+    def __init__(self, loop=None, upload_pool_size=DEFAULT_POOL_SIZE,
+                 retry_policy=None, auth_cache=None, transport=None,
+                 upload_transport=None, download_transport=None,
+                 hashing=None, throttle=None):
+        """
+        API calls, uploads and downloads each get their own connection pool,
+        configured by `transport`, `upload_transport` and
+        `download_transport` (TransportConfig). The latter two default to
+        `transport`, which defaults to TransportConfig().
+
+        Upload bodies are hashed by `hashing` (HashingPool), which defaults to
+        HashingPool(). Request rates and bandwidth are limited by `throttle`
+        (Throttle), which defaults to no limits.
+        """
+        transport = transport or TransportConfig()
+        self.session = transport.create_session(loop=loop)
+        self.upload_session = (upload_transport or transport).create_session(
+            loop=loop)
+        self.download_session = (download_transport or
+                                 transport).create_session(loop=loop)
+        self.connector = B2Connector(self.session,
+                                     upload_pool_size=upload_pool_size,
+                                     retry_policy=retry_policy,
+                                     auth_cache=auth_cache,
+                                     upload_session=self.upload_session,
+                                     download_session=self.download_session,
+                                     hashing=hashing,
+                                     throttle=throttle)
+
+    async def close(self):
+        """ Stop the background token refresh, close the HTTP sessions and
+        shut down the hashing workers.
+        """
+        self.connector.close()
+        self.connector.hashing.close()
+        await self.session.close()
+        await self.upload_session.close()
+        await self.download_session.close()
+
+    def pool_stats(self):
+        """ Connection pool limits and usage for API calls, uploads and
+        downloads.
+        """
+        return {
+            'api': pool_stats(self.session),
+            'upload': pool_stats(self.upload_session),
+            'download': pool_stats(self.download_session),
+        }
 
     def authenticate(self, key_id=None, application_key=None):
         """ b2_authorize_account """
@@ -64,7 +113,7 @@ class B2():
         if types is not None:
             params['bucketTypes'] = json.dumps(list(types))
 
-        response = await self.connector.put(
+        response = await self.connector.post(
             path=API.list_all_buckets,
             account_id_required=True,
             params=params)
@@ -1,14 +1,26 @@
 from aiob2.exceptions import B2Exception, B2BucketDeleted
+from aiob2.exceptions import B2FileNotFoundError, B2RequestError
 from aiob2.api import API
+from aiob2.concurrency import limit_concurrency
+from aiob2.file import B2File, B2FileEntry
+from aiob2.utilities import get_content_length, get_part_ranges
+from aiob2.utilities import iterate, local_path, open_part_reader
+from aiob2.utilities import run_workers
+from collections import Counter, namedtuple
+import asyncio
+import os
 
 
 MAX_FILES_PER_LIST = 10000
+DEFAULT_PART_CONCURRENCY = 4
+DEFAULT_UPLOAD_CONCURRENCY = 16
+DEFAULT_LIST_CONCURRENCY = 8
+DEFAULT_DELETE_CONCURRENCY = 16
 
 
-def _chunk_file(path, chunk_size):
-    with open(contents.name, 'rb') as file:
-        for chunk in iter(lambda: file.read(chunk_size), b''):
-            yield chunk
+# Outcome of one upload in B2Bucket.upload_many: the uploaded B2File, or the
+# exception that made it fail.
+UploadResult = namedtuple('UploadResult', ['file_name', 'file', 'error'])
 
 
 def _sanitize_file_name(file_name):
@@ -69,93 +81,776 @@ class B2Bucket(object):
                                                       params={'fileId': file_id}))
 
     async def _get_by_name(self, name):
-        async for file in self.list_file(prefix=name):
+        async for file in self.list_files(start_file=name, limit=1,
+                                          prefetch=0):
             if file.name == name:
                 return file
-        raise B2FileNotFoundError('Filename {} not found'.format(file_name))
+        raise B2FileNotFoundError('Filename {} not found'.format(name))
 
     async def list_files(self, prefix=None,
                          start_file=None,
-                         limit=100,
-                         delimiter=None):
-        """ b2_list_file_names """
+                         limit=None,
+                         delimiter=None,
+                         page_size=MAX_FILES_PER_LIST,
+                         prefetch=1,
+                         lightweight=False):
+        """ List the latest version of every file in the bucket, in
+        lexicographic order.
+
+        Calls: b2_list_file_names
+
+            Parameters:
+                prefix:         (str) Only list names with this prefix
+                start_file:     (str) First file name to list
+                limit:          (int) Maximum number of files listed
+                delimiter:      (str) Collapse names below this delimiter into
+                                folder entries
+                page_size:      (int) Files requested per call (max 10000)
+                prefetch:       (int) Pages requested ahead of the caller;
+                                0 disables read-ahead
+                lightweight:    (bool) Yield compact B2FileEntry records
+                                instead of B2File objects
+        """
         params = {'bucketId': self.id}
         if prefix is not None:
-            params['prefix'] = b2_url_encode(prefix)
+            params['prefix'] = prefix
         if start_file is not None:
             params['startFileName'] = start_file
         if limit is not None:
-            params['maxFileCount'] = min(int(limit), MAX_FILES_PER_LIST)
+            page_size = min(page_size, int(limit))
+        params['maxFileCount'] = min(int(page_size), MAX_FILES_PER_LIST)
         if delimiter is not None:
             params['delimiter'] = delimiter
 
-        while True:
-            response = await self.connector.post(API.list_all_files, params)
+        file_class = B2FileEntry if lightweight else B2File
+        count = 0
+        pages = self.connector.paginate(
+            API.list_all_files, params,
+            {'startFileName': 'nextFileName'},
+            prefetch=prefetch)
+        try:
+            async for response in pages:
+                for file_json in response['files']:
+                    if limit is not None and count >= limit:
+                        return
+                    count += 1
+                    yield file_class(self, file_json)
+        finally:
+            await pages.aclose()
+
+    async def list_file_versions(self, prefix=None,
+                                 start_file_name=None,
+                                 start_file_id=None,
+                                 limit=None,
+                                 delimiter=None,
+                                 page_size=MAX_FILES_PER_LIST,
+                                 prefetch=1,
+                                 lightweight=False):
+        """ List every version of every file in the bucket, by name and then
+        newest first, including hide markers.
+
+        Calls: b2_list_file_versions
 
-            for file_json in response['files']:
-                yield B2File(self, file_json)
+            Parameters:
+                prefix:             (str) Only list names with this prefix
+                start_file_name:    (str) First file name to list
+                start_file_id:      (str) First version of `start_file_name`
+                                    to list (requires start_file_name)
+                limit:              (int) Maximum number of versions listed
+                delimiter:          (str) Collapse names below this delimiter
+                                    into folder entries
+                page_size:          (int) Versions requested per call
+                                    (max 10000)
+                prefetch:           (int) Pages requested ahead of the caller;
+                                    0 disables read-ahead
+                lightweight:        (bool) Yield compact B2FileEntry records
+                                    instead of B2File objects
+        """
+        params = {'bucketId': self.id}
+        if prefix is not None:
+            params['prefix'] = prefix
+        if start_file_name is not None:
+            params['startFileName'] = start_file_name
+        if start_file_id is not None:
+            params['startFileId'] = start_file_id
+        if limit is not None:
+            page_size = min(page_size, int(limit))
+        params['maxFileCount'] = min(int(page_size), MAX_FILES_PER_LIST)
+        if delimiter is not None:
+            params['delimiter'] = delimiter
+
+        file_class = B2FileEntry if lightweight else B2File
+        count = 0
+        pages = self.connector.paginate(
+            API.list_file_versions, params,
+            {'startFileName': 'nextFileName', 'startFileId': 'nextFileId'},
+            prefetch=prefetch)
+        try:
+            async for response in pages:
+                for file_json in response['files']:
+                    if limit is not None and count >= limit:
+                        return
+                    count += 1
+                    yield file_class(self, file_json)
+        finally:
+            await pages.aclose()
+
+    async def list_files_sharded(self, prefix=None,
+                                 boundaries=None,
+                                 prefixes=None,
+                                 delimiter='/',
+                                 concurrency=DEFAULT_LIST_CONCURRENCY,
+                                 ordered=True,
+                                 page_size=MAX_FILES_PER_LIST,
+                                 prefetch=1,
+                                 lightweight=False):
+        """ List files by walking several shards of the name space at once.
+
+        Calls: b2_list_file_names
+
+        Shards are either the ranges between sorted `boundaries` (start file
+        names), or a list of disjoint `prefixes`. If neither is given, the
+        folders directly below `prefix` found in the first page of a
+        `delimiter` listing are used as boundaries, with the rest of the name
+        space after that page as a last shard. Without any folders (a flat
+        name space), this is a plain list_files. Up to `concurrency` shards
+        are listed at a time.
+
+            Parameters:
+                prefix:         (str) Only list names with this prefix
+                boundaries:     (list) File names to split the listing at
+                prefixes:       (list) Disjoint prefixes to list
+                delimiter:      (str) Delimiter used to find shards
+                concurrency:    (int) Number of shards listed at once
+                ordered:        (bool) Yield files in lexicographic order;
+                                otherwise in the order they arrive
+                page_size:      (int) Files requested per call (max 10000)
+                prefetch:       (int) Pages requested ahead per shard
+                lightweight:    (bool) Yield compact B2FileEntry records
+        """
+        if prefixes is not None:
+            shards = [(shard_prefix, None, None)
+                      for shard_prefix in sorted(set(prefixes))]
+        else:
+            if boundaries is None:
+                boundaries = await self._find_boundaries(prefix, delimiter,
+                                                         page_size)
+            if not boundaries:
+                async for file in self.list_files(prefix=prefix,
+                                                  page_size=page_size,
+                                                  prefetch=prefetch,
+                                                  lightweight=lightweight):
+                    yield file
+                return
+            starts = [None] + sorted(set(boundaries))
+            ends = starts[1:] + [None]
+            shards = [(prefix, start, end)
+                      for start, end in zip(starts, ends)]
+
+        semaphore = asyncio.Semaphore(concurrency)
+        shared = asyncio.Queue(maxsize=page_size)
+        queues = [shared if not ordered else asyncio.Queue(maxsize=page_size)
+                  for _ in shards]
+
+        async def list_shard(shard, queue):
+            shard_prefix, start, end = shard
+            async with semaphore:
+                files = self.list_files(prefix=shard_prefix,
+                                        start_file=start,
+                                        page_size=page_size,
+                                        prefetch=prefetch,
+                                        lightweight=lightweight)
+                try:
+                    async for file in files:
+                        if end is not None and file.name >= end:
+                            break
+                        await queue.put((file, None))
+                except Exception as error:
+                    await queue.put((None, error))
+                else:
+                    await queue.put((None, None))
+
+        tasks = [asyncio.ensure_future(list_shard(shard, queue))
+                 for shard, queue in zip(shards, queues)]
+        try:
+            # In ordered mode each shard has its own queue and the shards are
+            # drained in turn; otherwise every shard feeds the shared queue.
+            for queue in (queues if ordered else [shared] * len(shards)):
+                while True:
+                    file, error = await queue.get()
+                    if error is not None:
+                        raise error
+                    if file is None:
+                        break
+                    yield file
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _find_boundaries(self, prefix, delimiter, page_size):
+        """ Shard boundaries from one page of a `delimiter` listing: the
+        folders in it, and the name after it if there are more names. Only
+        the first page is read, so a flat name space is not listed twice.
+        """
+        folders, names = [], 0
+        last_name = None
+        async for entry in self.list_files(prefix=prefix,
+                                           delimiter=delimiter,
+                                           limit=page_size,
+                                           page_size=page_size,
+                                           prefetch=0, lightweight=True):
+            names += 1
+            last_name = entry.name
+            if entry.action == 'folder':
+                folders.append(entry.name)
+        if folders and names >= page_size:
+            # Everything after the page is listed as one more shard, starting
+            # past the last name seen (or its folder).
+            folders.append(last_name + '\uffff' if last_name.endswith(
+                delimiter) else last_name)
+        return folders
+
+    async def delete_prefix(self, prefix, versions='all',
+                            concurrency=DEFAULT_DELETE_CONCURRENCY,
+                            dry_run=False, progress_listener=None):
+        """ Delete the files whose names start with `prefix`.
+
+        Calls: b2_list_file_versions, b2_delete_file_version
+
+        Version listings are streamed (with read-ahead) into `concurrency`
+        delete workers. Deletes that B2 throttles are retried according to
+        the connector's retry policy; deletes that still fail are counted and
+        skipped rather than stopping the purge.
+
+            Parameters:
+                prefix:             (str) File name prefix to purge
+                versions:           (str) 'all' to delete every version, or
+                                    'latest' to delete only the newest version
+                                    of each file
+                concurrency:        (int or AdaptiveLimiter) Number of
+                                    deletes in flight
+                dry_run:            (bool) Only count what would be deleted
+                progress_listener:  (callable) Called with the counters after
+                                    every file version
+
+            Returns:
+                (Counter) 'listed', 'deleted' and 'failed' file versions
+        """
+        if versions not in ('all', 'latest'):
+            raise ValueError("versions must be 'all' or 'latest'")
+        stats = Counter(listed=0, deleted=0, failed=0)
+
+        async def list_versions():
+            last_name = None
+            async for version in self.list_file_versions(prefix=prefix,
+                                                         lightweight=True):
+                # Versions of a file are listed newest first.
+                if versions == 'latest' and version.name == last_name:
+                    continue
+                last_name = version.name
+                stats['listed'] += 1
+                yield version
+
+        def delete_params(version):
+            return {'fileId': version.id, 'fileName': version.name}
+
+        await self._purge(list_versions(), API.delete_file_version,
+                          delete_params, stats, 'deleted', concurrency,
+                          dry_run, progress_listener)
+        return stats
+
+    async def hide_prefix(self, prefix,
+                          concurrency=DEFAULT_DELETE_CONCURRENCY,
+                          dry_run=False, progress_listener=None):
+        """ Hide every file whose name starts with `prefix`, keeping their
+        previous versions.
+
+        Calls: b2_list_file_names, b2_hide_file
+
+        Works like delete_prefix; the returned Counter has 'listed', 'hidden'
+        and 'failed' files.
+        """
+        stats = Counter(listed=0, hidden=0, failed=0)
+
+        async def list_names():
+            async for file in self.list_files(prefix=prefix,
+                                              lightweight=True):
+                stats['listed'] += 1
+                yield file
+
+        def hide_params(file):
+            return {'bucketId': self.id, 'fileName': file.name}
 
-            if files_json['nextFileName'] is None:
-                break
-            params['startFileName'] = response['nextFileName']
+        await self._purge(list_names(), API.delete_file, hide_params, stats,
+                          'hidden', concurrency, dry_run, progress_listener)
+        return stats
+
+    async def _purge(self, listing, path, get_params, stats, done_key,
+                     concurrency, dry_run, progress_listener):
+        """ Call `path` for every listed file with `concurrency` workers,
+        counting successes under `done_key` and failures under 'failed'.
+        """
+        async def purge(file):
+            if not dry_run:
+                try:
+                    await self.connector.post(path=path,
+                                              params=get_params(file))
+                except B2Exception:
+                    stats['failed'] += 1
+                else:
+                    stats[done_key] += 1
+            if progress_listener is not None:
+                progress_listener(stats)
+
+        purge, workers = self._limit_concurrency(purge, concurrency)
+        await run_workers(listing, purge, workers)
 
     async def upload_file(self, contents, file_name, mime_content_type=None,
-                          content_length=None):
+                          content_length=None, file_info=None,
+                          content_sha1=None, progress_listener=None):
+        """ b2_upload_file
+
+        Upload URLs are reused across calls through the connector's per-bucket
+        upload URL pool. `file_info` is a dict of custom file info (sent as
+        X-Bz-Info-* headers), e.g. {'src_last_modified_millis': '...'}.
+
+        By default the SHA1 is computed while sending and appended to the
+        body. `content_sha1` sends it in the header with the data as a plain
+        body instead: pass the hex SHA1 if it is known, PRECOMPUTE_SHA1 to
+        hash seekable `contents` before sending, or DO_NOT_VERIFY to skip
+        hashing for trusted data.
+
+        `progress_listener` is called with the number of bytes sent so far,
+        at most every 0.5 seconds or 16 MiB.
+        """
         file_name = _sanitize_file_name(file_name)
-        return B2File(self, await self._upload(
-            endpoint=API.uppload_url,
-            handler=self.connector.upload_file,
-            contents=contents,
-            file_name=file_name,
-            content_length=content_length))
+        return B2File(self, await self.connector.upload_file(
+            self.id,
+            contents,
+            file_name,
+            mime_content_type=mime_content_type,
+            content_length=content_length,
+            file_info=file_info,
+            content_sha1=content_sha1,
+            progress_listener=progress_listener))
+
+    async def copy_file(self, source_file_id, file_name,
+                        mime_content_type=None, file_info=None):
+        """ Copy a file (from any bucket of the account) into this bucket
+        without downloading it.
+
+        Calls: b2_copy_file
+
+            Parameters:
+                source_file_id:     (str) ID of the file version to copy
+                file_name:          (str) Name of the new file
+                mime_content_type:  (str) Content type of the new file
+                                    (optional, defaults to the source's)
+                file_info:          (dict) File info of the new file
+                                    (optional, defaults to the source's)
+
+        The source must be at most 5 GB; see B2File.copy_to for larger files.
+        """
+        params = {
+            'sourceFileId': source_file_id,
+            'fileName': _sanitize_file_name(file_name),
+            'destinationBucketId': self.id,
+        }
+        if mime_content_type is not None or file_info is not None:
+            params['metadataDirective'] = 'REPLACE'
+            params['contentType'] = mime_content_type or 'b2/x-auto'
+            params['fileInfo'] = {key: str(value)
+                                  for key, value in (file_info or {}).items()}
+        return B2File(self, await self.connector.post(path=API.copy_file,
+                                                      params=params))
+
+    async def upload_deduplicated(self, contents, file_name, index,
+                                  mime_content_type=None, content_length=None,
+                                  file_info=None, hash_cache=None):
+        """ Upload a file unless the same bytes are already in the bucket, in
+        which case the existing object is copied under the new name.
+
+        Calls: b2_copy_file or b2_upload_file
+
+            Parameters:
+                contents:           (file or bytes) Data to upload
+                file_name:          (str) File name
+                index:              (DedupeIndex or ManifestIndex) Where the
+                                    SHA1s of uploaded objects are looked up
+                                    and recorded
+                mime_content_type:  (str) Content type (optional)
+                content_length:     (int) Size in bytes (optional)
+                file_info:          (dict) Custom file info (optional)
+                hash_cache:         (HashCache) Cache of local SHA1s, used
+                                    when `contents` is a file opened from a
+                                    path (optional)
+
+        `contents` is hashed on the connector's HashingPool before anything
+        is sent, unless `hash_cache` has the SHA1 of the whole, unchanged
+        file. If `index` knows an object with that SHA1, it is copied
+        server-side; objects that have since been deleted are dropped from
+        the index and the data is uploaded instead. Newly uploaded objects
+        are recorded in `index`.
+        """
+        loop = asyncio.get_running_loop()
+        path = hash_cache is not None and local_path(contents)
+        content_sha1, key = None, None
+        if path and contents.tell() == 0:
+            key = await loop.run_in_executor(None, hash_cache.stat, path)
+            if content_length not in (None, key[1]):
+                key = None
+        if key is not None:
+            cached = await loop.run_in_executor(None, hash_cache.lookup,
+                                                path, key)
+            content_sha1 = cached and cached[0]
+        if content_sha1 is None:
+            content_sha1 = await self.connector.precompute_sha1(
+                contents, content_length)
+            if key is not None:
+                await loop.run_in_executor(None, lambda: hash_cache.store(
+                    path, key, sha1=content_sha1))
+
+        source_file_id = await index.lookup(self, content_sha1)
+        if source_file_id is not None:
+            try:
+                return await self.copy_file(
+                    source_file_id, file_name,
+                    mime_content_type=mime_content_type,
+                    file_info=file_info)
+            except (B2FileNotFoundError, B2RequestError):
+                await index.forget(self, content_sha1)
+
+        file = await self.upload_file(contents, file_name,
+                                      mime_content_type=mime_content_type,
+                                      content_length=content_length,
+                                      file_info=file_info,
+                                      content_sha1=content_sha1)
+        await index.record(self, content_sha1, file)
+        return file
+
+    async def upload_many(self, sources,
+                          concurrency=DEFAULT_UPLOAD_CONCURRENCY,
+                          mime_content_type=None):
+        """ Upload many small files concurrently.
+
+        `sources` is a sync or async iterable of (file_name, contents) pairs,
+        where contents is anything upload_file accepts or a local path. It is
+        only consumed as fast as the `concurrency` uploads in flight finish,
+        and upload URLs are reused between uploads.
+
+        `concurrency` may also be an AdaptiveLimiter, which then decides how
+        many uploads are in flight.
+
+        Yields an UploadResult for every source as its upload completes. A
+        failed upload is reported in its result's `error` and does not stop
+        the others.
+        """
+        async def upload(source):
+            file_name, contents = source
+            if isinstance(contents, (str, os.PathLike)):
+                with open(contents, 'rb') as file:
+                    return await self.upload_file(
+                        file, file_name, mime_content_type=mime_content_type)
+            return await self.upload_file(
+                contents, file_name, mime_content_type=mime_content_type)
+
+        upload, workers = self._limit_concurrency(upload, concurrency)
+        self.connector.bucket_upload_pool(self.id, size=workers)
+        pending = asyncio.Queue(maxsize=workers)
+        results = asyncio.Queue(maxsize=workers)
+        done = object()
+
+        async def produce():
+            try:
+                async for source in iterate(sources):
+                    await pending.put(source)
+            except Exception as error:
+                await results.put(UploadResult(None, None, error))
+            for _ in range(workers):
+                await pending.put(None)
+
+        async def work():
+            while True:
+                source = await pending.get()
+                if source is None:
+                    break
+                file_name = source[0]
+                try:
+                    result = UploadResult(file_name, await upload(source),
+                                          None)
+                except Exception as error:
+                    result = UploadResult(file_name, None, error)
+                await results.put(result)
+            await results.put(done)
+
+        tasks = [asyncio.ensure_future(produce())]
+        tasks += [asyncio.ensure_future(work()) for _ in range(workers)]
+        try:
+            finished = 0
+            while finished < workers:
+                result = await results.get()
+                if result is done:
+                    finished += 1
+                else:
+                    yield result
+        finally:
+            for task in tasks:
+                task.cancel()
 
     async def upload_large_file(self, contents, file_name,
                                 part_size=None,
-                                mime_content_type=None, content_length=None):
+                                mime_content_type=None, content_length=None,
+                                concurrency=DEFAULT_PART_CONCURRENCY,
+                                resume=False, file_info=None,
+                                hash_cache=None, progress_listener=None):
+        """ Upload a file in parts.
+
+        Up to `concurrency` parts are uploaded at once, each over its own
+        upload part URL. A part is only read from `contents` right before it
+        is sent, so at most `concurrency` parts are held in memory.
+
+            Parameters:
+                contents:           (file or bytes) Data to upload
+                file_name:          (str) File name
+                part_size:          (int) Part size in bytes (optional,
+                                    defaults to recommendedPartSize)
+                mime_content_type:  (str) Content type (optional)
+                content_length:     (int) Total size in bytes (optional)
+                concurrency:        (int or AdaptiveLimiter) Number of
+                                    concurrent part uploads
+                resume:             (bool) Continue an unfinished upload of
+                                    the same file if one exists (optional)
+                file_info:          (dict) Custom file info (optional)
+                hash_cache:         (HashCache) Cache of local part SHA1s,
+                                    used when `contents` is a file opened
+                                    from a path (optional)
+                progress_listener:  (callable) Called with the number of bytes
+                                    sent so far, over all parts (optional)
+
+        With `resume`, an unfinished large file with the same name whose
+        stored parts fit the part layout of `contents` is picked up instead of
+        starting a new one. Stored parts are verified against the SHA1 of the
+        matching local range, and only missing or mismatched parts are
+        uploaded. With a `hash_cache`, the SHA1 of every part is cached as
+        soon as the part is stored, so resuming an interrupted upload of an
+        unchanged file verifies the stored parts without reading them.
+        """
         file_name = _sanitize_file_name(file_name)
         part_size = part_size or self.connector.recommended_part_size
-        content_length = contennt_length or get_content_length(contents)
+        content_length = content_length or get_content_length(contents)
+        part_ranges = list(get_part_ranges(content_length, part_size))
 
-        file_id = self._start_file_upload(file_name, mime_content_type)
-        sha_list = self._upload_file_parts(file_id)
-        response = self._finish_large_file(file_id, sha_list)
+        loop = asyncio.get_running_loop()
+        path = hash_cache is not None and local_path(contents)
+        key = path and await loop.run_in_executor(None, hash_cache.stat,
+                                                  path)
+
+        file_id, uploaded, part_sha1s = None, {}, None
+        if resume:
+            file_id, uploaded = await self._find_unfinished_large_file(
+                file_name, part_ranges)
+        if path:
+            cached = await loop.run_in_executor(None, hash_cache.lookup,
+                                                path, key)
+            if cached is not None and cached[1] == part_size:
+                part_sha1s = cached[2]
+        if file_id is None:
+            file_id = await self._start_large_file(file_name,
+                                                   mime_content_type,
+                                                   file_info)
+
+        known = list(part_sha1s or [None] * len(part_ranges))
+        store_lock = asyncio.Lock()
+
+        async def cache_part(part_number, sha):
+            # Stores are serialized so an older list never overwrites a newer
+            # one.
+            known[part_number - 1] = sha
+            async with store_lock:
+                snapshot = list(known)
+                await loop.run_in_executor(None, lambda: hash_cache.store(
+                    path, key, part_size=part_size, part_sha1s=snapshot))
+
+        sha_list = await self._upload_large_file_parts(
+            file_id, contents, enumerate(part_ranges, 1), concurrency,
+            uploaded=uploaded, part_sha1s=part_sha1s,
+            progress_listener=progress_listener,
+            part_done=cache_part if path else None)
+        response = await self._finish_large_file(file_id, sha_list)
 
         return B2File(self, response)
 
-    async def _start_large_upload(self, file_name, mime_content_type):
+    async def _start_large_file(self, file_name, mime_content_type,
+                                file_info=None):
         """ b2_start_large_file """
+        params = {
+            'bucketId': self.id,
+            'fileName': file_name,
+            'contentType': mime_content_type or 'b2/x-auto'
+        }
+        if file_info:
+            params['fileInfo'] = {key: str(value)
+                                  for key, value in file_info.items()}
         # Start the request
         large_file_response = await self.connector.post(
             path=API.upload_large,
-            params={
-                'bucketId': self.id,
-                'fileName': b2_url_encode(file_name),
-                'contentType': mime_content_type or 'b2/x-auto'
-            })
+            params=params)
         return large_file_response.get('fileId', None)
 
-    async def _upload_large_file_parts(self, file_id):
-        """ b2_upload_part """
-        async def upload_part_async(chunk, part_number):
-            json = await self._upload(
-                endpoint=API.uppload_url,
-                handler=self.connector.upload_part,
-                contents=chunk,
-                part_number=part_number,
-                content_length=content_length)
-            return json.get('contentSha1', None)
-
-        def file_io_thread(loop):
-            futures = []
-            iterator = _chunk_files(contents.name, content_length)
-            for idx, chunk in enumerate(iterator):
-                futures.append(asyncio.run_coroutine_threadsafe(
-                    upload_part_async(chunk, idx),
-                    loop))
-            return [future.result() for future in futures]
+    async def list_unfinished_large_files(self, prefix=None):
+        """ List large files that have been started but not finished or
+        canceled, as the raw JSON returned by B2.
 
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, file_io_thread, loop)
+        Calls: b2_list_unfinished_large_files
+        """
+        params = {'bucketId': self.id, 'maxFileCount': 100}
+        if prefix is not None:
+            params['namePrefix'] = prefix
+
+        async for response in self.connector.paginate(
+                API.list_unfinished_large_files, params,
+                {'startFileId': 'nextFileId'}):
+            for file_json in response['files']:
+                yield file_json
+
+    async def cancel_large_file(self, file_id):
+        """ Cancel an unfinished large file and delete its uploaded parts.
+
+        Calls: b2_cancel_large_file
+        """
+        return await self.connector.post(
+            path=API.upload_large_cancel,
+            params={'fileId': file_id})
+
+    async def _list_parts(self, file_id):
+        """ b2_list_parts """
+        params = {'fileId': file_id, 'maxPartCount': 1000}
+
+        async for response in self.connector.paginate(
+                API.list_parts, params,
+                {'startPartNumber': 'nextPartNumber'}):
+            for part_json in response['parts']:
+                yield part_json
+
+    async def _find_unfinished_large_file(self, file_name, part_ranges):
+        """ Find the most recent unfinished large file named `file_name`
+        whose stored parts match `part_ranges`.
+
+        Returns the file ID (or None) and a dict of part number to
+        (content length, SHA1) for the parts already stored.
+        """
+        candidates = []
+        async for file_json in self.list_unfinished_large_files(
+                prefix=file_name):
+            if file_json['fileName'] == file_name:
+                candidates.append(file_json)
+        candidates.sort(key=lambda f: f['uploadTimestamp'], reverse=True)
+
+        for file_json in candidates:
+            uploaded = {}
+            async for part in self._list_parts(file_json['fileId']):
+                uploaded[part['partNumber']] = (part['contentLength'],
+                                                part['contentSha1'])
+            fits = all(1 <= number <= len(part_ranges) and
+                       length == part_ranges[number - 1][1]
+                       for number, (length, _) in uploaded.items())
+            if fits:
+                return file_json['fileId'], uploaded
+        return None, {}
+
+    async def _upload_large_file_parts(self, file_id, contents, parts,
+                                       concurrency, uploaded=None,
+                                       part_sha1s=None,
+                                       progress_listener=None,
+                                       part_done=None):
+        """ b2_upload_part
+
+        Uploads `parts`, an iterable of (part_number, (offset, size)), and
+        returns the part SHA1s ordered by part number. Parts listed in
+        `uploaded` are skipped if their SHA1 matches the local data, as given
+        by `part_sha1s` (None for unknown parts) or else hashed by the
+        connector's HashingPool (by path, without reading the part here, when
+        `contents` is a file on disk). `part_done`, if given, is awaited with
+        the part number and SHA1 of every part once it is stored.
+
+        Parts of a file on disk are also hashed by path before they are sent
+        when the HashingPool has processes, and SHA1s known up front are sent
+        in the part's header instead of being computed while sending.
+        """
+        uploaded = uploaded or {}
+        sha_by_part = {}
+        reader = open_part_reader(contents)
+        hashing = self.connector.hashing
+        path = local_path(contents)
+        part_progress = {}
+
+        def part_listener(part_number):
+            if progress_listener is None:
+                return None
+
+            def listener(bytes_completed):
+                part_progress[part_number] = bytes_completed
+                progress_listener(sum(part_progress.values()))
+            return listener
+
+        def skip_part(part_number, size):
+            listener = part_listener(part_number)
+            if listener is not None:
+                listener(size)
+
+        async def upload_part(part):
+            part_number, (offset, size) = part
+            sha = None
+            if part_sha1s:
+                sha = part_sha1s[part_number - 1]
+            if sha is None and path and (part_number in uploaded or
+                                         hashing.processes):
+                sha = await hashing.hash_range(path, offset, size)
+            if sha is not None and uploaded.get(part_number) == (size, sha):
+                sha_by_part[part_number] = sha
+                return skip_part(part_number, size)
+            chunk = await reader.read(offset, size)
+            try:
+                if sha is None and part_number in uploaded:
+                    sha = await hashing.digest([chunk])
+                    if uploaded[part_number] == (size, sha):
+                        sha_by_part[part_number] = sha
+                        return skip_part(part_number, size)
+                # A SHA1 known up front goes in the header, and the part is
+                # sent without hashing it again.
+                json = await self.connector.upload_part(
+                    file_id, chunk, part_number, content_sha1=sha,
+                    progress_listener=part_listener(part_number))
+                sha_by_part[part_number] = json.get('contentSha1', None)
+            finally:
+                if isinstance(chunk, memoryview):
+                    chunk.release()
+
+        async def handle_part(part):
+            await upload_part(part)
+            part_number = part[0]
+            if part_done is not None:
+                await part_done(part_number, sha_by_part[part_number])
+
+        handle_part, workers = self._limit_concurrency(handle_part,
+                                                       concurrency)
+        # Reserve one upload part URL per worker.
+        self.connector.part_upload_pool(file_id, size=workers)
+        try:
+            await run_workers(parts, handle_part, workers)
+        finally:
+            reader.close()
+            self.connector.close_upload_pool(file_id)
+        return [sha_by_part[number] for number in sorted(sha_by_part)]
+
+    def _limit_concurrency(self, handler, concurrency):
+        """ The handler and worker count for run_workers with a fixed
+        `concurrency` or an AdaptiveLimiter, which also backs off on the 429
+        and 503 responses the connector sees.
+        """
+        return limit_concurrency(
+            handler, concurrency,
+            congestion=lambda: self.connector.congestion_count)
 
     async def _finish_large_file(self, file_id, sha_list):
         """ b2_finish_large_file """
@@ -0,0 +1,181 @@
+from aiob2.exceptions import B2ServiceUnavailableError, B2TooManyRequestsError
+from collections import deque
+import asyncio
+import time
+
+
+# Failures that mean B2 (or the network) wants less traffic.
+BACKOFF_ERRORS = (
+    B2TooManyRequestsError,
+    B2ServiceUnavailableError,
+    asyncio.TimeoutError,
+)
+
+# Number of recent latencies the baseline is taken from, and the number
+# needed before latency spikes are acted on.
+LATENCY_SAMPLES = 50
+MIN_LATENCY_SAMPLES = 5
+
+
+class AdaptiveLimiter():
+    """ An AIMD (additive increase, multiplicative decrease) concurrency
+    limit.
+
+    Operations run in `slot()`s, at most `limit` at a time. After every
+    window of `limit` completed operations, the limit grows by `increase` if
+    the throughput (operations per second) did not drop compared to the
+    previous window. It is multiplied by `decrease` when an operation fails
+    with one of BACKOFF_ERRORS, when B2 reported congestion (429 or 503)
+    while it ran, or when its latency exceeds `latency_factor` times the
+    median recent latency. Only one decrease happens per round trip: signals
+    from operations started before the last decrease are ignored.
+
+    The limit always stays between `minimum` and `maximum`. `listener`, if
+    given, is called with the new limit whenever it changes.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=64, increase=1,
+                 decrease=0.5, latency_factor=3.0, listener=None):
+        """
+        Parameters:
+            initial:        (int) Starting limit
+            minimum:        (int) Lowest limit
+            maximum:        (int) Highest limit
+            increase:       (int) Added to the limit per improving window
+            decrease:       (float) Limit multiplier on congestion
+            latency_factor: (float) Latency, relative to the median recent
+                            latency, that counts as congestion
+            listener:       (callable) Called with the new limit
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.listener = listener
+        self.in_flight = 0
+        self.increases = 0
+        self.decreases = 0
+        self.throughput = None
+        self._limit = float(min(max(initial, minimum), maximum))
+        self._condition = None
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._last_decrease = 0.0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    @property
+    def limit(self):
+        """ The current number of operations allowed at once. """
+        return int(self._limit)
+
+    def slot(self, congestion=None):
+        """ Run an operation in an `async with` block once the limit allows.
+
+        `congestion` is an optional callable returning a count of congestion
+        responses seen (such as B2Connector.congestion_count); if it grows
+        while the operation runs, the limit is decreased.
+        """
+        return _Slot(self, congestion)
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'increases': self.increases,
+            'decreases': self.decreases,
+            'throughput': self.throughput,
+        }
+
+    async def _acquire(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            while self.in_flight >= self.limit:
+                await self._condition.wait()
+            self.in_flight += 1
+
+    async def _release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def _completed(self, started, congested):
+        now = time.monotonic()
+        latency = now - started
+        baseline = None
+        if len(self._latencies) >= MIN_LATENCY_SAMPLES:
+            baseline = sorted(self._latencies)[len(self._latencies) // 2]
+        self._latencies.append(latency)
+        if congested or (baseline is not None and
+                         latency > baseline * self.latency_factor):
+            self._back_off(started)
+            return
+
+        self._window_count += 1
+        if self._window_count < self.limit:
+            return
+        throughput = self._window_count / max(now - self._window_start, 1e-9)
+        if self.throughput is None or throughput >= self.throughput:
+            self._set_limit(self._limit + self.increase)
+            self.increases += 1
+        self.throughput = throughput
+        self._window_start, self._window_count = now, 0
+
+    def _back_off(self, started):
+        if started < self._last_decrease:
+            return
+        self._last_decrease = time.monotonic()
+        self.decreases += 1
+        self._set_limit(self._limit * self.decrease)
+        self._window_start, self._window_count = self._last_decrease, 0
+        self.throughput = None
+
+    def _set_limit(self, limit):
+        previous = self.limit
+        self._limit = float(min(max(limit, self.minimum), self.maximum))
+        if self.limit != previous and self.listener is not None:
+            self.listener(self.limit)
+
+
+class _Slot():
+
+    def __init__(self, limiter, congestion):
+        self.limiter = limiter
+        self.congestion = congestion
+        self.started = None
+        self.congestion_at_start = None
+
+    async def __aenter__(self):
+        await self.limiter._acquire()
+        self.started = time.monotonic()
+        if self.congestion is not None:
+            self.congestion_at_start = self.congestion()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        congested = (self.congestion is not None and
+                     self.congestion() > self.congestion_at_start)
+        if exc_type is None:
+            self.limiter._completed(self.started, congested)
+        elif congested or issubclass(exc_type, BACKOFF_ERRORS):
+            self.limiter._back_off(self.started)
+        await self.limiter._release()
+        return False
+
+
+def limit_concurrency(handler, concurrency, congestion=None):
+    """ Returns `handler` and the number of workers to run it with.
+
+    `concurrency` is either a fixed number of workers, or an AdaptiveLimiter,
+    in which case the handler is wrapped to run in the limiter's slots and
+    `maximum` workers are started.
+    """
+    if not isinstance(concurrency, AdaptiveLimiter):
+        return handler, concurrency
+
+    async def limited(item):
+        async with concurrency.slot(congestion):
+            return await handler(item)
+
+    return limited, concurrency.maximum
@@ -2,14 +2,37 @@ from aiob2.api import BASE_URL, API_VERSION, API
 from aiob2.exceptions import B2AuthorizationError
 from aiob2.exceptions import B2Exception
 from aiob2.exceptions import B2InvalidRequestType
-from aiob2.utilities import StreamWithHashProgress
-from aiob2.utilities import get_content_length
+from aiob2.exceptions import B2ServiceUnavailableError
+from aiob2.exceptions import B2TooManyRequestsError
+from aiob2.exceptions import B2UnauthorizedError
+from aiob2.hashing import HashingPool
+from aiob2.pool import DEFAULT_POOL_SIZE, UploadUrlPool
+from aiob2.retry import RetryPolicy
+from aiob2.throttle import Throttle, endpoint_class
+from aiob2.utilities import DEFAULT_CHUNK_SIZE, StreamWithHashProgress
+from aiob2.utilities import get_content_length, local_path
 from aiob2.utilities import url_encode
+from collections import Counter
 from hashlib import sha1
-from io import BytesIO
 import aiohttp
+import asyncio
 import datetime
+import mmap
 import sys
+import time
+
+
+# Authorization tokens are valid for 24 hours; refresh them well before that.
+AUTH_REFRESH_AFTER = datetime.timedelta(hours=23)
+# Delay before retrying a background refresh that failed.
+AUTH_REFRESH_RETRY = datetime.timedelta(minutes=1)
+# 401 codes that mean the token has to be replaced.
+EXPIRED_TOKEN_CODES = ('bad_auth_token', 'expired_auth_token')
+
+# Upload SHA1 modes besides a known hex SHA1. By default the SHA1 is computed
+# while sending and appended to the body ('hex_digits_at_end').
+DO_NOT_VERIFY = 'do_not_verify'
+PRECOMPUTE_SHA1 = 'precompute'
 
 
 async def get_json(response):
@@ -18,18 +41,47 @@ async def get_json(response):
     return await response.json()
 
 
+async def check_download(response):
+    """ Raise the matching B2Exception unless a download response (full or
+    partial content) succeeded.
+    """
+    if response.status not in (200, 206):
+        raise await B2Exception.parse(response)
+    return response
+
+
 class B2Connector():
     """
 
     """
 
-    def __init__(self, session):
+    def __init__(self, session, upload_pool_size=DEFAULT_POOL_SIZE,
+                 retry_policy=None, auth_cache=None, upload_session=None,
+                 download_session=None, hashing=None,
+                 upload_chunk_size=DEFAULT_CHUNK_SIZE, throttle=None):
         """
 
-        :param key_id:
-        :param application_key:
+        :param session: Session used for API calls.
+        :param upload_pool_size: Number of idle upload URLs kept per bucket
+            or large file.
+        :param retry_policy: RetryPolicy for temporary failures. Defaults to
+            RetryPolicy().
+        :param auth_cache: Optional AuthCache to share authorization tokens
+            with other processes.
+        :param upload_session: Session used for uploads. Defaults to
+            `session`.
+        :param download_session: Session used for downloads. Defaults to
+            `session`.
+        :param hashing: HashingPool that hashes upload bodies. Defaults to
+            HashingPool().
+        :param upload_chunk_size: Bytes read from a file and sent at a time
+            when uploading.
+        :param throttle: Throttle limiting request rates and bandwidth.
+            Defaults to Throttle(), which has no limits.
         """
-        self.api_session = session
+        self.session = session
+        self.upload_session = upload_session or session
+        self.download_session = download_session or session
         self.key_id = None
         self.application_key = None
         self.account_id = None
@@ -38,6 +90,20 @@ class B2Connector():
         self.api_url = None
         self.download_url = None
         self.recommended_part_size = None
+        self.upload_pool_size = upload_pool_size
+        self._upload_pools = {}
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.hashing = hashing or HashingPool()
+        self.upload_chunk_size = upload_chunk_size
+        self.throttle = throttle or Throttle()
+        # Retries per operation (API path, 'upload_file', 'upload_part', ...)
+        self.retry_counts = Counter()
+        # 429 and 503 responses seen, for adaptive concurrency limits.
+        self.congestion_count = 0
+        self.auth_refresh_after = AUTH_REFRESH_AFTER
+        self.auth_cache = auth_cache
+        self._auth_lock = None
+        self._refresh_task = None
         #TODO:  Part Size
 
     async def is_authorized(self):
@@ -48,117 +114,529 @@ class B2Connector():
         if self.auth_token is None:
             return False
         time_authorized = datetime.datetime.utcnow() - self.authorized_at
-        if time_authorized > datetime.timedelta(hours=23):
-            await self._authorize()
+        if time_authorized > self.auth_refresh_after:
+            await self.reauthorize(stale_token=self.auth_token)
         return True
 
-    async def _authorize(self, key_id, application_key):
-        self.key_id = None
-        self.application_key = None
+    async def reauthorize(self, stale_token=None):
+        """ Get a new authorization token with the stored keys.
+
+        Only one b2_authorize_account call runs at a time. Callers that pass
+        the `stale_token` they failed with return as soon as another caller
+        has already replaced it, so any number of concurrent failures lead to
+        a single re-authorization.
+        """
+        if self._auth_lock is None:
+            self._auth_lock = asyncio.Lock()
+        async with self._auth_lock:
+            if stale_token is not None and self.auth_token != stale_token:
+                return
+            await self._authorize(self.key_id, self.application_key,
+                                  stale_token=self.auth_token)
+
+    def close(self):
+        """ Stop the background token refresh. """
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
 
+    def _schedule_refresh(self, delay):
+        self.close()
+        self._refresh_task = asyncio.ensure_future(self._refresh(delay))
+
+    async def _refresh(self, delay):
+        await asyncio.sleep(delay.total_seconds())
+        # Detach first so that the refresh does not cancel itself when it
+        # schedules the next one.
+        self._refresh_task = None
+        try:
+            await self.reauthorize(stale_token=self.auth_token)
+        except Exception:
+            # The current token is still valid for a while; try again soon.
+            self._schedule_refresh(AUTH_REFRESH_RETRY)
+
+    async def _authorize(self, key_id, application_key, stale_token=None):
+        self.key_id = key_id
+        self.application_key = application_key
+
+        if self.auth_cache is None:
+            self._set_authorization(await self._authorize_account(),
+                                    datetime.datetime.utcnow())
+            return
+
+        # Hold the cache lock across the network call so processes starting
+        # together share one b2_authorize_account call.
+        loop = asyncio.get_running_loop()
+        cache = self.auth_cache
+        async with cache.lock():
+            response_json, authorized_at = await loop.run_in_executor(
+                None, cache.load, key_id, application_key)
+            if response_json is not None:
+                authorized_at = datetime.datetime.utcfromtimestamp(
+                    authorized_at)
+                age = datetime.datetime.utcnow() - authorized_at
+                if age < self.auth_refresh_after and \
+                        response_json['authorizationToken'] != stale_token:
+                    self._set_authorization(response_json, authorized_at)
+                    return
+            response_json = await self._authorize_account()
+            await loop.run_in_executor(None, cache.store, key_id,
+                                       application_key, response_json)
+            self._set_authorization(response_json,
+                                    datetime.datetime.utcnow())
+
+    async def _authorize_account(self):
+        """ b2_authorize_account """
         path = BASE_URL + API.authorize
 
         auth = aiohttp.BasicAuth(self.key_id, self.application_key)
         async with self.session.get(path, auth=auth) as response:
-            response_json = await get_json(response)
-        self.authorized_at = datetime.datetime.utcnow()
+            return await get_json(response)
+
+    def _set_authorization(self, response_json, authorized_at):
+        self.authorized_at = authorized_at
         self.account_id = response_json['accountId']
         self.auth_token = response_json['authorizationToken']
         self.api_url = response_json['apiUrl'] + API_VERSION
         self.download_url = response_json['downloadUrl'] + \
             API_VERSION + API.download_file_by_id
         self.recommended_part_size = response_json['recommendedPartSize']
+        age = datetime.datetime.utcnow() - authorized_at
+        self._schedule_refresh(
+            max(self.auth_refresh_after - age, datetime.timedelta(0)))
+
+    async def retry(self, name, func, retry=True):
+        """ Await `func()` under the retry policy, counting every retry
+        under `name` in `retry_counts`.
+
+        A 429 response also makes the throttle lower the request rate of the
+        endpoint class `name` belongs to, once per round trip. 429 and 503
+        responses are counted in `congestion_count`.
+        """
+        async def attempt():
+            started = time.monotonic()
+            try:
+                return await func()
+            except B2TooManyRequestsError:
+                self.congestion_count += 1
+                self.throttle.back_off(endpoint_class(name), started)
+                raise
+            except B2ServiceUnavailableError:
+                self.congestion_count += 1
+                raise
+
+        if not retry:
+            return await attempt()
 
-    async def get(self, path, headers={}):
-        if not self.authorized:
+        def count_retry(error, attempt, delay):
+            self.retry_counts[name] += 1
+
+        return await self.retry_policy.call(attempt, on_retry=count_retry)
+
+    async def _authorized(self, request):
+        """ Await `request(token)` with the current authorization token.
+
+        If B2 rejects the token as bad or expired, the connector is
+        re-authorized (once, however many requests fail at the same time) and
+        the request is replayed with the new token.
+        """
+        token = self.auth_token
+        try:
+            return await request(token)
+        except B2UnauthorizedError as error:
+            if error.code not in EXPIRED_TOKEN_CODES:
+                raise
+        await self.reauthorize(stale_token=token)
+        return await request(self.auth_token)
+
+    async def get(self, path, headers=None):
+        if self.auth_token is None:
             raise B2AuthorizationError('Not authorized.')
         url = self.api_url + path
-        headers.update({'Authorization': self.auth_token})
-        async with self.session.get(url, headers=headers) as response:
-            return await get_json(response)
 
-    async def put(self, path, headers={}, params={},
-                  account_id_required=False):
-        if not self.authorized:
+        async def request(token):
+            await self.throttle.request('api')
+            request_headers = dict(headers or {})
+            request_headers.update({'Authorization': token})
+            async with self.session.get(url,
+                                        headers=request_headers) as response:
+                return await get_json(response)
+
+        return await self.retry(path, lambda: self._authorized(request))
+
+    async def post(self, path, params=None, headers=None,
+                   account_id_required=False):
+        if self.auth_token is None:
             raise B2AuthorizationError('Not authorized.')
         url = self.api_url + path
-        headers.update({'Authorization': self.auth_token})
+        params = dict(params or {})
         if account_id_required:
             params.update({'accountId': self.account_id})
-        headers.update({'Content-Type': 'application/json'})
-        async with self.session.post(url, json=params, headers=headers) as response:
-            return await get_json(response)
 
-    async def upload_file(self, file_contents,
+        async def request(token):
+            await self.throttle.request('api')
+            request_headers = dict(headers or {})
+            request_headers.update({'Authorization': token,
+                                    'Content-Type': 'application/json'})
+            async with self.session.post(url, json=params,
+                                         headers=request_headers) as response:
+                return await get_json(response)
+
+        return await self.retry(path, lambda: self._authorized(request))
+
+    async def paginate(self, path, params, cursors, prefetch=1):
+        """ Yield every response page of a paged B2 list call.
+
+        `cursors` maps each request parameter to the response field holding
+        its next value, e.g. {'startFileName': 'nextFileName'}; the first
+        entry decides when the listing is done. Up to `prefetch` pages are
+        requested in the background while the caller works through the
+        current one.
+        """
+        params = dict(params)
+        cursors = list(cursors.items())
+
+        async def fetch_pages():
+            while True:
+                response = await self.post(path, params)
+                yield response
+                if response.get(cursors[0][1]) is None:
+                    return
+                for param, field in cursors:
+                    params[param] = response.get(field)
+
+        if not prefetch:
+            async for response in fetch_pages():
+                yield response
+            return
+
+        queue = asyncio.Queue(maxsize=prefetch)
+
+        async def read_ahead():
+            try:
+                async for response in fetch_pages():
+                    await queue.put((response, None))
+            except Exception as error:
+                await queue.put((None, error))
+            else:
+                await queue.put((None, None))
+
+        task = asyncio.ensure_future(read_ahead())
+        try:
+            while True:
+                response, error = await queue.get()
+                if error is not None:
+                    raise error
+                if response is None:
+                    break
+                yield response
+        finally:
+            task.cancel()
+
+    def upload_pool(self, key, fetch, size=None):
+        """ Get the upload URL pool for a bucket or large file ID. """
+        size = max(size or 0, self.upload_pool_size)
+        pool = self._upload_pools.get(key)
+        if pool is None:
+            pool = UploadUrlPool(fetch, size=size)
+            self._upload_pools[key] = pool
+        pool.size = max(pool.size, size)
+        return pool
+
+    def bucket_upload_pool(self, bucket_id, size=None):
+        """ Get the upload URL pool for a bucket.
+
+        Passing `size` makes room for at least that many concurrent uploads.
+        """
+        return self.upload_pool(bucket_id,
+                                lambda: self._upload_url(bucket_id),
+                                size=size)
+
+    def part_upload_pool(self, file_id, size=None):
+        """ Get the upload part URL pool for a large file.
+
+        Passing `size` makes room for at least that many concurrent part
+        uploads, each holding its own upload part URL.
+        """
+        return self.upload_pool(file_id,
+                                lambda: self._upload_part_url(file_id),
+                                size=size)
+
+    def close_upload_pool(self, key):
+        """ Forget the pooled upload URLs for a bucket or large file ID. """
+        self._upload_pools.pop(key, None)
+
+    def upload_pool_stats(self):
+        """ Hit/miss counters for every live upload URL pool. """
+        return {key: pool.stats() for key, pool in self._upload_pools.items()}
+
+    async def upload_file(self, bucket_id, file_contents,
                           file_name,
                           mime_content_type=None,
-                          content_length=None):
+                          content_length=None,
+                          file_info=None,
+                          content_sha1=None,
+                          progress_listener=None):
+        """ b2_upload_file
+
+        Without `content_sha1` the data is hashed as it is sent and the SHA1
+        is appended to the body. With a hex SHA1 (or DO_NOT_VERIFY) in
+        `content_sha1`, it is sent in the header instead and the data is sent
+        as it is, mapped into memory if it is a file. PRECOMPUTE_SHA1 hashes
+        the data first (see precompute_sha1).
+
+        `progress_listener` is called with the number of bytes sent so far
+        (see StreamWithHashProgress for how often).
+        """
+        if content_sha1 == PRECOMPUTE_SHA1:
+            content_sha1 = await self.precompute_sha1(file_contents,
+                                                      content_length)
         if hasattr(file_contents, 'read'):
             content_length = content_length or get_content_length(
                 file_contents)
         else:
             content_length = content_length or len(file_contents)
+        body_length = content_length
+        if content_sha1 is None:
+            body_length += sha1().digest_size * 2
 
-        hasher, stream = self._create_hasher_stream(file_contents)
-        content_length += hasher.digest_size
+        # A retry has to send the stream again from where it started.
+        rewind = _rewinder(file_contents)
+        pool = self.bucket_upload_pool(bucket_id)
 
-        upload_url, token = await self._upload_url()
+        async def upload():
+            if rewind is not None:
+                rewind()
+            body = self._create_body(file_contents, content_length,
+                                     content_sha1, progress_listener)
+            await self.throttle.request('upload')
+            async with pool.checkout() as (upload_url, token):
+                headers = {
+                    'Content-Type': mime_content_type or 'b2/x-auto',
+                    'Content-Length': str(body_length),
+                    'X-Bz-Content-Sha1': content_sha1 or 'hex_digits_at_end',
+                    'X-Bz-File-Name': url_encode(file_name),
+                    'Authorization': token
+                }
+                for key, value in (file_info or {}).items():
+                    headers['X-Bz-Info-' + key] = url_encode(str(value))
 
-        headers = {
-            'Content-Type': mime_content_type or 'b2/x-auto',
-            'Content-Length': str(content_length),
-            'X-Bz-Content-Sha1': 'hex_digits_at_end',
-            'X-Bz-File-Name': url_encode(file_name),
-            'Authorization': token
-        }
+                async with self.upload_session.post(
+                        upload_url, headers=headers,
+                        data=body) as response:
+                    return await get_json(response)
 
-        async with self.session.post(upload_url, headers=headers,
-                                     data=stream) as response:
-            return await get_json(response)
+        return await self.retry('upload_file',
+                                lambda: _replay_expired_upload(upload,
+                                                               rewind),
+                                retry=rewind is not None)
 
-    async def upload_part(self, file_contents, part_number):
-        hasher, stream = self._create_hasher_stream(file_contents)
-        content_length = len(file_contents) + hasher.digest_size * 2
+    async def upload_part(self, file_id, file_contents, part_number,
+                          content_sha1=None, progress_listener=None):
+        """ b2_upload_part
 
-        upload_url, token = await self._upload_url()
+        `file_contents` is a bytes-like object. A known hex SHA1 of it can be
+        passed in `content_sha1` (or PRECOMPUTE_SHA1 to hash it first) to send
+        it in the header with a plain body, instead of hashing while sending.
+        """
+        if content_sha1 == PRECOMPUTE_SHA1:
+            content_sha1 = await self.precompute_sha1(file_contents)
+        part_length = content_length = len(file_contents)
+        if content_sha1 is None:
+            content_length += sha1().digest_size * 2
+        pool = self.part_upload_pool(file_id)
 
-        headers = {
-            'Content-Length': str(content_length),
-            'X-Bz-Content-Sha1': 'hex_digits_at_end',
-            'X-Bz-Part-Number': str(part_number),
-            'Authorization': token
-        }
+        async def upload():
+            body = self._create_body(file_contents, part_length,
+                                     content_sha1, progress_listener)
+            await self.throttle.request('upload')
+            async with pool.checkout() as (upload_url, token):
+                headers = {
+                    'Content-Length': str(content_length),
+                    'X-Bz-Content-Sha1': content_sha1 or 'hex_digits_at_end',
+                    'X-Bz-Part-Number': str(part_number),
+                    'Authorization': token
+                }
 
-        async with self.session.post(upload_url, headers=headers,
-                                     data=stream) as response:
-            return await get_json(response)
+                async with self.upload_session.post(
+                        upload_url, headers=headers,
+                        data=body) as response:
+                    return await get_json(response)
+
+        return await self.retry('upload_part',
+                                lambda: _replay_expired_upload(
+                                    upload, _rewinder(file_contents)))
+
+    async def precompute_sha1(self, file_contents, content_length=None):
+        """ Returns the hex SHA1 of the data an upload of `file_contents`
+        sends, hashed on the HashingPool before anything is sent.
+
+        Files on disk are hashed by path from their current position (for
+        `content_length` bytes, or to the end); other file-like objects are
+        read to the end and seeked back.
+
+        Raises:
+            ValueError if `file_contents` is a stream that cannot seek.
+        """
+        if not hasattr(file_contents, 'read'):
+            return await self.hashing.digest([file_contents])
+        path = local_path(file_contents)
+        if path:
+            return await self.hashing.hash_range(path, file_contents.tell(),
+                                                 content_length)
+        if hasattr(file_contents, 'seekable') and \
+                not file_contents.seekable():
+            raise ValueError('The SHA1 of a stream that cannot seek cannot '
+                             'be computed before it is sent')
+        return await self.hashing.hash_contents(file_contents)
+
+    def download_file(self, file_id, byte_range=None):
+        """ b2_download_file_by_id
+
+        `byte_range` is an inclusive (start, end) pair sent as an HTTP Range
+        header; `end` may be None to read to the end of the file.
+
+        Returns an async context manager for the response. A response that
+        rejects the token as bad or expired is not returned: the connector is
+        re-authorized as for API calls and the download sent again.
+        """
+        headers = {}
+        if byte_range is not None:
+            start, end = byte_range
+            headers['Range'] = 'bytes={}-{}'.format(
+                start, '' if end is None else end)
 
-    def download_file(self, file_id):
-        headers = {'Authorization': self.auth_token}
-        return self.session.get(self.download_url,
-                                headers=headers,
-                                params={'fileId': file_id})
+        def make_request(token):
+            return self.download_session.get(
+                self.download_url, headers=dict(headers, Authorization=token),
+                params={'fileId': file_id})
 
-    async def _upload_url(self):
+        return _DownloadRequest(self, make_request)
+
+    async def iter_download(self, response, chunk_size):
+        """ Yield the body of a download response in chunks of at most
+        `chunk_size` bytes, within the download bandwidth limit.
+        """
+        async for chunk in response.content.iter_chunked(chunk_size):
+            await self.throttle.transfer('download', len(chunk))
+            yield chunk
+
+    async def _upload_url(self, bucket_id):
+        """ b2_get_upload_url """
         response = await self.post(path=API.upload_url,
-                                   params={'bucketId': self.id})
+                                   params={'bucketId': bucket_id})
         return (response.get('uploadUrl', None),
                 response.get('authorizationToken', None))
 
-    def _create_hasher_stream(self, file_contents):
-        if not hasattr(file_contents, 'read'):
-            file_contents = BytesIO(file_cotents)
+    async def _upload_part_url(self, file_id):
+        """ b2_get_upload_part_url """
+        response = await self.post(path=API.upload_large_part,
+                                   params={'fileId': file_id})
+        return (response.get('uploadUrl', None),
+                response.get('authorizationToken', None))
+
+    def _create_body(self, file_contents, content_length, content_sha1,
+                     progress_listener=None):
+        """ The body of an upload of `content_length` bytes.
+
+        Without `content_sha1`, the data is hashed as it is sent and its SHA1
+        follows it. Otherwise buffers are sent as they are and files are
+        mapped into memory, unless progress has to be reported or bandwidth
+        limited; streams that cannot be mapped are read in chunks.
+        """
+        bandwidth = None
+        if self.throttle.limits_bandwidth('upload'):
+            bandwidth = self.throttle.bandwidth['upload']
+        if content_sha1 is None:
+            return StreamWithHashProgress(
+                file_contents, content_length,
+                chunk_size=self.upload_chunk_size,
+                progress_listener=progress_listener,
+                hashing=self.hashing, bandwidth=bandwidth)
+        body = _map_file(file_contents, content_length)
+        if body is None or progress_listener or bandwidth:
+            return StreamWithHashProgress(
+                file_contents if body is None else body, content_length,
+                chunk_size=self.upload_chunk_size, hash_at_end=False,
+                progress_listener=progress_listener, bandwidth=bandwidth)
+        return body
+
+
+class _DownloadRequest():
+    """ Enters the download request built by `make_request(token)` once the
+    throttle allows, through B2Connector._authorized so that an expired
+    token is replaced and the request sent again.
+    """
+
+    def __init__(self, connector, make_request):
+        self.connector = connector
+        self.make_request = make_request
+        self.request = None
+
+    async def __aenter__(self):
+        return await self.connector._authorized(self._send)
 
-        hasher = sha1()
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return await self.request.__aexit__(exc_type, exc_val, exc_tb)
 
-        def update_block(block):
-            hasher.update(block)
+    async def _send(self, token):
+        await self.connector.throttle.request('download')
+        request = self.make_request(token)
+        response = await request.__aenter__()
+        if response.status == 401:
+            error = await B2Exception.parse(response)
+            if error.code in EXPIRED_TOKEN_CODES:
+                await request.__aexit__(None, None, None)
+                raise error
+        self.request = request
+        return response
 
-        async def data_stream():
-            loop = asyncio.get_running_loop()
-            for chunk in iter(lambda: file_contents.read(1024 ** 2), b''):
-                await loop.run_in_executor(None, update_hash, chunk)
-                yield chunk
-            yield hasher.hexdigest().encode()
 
-        return hasher, data_stream()
+async def _replay_expired_upload(upload, rewind):
+    """ Await `upload()`, replaying it once if the upload URL's token has
+    expired. The upload URL pool has dropped that URL by then, so the replay
+    gets a fresh one.
+
+    `rewind` (see _rewinder) puts the data back where the first attempt
+    started; if it is None the data cannot be sent again and the error is
+    raised instead.
+    """
+    try:
+        return await upload()
+    except B2UnauthorizedError as error:
+        if error.code not in EXPIRED_TOKEN_CODES or rewind is None:
+            raise
+    rewind()
+    return await upload()
+
+
+def _rewinder(file_contents):
+    """ Returns a function that seeks `file_contents` back to its current
+    position, a no-op for in-memory buffers, or None if the stream cannot be
+    rewound.
+    """
+    if not hasattr(file_contents, 'read'):
+        return lambda: None
+    try:
+        position = file_contents.tell()
+        if hasattr(file_contents, 'seekable') and \
+                not file_contents.seekable():
+            return None
+    except (AttributeError, OSError):
+        return None
+    return lambda: file_contents.seek(position)
+
+
+def _map_file(file_contents, content_length):
+    """ Returns a buffer over `content_length` bytes of `file_contents` from
+    its current position, memory-mapped if it is a file, or None if it is a
+    stream that cannot be mapped.
+    """
+    if not hasattr(file_contents, 'read'):
+        return file_contents
+    try:
+        position = file_contents.tell()
+        mapped = mmap.mmap(file_contents.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):
+        return None
+    return memoryview(mapped)[position:position + content_length]
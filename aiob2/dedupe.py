@@ -0,0 +1,114 @@
+from aiob2.api import API
+from aiob2.exceptions import B2Exception
+import asyncio
+import os
+import sqlite3
+import threading
+
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'aiob2',
+                            'dedupe.sqlite')
+
+DEFAULT_MANIFEST_PREFIX = '.aiob2-dedupe/'
+
+
+class DedupeIndex():
+    """ A local SQLite index from SHA1 to the ID of an object with that
+    content, per bucket, for B2Bucket.upload_deduplicated.
+
+    Only objects uploaded through this index are known to it, and it is only
+    shared by the processes using the same file. See ManifestIndex for an
+    index kept in the bucket itself.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS objects ('
+                ' bucket_id TEXT NOT NULL,'
+                ' sha1 TEXT NOT NULL,'
+                ' file_id TEXT NOT NULL,'
+                ' file_name TEXT NOT NULL,'
+                ' PRIMARY KEY (bucket_id, sha1))')
+
+    async def lookup(self, bucket, sha1):
+        """ Returns the ID of an object in `bucket` with this SHA1, or None.
+        """
+        row = await self._run(
+            'SELECT file_id FROM objects WHERE bucket_id = ? AND sha1 = ?',
+            (bucket.id, sha1))
+        return row and row[0]
+
+    async def record(self, bucket, sha1, file):
+        await self._run(
+            'INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?)',
+            (bucket.id, sha1, file.id, file.name))
+
+    async def forget(self, bucket, sha1):
+        await self._run(
+            'DELETE FROM objects WHERE bucket_id = ? AND sha1 = ?',
+            (bucket.id, sha1))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _execute(self, statement, parameters):
+        with self._lock, self._db:
+            return self._db.execute(statement, parameters).fetchone()
+
+    async def _run(self, statement, parameters):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._execute, statement,
+                                          parameters)
+
+
+class ManifestIndex():
+    """ An index from SHA1 to object kept in the bucket itself, for
+    B2Bucket.upload_deduplicated.
+
+    Every recorded object gets an empty manifest file named
+    `<prefix><sha1>` whose file info holds the ID and name of the object, so
+    every client uploading to the bucket shares the index. Looking up a SHA1
+    costs one b2_list_file_names call.
+    """
+
+    def __init__(self, prefix=DEFAULT_MANIFEST_PREFIX):
+        self.prefix = prefix
+
+    async def lookup(self, bucket, sha1):
+        """ Returns the ID of an object in `bucket` with this SHA1, or None.
+
+        Calls: b2_list_file_names
+        """
+        name = self.prefix + sha1
+        async for entry in bucket.list_files(start_file=name, prefix=name,
+                                             limit=1, prefetch=0,
+                                             lightweight=True):
+            if entry.name == name:
+                return entry.file_info.get('source_file_id')
+        return None
+
+    async def record(self, bucket, sha1, file):
+        """ Calls: b2_upload_file """
+        await bucket.upload_file(b'', self.prefix + sha1,
+                                 mime_content_type='text/plain',
+                                 file_info={'source_file_id': file.id,
+                                            'source_file_name': file.name})
+
+    async def forget(self, bucket, sha1):
+        """ Calls: b2_hide_file """
+        try:
+            await bucket.connector.post(
+                path=API.delete_file,
+                params={'bucketId': bucket.id,
+                        'fileName': self.prefix + sha1})
+        except B2Exception:
+            pass
@@ -1,40 +1,48 @@
 import json
 
 
-API_EXCEPTION_CODES = {
-    400: B2RequestError,
-    401: B2UnauthorizedError,
-    403: B2ForbiddenError,
-    404: B2FileNotFoundError,
-    408: B2RequestTimeoutError,
-    429: B2TooManyRequestsError,
-    500: B2InternalError,
-    503: B2ServiceUnavailableError,
-}
-
-
-class B2B2Exception(Exception):
+class B2Exception(Exception):
     """ Base exception class for the Backblaze API """
 
+    # Details of the error response, when the exception came from one.
+    status = None
+    code = None
+    retry_after = None
+
     @staticmethod
     async def parse(response):
         """ Parse the response error code and return the related error type. """
 
+        response_json = None
         try:
             response_json = await response.json()
             status = int(response_json['status'])
 
-            # Return B2B2Exception if unrecognized status code
-            ErrorClass = API_EXCEPTION_CODES.get(status, B2B2Exception)
-            return ErrorClass('{} - {}: {}'.format(status,
-                                                   response_json['code'],
-                                                   response_json['message']))
+            # Return B2Exception if unrecognized status code
+            ErrorClass = API_EXCEPTION_CODES.get(status, B2Exception)
+            error = ErrorClass('{} - {}: {}'.format(status,
+                                                    response_json['code'],
+                                                    response_json['message']))
+            error.status = status
+            error.code = response_json['code']
+            error.retry_after = _parse_retry_after(
+                response.headers.get('Retry-After'))
+            return error
         except:
             return B2Exception('error parsing response. status code - {} '
                                'Response JSON: {}'.format(response.status,
                                                           response_json))
 
 
+def _parse_retry_after(value):
+    """ Retry-After in seconds, or None if missing or not a number of seconds.
+    """
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
 class B2ApplicationKeyNotSet(B2Exception):
     """ You must set the B2_KEY_ID environment variable before running the
     application
@@ -90,6 +98,12 @@ class B2OutOfRangeError(B2Exception):
     pass
 
 
+class B2HashMismatchError(B2Exception):
+    """ The SHA1 of the transferred data does not match the one stored in B2.
+    """
+    pass
+
+
 class B2TooManyRequestsError(B2Exception):
     """ B2 may limit API requests on a per-account basis. """
     pass
@@ -126,3 +140,16 @@ class B2AuthorizationError(B2Exception):
 class B2InvalidRequestType(B2Exception):
     """ Request type must be get or post """
     pass
+
+
+API_EXCEPTION_CODES = {
+    400: B2RequestError,
+    401: B2UnauthorizedError,
+    403: B2ForbiddenError,
+    404: B2FileNotFoundError,
+    408: B2RequestTimeoutError,
+    416: B2OutOfRangeError,
+    429: B2TooManyRequestsError,
+    500: B2InternalError,
+    503: B2ServiceUnavailableError,
+}
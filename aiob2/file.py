@@ -1,6 +1,21 @@
 from aiob2.api import API
-from aiob2.exceptions import B2Exception
-from aiob2.utilities import b2_url_encode, b2_url_decode
+from aiob2.connector import check_download
+from aiob2.exceptions import B2Exception, B2HashMismatchError
+from aiob2.exceptions import B2OutOfRangeError
+from aiob2.utilities import RangeFileWriter, get_part_ranges
+from aiob2.utilities import PROGRESS_BYTES, PROGRESS_INTERVAL
+from aiob2.utilities import report_progress, run_workers
+from hashlib import sha1
+from types import MappingProxyType
+import asyncio
+import inspect
+import sys
+
+
+DEFAULT_DOWNLOAD_CONCURRENCY = 4
+DEFAULT_COPY_CONCURRENCY = 4
+DOWNLOAD_CHUNK_SIZE = 1024 ** 2
+MAX_VERSIONS_PER_LIST = 1000
 
 
 class B2File():
@@ -14,8 +29,8 @@ class B2File():
         :param parent_list:
         :param json:
         """
-        self.bucket  = bucket
-        self.connector = parent.connector
+        self.bucket = bucket
+        self.connector = bucket.connector
         self.deleted = False
 
         self.id = json['fileId']
@@ -29,24 +44,41 @@ class B2File():
         self.action = json['action']
         self.uploadTimestamp = json['uploadTimestamp']
 
+    async def list_versions(self, limit=None, page_size=None, prefetch=1,
+                            lightweight=False):
+        """ Iterate over every version of this file, newest first.
+
+        Calls: b2_list_file_versions
+
+        Pages through the bucket's version listing from this file's name and
+        stops as soon as the listing moves on to another name. See
+        B2Bucket.list_file_versions for the parameters.
+        """
+        versions = self.bucket.list_file_versions(
+            prefix=self.name,
+            start_file_name=self.name,
+            limit=limit,
+            page_size=page_size or MAX_VERSIONS_PER_LIST,
+            prefetch=prefetch,
+            lightweight=lightweight)
+        try:
+            async for version in versions:
+                if version.name != self.name:
+                    break
+                yield version
+        finally:
+            await versions.aclose()
+
     async def get_versions(self, limit=None):
         """ Fetch list of all versions of the current file.
             Params:
-                limit: (int) Limit number of results returned (optional, default 10000)
+                limit: (int) Limit number of results returned (optional,
+                       default all versions)
 
             Returns:
                 file_versions (list) B2FileObject of all file versions
         """
-        response = await self.connector.post(
-            path=API.list_file_versions,
-            params={
-                'bucketId': self.bucket.id,
-                'maxFileCount': limit or 10000,
-                'startFileId': self.id,
-                'startFileName': self.name,
-            })
-
-        return [B2File(self, file_json) for file_json in response['files']]
+        return [version async for version in self.list_versions(limit=limit)]
 
     async def hide(self):
         """Soft-delete a file (hide it from files list, but previous versions
@@ -58,12 +90,9 @@ class B2File():
             path=API.delete_file,
             params={
                 'bucketId': self.bucket.id,
-                'fileName': b2_url_encode(self.name)
+                'fileName': self.name
             })
         self.deleted = True
-        # Delete from parent list if exists
-        self.parent_list._files_by_name.pop(self.name)
-        self.parent_list._files_by_id.pop(self.file_id)
 
     async def delete(self):
         """ Delete a file version (Does not delete entire file history: only a
@@ -74,16 +103,310 @@ class B2File():
         await self.connector.post(
             path=API.delete_file_version,
             params={
-                'fileId': self.file_id,
-                'fileName': b2_url_encode(self.name)
+                'fileId': self.id,
+                'fileName': self.name
             })
         self.deleted = True
 
-    def download(self):
-        """ Download latest file version """
-        return self.connector.download_file(file_id=self.file_id)
+    async def copy_to(self, file_name, bucket=None, part_size=None,
+                      concurrency=DEFAULT_COPY_CONCURRENCY,
+                      mime_content_type=None, file_info=None):
+        """ Copy this file version server-side, without downloading it.
+
+        Calls: b2_copy_file, or b2_start_large_file, b2_copy_part and
+        b2_finish_large_file
+
+            Parameters:
+                file_name:          (str) Name of the copy
+                bucket:             (B2Bucket) Destination bucket (optional,
+                                    defaults to this file's bucket)
+                part_size:          (int) Bytes per copied part (optional,
+                                    defaults to recommendedPartSize)
+                concurrency:        (int or AdaptiveLimiter) Number of
+                                    parts copied at once
+                mime_content_type:  (str) Content type of the copy (optional,
+                                    defaults to this file's)
+                file_info:          (dict) File info of the copy (optional,
+                                    defaults to this file's)
+
+            Returns:
+                (B2File) The copy
+
+        Files smaller than two parts are copied with a single b2_copy_file.
+        Larger files are copied as a large file, `concurrency` ranges of
+        `part_size` bytes at a time; a failed copy cancels the large file.
+        """
+        bucket = bucket or self.bucket
+        part_size = part_size or self.connector.recommended_part_size
+        if self.content_length < 2 * part_size:
+            return await bucket.copy_file(self.id, file_name,
+                                          mime_content_type=mime_content_type,
+                                          file_info=file_info)
+
+        if mime_content_type is None and file_info is None:
+            mime_content_type, file_info = self.content_type, self.file_info
+        if file_name.startswith('/'):
+            file_name = file_name[1:]
+        file_id = await bucket._start_large_file(file_name, mime_content_type,
+                                                 file_info)
+        sha_by_part = {}
+
+        async def copy_part(part):
+            part_number, (offset, size) = part
+            response = await self.connector.post(
+                path=API.copy_part,
+                params={
+                    'sourceFileId': self.id,
+                    'largeFileId': file_id,
+                    'partNumber': part_number,
+                    'range': 'bytes={}-{}'.format(offset, offset + size - 1),
+                })
+            sha_by_part[part_number] = response['contentSha1']
+
+        copy_part, workers = bucket._limit_concurrency(copy_part,
+                                                       concurrency)
+        try:
+            await run_workers(
+                enumerate(get_part_ranges(self.content_length, part_size), 1),
+                copy_part, workers)
+            sha_list = [sha_by_part[number] for number in sorted(sha_by_part)]
+            response = await bucket._finish_large_file(file_id, sha_list)
+        except BaseException:
+            try:
+                await asyncio.shield(bucket.cancel_large_file(file_id))
+            except B2Exception:
+                pass
+            raise
+        return B2File(bucket, response)
+
+    def download(self, start=None, end=None):
+        """ Download latest file version
+
+        Passing `start` and/or `end` (inclusive byte offsets) requests only
+        that range of the file with an HTTP Range header.
+
+        Raises:
+            B2OutOfRangeError if the range is outside the file.
+        """
+        byte_range = None
+        if start is not None or end is not None:
+            byte_range = self._check_range(start or 0, end)
+        return self.connector.download_file(file_id=self.id,
+                                            byte_range=byte_range)
+
+    async def download_parallel(self, path, part_size=None,
+                                concurrency=DEFAULT_DOWNLOAD_CONCURRENCY,
+                                verify=True):
+        """ Download the file to `path` as byte ranges fetched over several
+        connections at once.
+
+        The file at `path` is preallocated to the full size and every range is
+        written in place as it arrives.
+
+            Parameters:
+                path:           (str) Local file to write
+                part_size:      (int) Bytes per range (optional, defaults to
+                                recommendedPartSize)
+                concurrency:    (int or AdaptiveLimiter) Number of ranges
+                                fetched at once
+                verify:         (bool) Check the SHA1 of the written file
+                                against content_sha1 (or large_file_sha1)
+
+        Raises:
+            B2HashMismatchError if `verify` is set and the SHA1 differs.
+        """
+        part_size = part_size or self.connector.recommended_part_size
+        writer = RangeFileWriter(path, self.content_length)
+
+        async def fetch_range(offset, size):
+            async with self.download(offset, offset + size - 1) as response:
+                await check_download(response)
+                async for chunk in self.connector.iter_download(
+                        response, DOWNLOAD_CHUNK_SIZE):
+                    await writer.write(offset, chunk)
+                    offset += len(chunk)
+
+        async def download_range(part):
+            # A failed range is fetched again from the start and overwrites
+            # whatever it had written so far.
+            await self.connector.retry('download',
+                                       lambda: fetch_range(*part))
+
+        download_range, workers = self.bucket._limit_concurrency(
+            download_range, concurrency)
+        try:
+            await run_workers(get_part_ranges(self.content_length, part_size),
+                              download_range, workers)
+        finally:
+            writer.close()
+
+        expected_sha1 = self.expected_sha1
+        if verify and expected_sha1 is not None:
+            actual_sha1 = await self.connector.hashing.hash_file(path)
+            if actual_sha1 != expected_sha1:
+                raise B2HashMismatchError(
+                    'SHA1 of {} is {}, expected {}'.format(
+                        path, actual_sha1, expected_sha1))
+
+    async def iter_chunks(self, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                          progress_listener=None, verify=True,
+                          progress_bytes=PROGRESS_BYTES,
+                          progress_interval=PROGRESS_INTERVAL):
+        """ Stream the file as chunks of at most `chunk_size` bytes.
+
+        The data is hashed as it streams, in batches on the connector's
+        HashingPool. `progress_listener` is called with the total number of
+        bytes received at most every `progress_interval` seconds or
+        `progress_bytes` bytes, and once more at the end, like
+        StreamWithHashProgress does for uploads.
+
+        Raises:
+            B2HashMismatchError if `verify` is set and the SHA1 of the data
+            differs from the one stored in B2 (checked after the last chunk).
+        """
+        hasher = sha1()
+        async with self.download() as response:
+            await check_download(response)
+            chunks = self.connector.iter_download(response, chunk_size)
+            chunks = report_progress(chunks, progress_listener,
+                                     progress_bytes, progress_interval)
+            async for chunk in self.connector.hashing.feed(hasher, chunks):
+                yield chunk
+
+        expected_sha1 = self.expected_sha1
+        if verify and expected_sha1 is not None:
+            if hasher.hexdigest() != expected_sha1:
+                raise B2HashMismatchError(
+                    'SHA1 of {} is {}, expected {}'.format(
+                        self.name, hasher.hexdigest(), expected_sha1))
+
+    async def download_to(self, path_or_writer,
+                          chunk_size=DOWNLOAD_CHUNK_SIZE,
+                          progress_listener=None, verify=True,
+                          progress_bytes=PROGRESS_BYTES,
+                          progress_interval=PROGRESS_INTERVAL):
+        """ Stream the file into a local path or a writer with constant
+        memory use.
+
+        `path_or_writer` is either a path to write to or an object with a
+        `write()` method, which may be a coroutine function. See iter_chunks
+        for the other parameters.
+        """
+        loop = asyncio.get_running_loop()
+        if hasattr(path_or_writer, 'write'):
+            file, write = None, path_or_writer.write
+        else:
+            file = open(path_or_writer, 'wb')
+
+            def write(chunk):
+                return loop.run_in_executor(None, file.write, chunk)
+
+        try:
+            async for chunk in self.iter_chunks(chunk_size,
+                                                progress_listener,
+                                                verify, progress_bytes,
+                                                progress_interval):
+                result = write(chunk)
+                if inspect.isawaitable(result):
+                    await result
+        finally:
+            if file is not None:
+                file.close()
+
+    @property
+    def expected_sha1(self):
+        """ The SHA1 of the whole file, if B2 knows it. Large files only have
+        one if it was set as the `large_file_sha1` file info.
+        """
+        content_sha1 = self.content_sha1
+        if content_sha1 and content_sha1.startswith('unverified:'):
+            content_sha1 = content_sha1[len('unverified:'):]
+        if content_sha1 and content_sha1 != 'none':
+            return content_sha1
+        return (self.file_info or {}).get('large_file_sha1')
+
+    def _check_range(self, start, end):
+        last = self.content_length - 1
+        if end is None:
+            end = last
+        if start < 0 or end < start or end > last:
+            raise B2OutOfRangeError(
+                'Range {}-{} is outside of {} ({} bytes)'.format(
+                    start, end, self.name, self.content_length))
+        return start, end
 
     @property
     def download_url(self):
         """ Return file download URL """
-        return self.connector.download_url + '?fileId=' + self.file_id
+        return self.connector.download_url + '?fileId=' + self.id
+
+
+class B2FileEntry():
+    """ A compact, read-only record of a file from a bucket listing.
+
+    Keeps only the listed fields in slots instead of a full B2File, which
+    matters when listing millions of files. `file_info` is turned back into a
+    read-only mapping only when it is accessed, and `to_file()` builds the
+    full B2File.
+    """
+
+    __slots__ = ('bucket', 'id', 'name', 'content_length', 'content_type',
+                 'action', 'uploadTimestamp', '_content_sha1', '_file_info')
+
+    def __init__(self, bucket, json):
+        self.bucket = bucket
+        self.id = json['fileId']
+        self.name = json['fileName']
+        self._content_sha1 = _pack_sha1(json.get('contentSha1'))
+        self.content_length = json.get('contentLength')
+        # Content types and actions repeat across a listing, share them.
+        content_type = json.get('contentType')
+        self.content_type = content_type and sys.intern(content_type)
+        self.action = sys.intern(json['action'])
+        self.uploadTimestamp = json.get('uploadTimestamp')
+        file_info = json.get('fileInfo')
+        self._file_info = tuple(file_info.items()) if file_info else None
+
+    def __repr__(self):
+        return '<B2FileEntry {!r} ({})>'.format(self.name, self.id)
+
+    @property
+    def content_sha1(self):
+        if isinstance(self._content_sha1, bytes):
+            return self._content_sha1.hex()
+        return self._content_sha1
+
+    @property
+    def file_info(self):
+        """ A read-only view of the file info; `to_file()` or `to_json()`
+        give a copy that can be changed.
+        """
+        return MappingProxyType(dict(self._file_info or ()))
+
+    def to_json(self):
+        return {
+            'fileId': self.id,
+            'fileName': self.name,
+            'contentSha1': self.content_sha1,
+            'contentLength': self.content_length,
+            'contentType': self.content_type,
+            'fileInfo': dict(self._file_info or ()),
+            'action': self.action,
+            'uploadTimestamp': self.uploadTimestamp,
+        }
+
+    def to_file(self):
+        """ Build the full B2File for this entry. """
+        return B2File(self.bucket, self.to_json())
+
+
+def _pack_sha1(content_sha1):
+    """ Store plain hex SHA1s as their 20 raw bytes. Other values ('none',
+    'unverified:...') are kept as they are.
+    """
+    if content_sha1 is not None and len(content_sha1) == 40:
+        try:
+            return bytes.fromhex(content_sha1)
+        except ValueError:
+            pass
+    return content_sha1
@@ -0,0 +1,159 @@
+from aiob2.utilities import get_part_ranges
+from hashlib import sha1
+import json
+import os
+import sqlite3
+import threading
+
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'aiob2',
+                            'hashes.sqlite')
+
+BLOCK_SIZE = 1024 ** 2
+
+
+class HashCache():
+    """ An on-disk cache of the SHA1s of local files, so that unchanged files
+    are never read again to be compared or verified.
+
+    Entries are stored per path along with the file's inode, size and
+    modification time in nanoseconds; an entry is only used while all three
+    still match the file. Besides the SHA1 of the whole file, the SHA1 of
+    every part of a large file upload can be stored for one part size.
+
+    Methods are blocking and safe to call from several threads, so they can
+    be run in an executor.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS hashes ('
+                ' path TEXT PRIMARY KEY,'
+                ' inode INTEGER NOT NULL,'
+                ' size INTEGER NOT NULL,'
+                ' mtime_ns INTEGER NOT NULL,'
+                ' sha1 TEXT,'
+                ' part_size INTEGER,'
+                ' part_sha1s TEXT)')
+
+    @staticmethod
+    def stat(path):
+        """ Returns the (inode, size, mtime_ns) an entry for `path` is valid
+        for.
+        """
+        info = os.stat(path)
+        return info.st_ino, info.st_size, info.st_mtime_ns
+
+    def lookup(self, path, key=None):
+        """ Returns the cached (sha1, part_size, part_sha1s) for `path`, or
+        None if there is no entry or the file has changed since.
+
+        Any of the three may be None if it was never stored, and part SHA1s
+        of parts that were never stored are None.
+        """
+        key = key or self.stat(path)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT inode, size, mtime_ns, sha1, part_size, part_sha1s '
+                'FROM hashes WHERE path = ?', (_key_path(path),)).fetchone()
+        if row is None or tuple(row[:3]) != tuple(key):
+            return None
+        sha1_hex, part_size, part_sha1s = row[3:]
+        return sha1_hex, part_size, part_sha1s and json.loads(part_sha1s)
+
+    def store(self, path, key, sha1=None, part_size=None, part_sha1s=None):
+        """ Record hashes computed from the file as it was at `key` (from
+        stat()). Nothing is stored if the file has changed since.
+
+        Hashes already cached for the same version of the file are kept
+        unless they are replaced.
+        """
+        try:
+            if tuple(self.stat(path)) != tuple(key):
+                return
+        except OSError:
+            return
+        cached = self.lookup(path, key) or (None, None, None)
+        if sha1 is None:
+            sha1 = cached[0]
+        if part_sha1s is None:
+            part_size, part_sha1s = cached[1], cached[2]
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (_key_path(path),) + tuple(key) + (
+                    sha1, part_size,
+                    part_sha1s and json.dumps(list(part_sha1s))))
+
+    def forget(self, path):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM hashes WHERE path = ?',
+                             (_key_path(path),))
+
+    def sha1(self, path):
+        """ Returns the hex SHA1 of the file at `path`, reading it only if
+        the cache has no valid entry.
+        """
+        key = self.stat(path)
+        cached = self.lookup(path, key)
+        if cached is not None and cached[0] is not None:
+            return cached[0]
+        sha1_hex, _ = _hash_parts(path, None)
+        self.store(path, key, sha1=sha1_hex)
+        return sha1_hex
+
+    def part_sha1s(self, path, part_size):
+        """ Returns the hex SHA1s of the parts of `path` for `part_size`,
+        reading the file only if the cache has no complete valid entry. The
+        SHA1 of the whole file is cached from the same read.
+        """
+        key = self.stat(path)
+        cached = self.lookup(path, key)
+        if cached is not None and cached[1] == part_size and \
+                None not in cached[2]:
+            return cached[2]
+        sha1_hex, part_sha1s = _hash_parts(path, part_size)
+        self.store(path, key, sha1=sha1_hex, part_size=part_size,
+                   part_sha1s=part_sha1s)
+        return part_sha1s
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _key_path(path):
+    return os.path.abspath(path)
+
+
+def _hash_parts(path, part_size):
+    """ Hash a file in one pass, returning the SHA1 of the whole file and,
+    with a `part_size`, the list of SHA1s of its parts.
+    """
+    whole = sha1()
+    part_sha1s = []
+    with open(path, 'rb') as file:
+        if part_size is None:
+            for block in iter(lambda: file.read(BLOCK_SIZE), b''):
+                whole.update(block)
+            return whole.hexdigest(), None
+        size = os.fstat(file.fileno()).st_size
+        for offset, length in get_part_ranges(size, part_size):
+            part = sha1()
+            while length:
+                block = file.read(min(BLOCK_SIZE, length))
+                if not block:
+                    break
+                whole.update(block)
+                part.update(block)
+                length -= len(block)
+            part_sha1s.append(part.hexdigest())
+    return whole.hexdigest(), part_sha1s
@@ -0,0 +1,203 @@
+from aiob2.utilities import iterate
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from hashlib import sha1
+import asyncio
+import os
+import time
+
+
+DEFAULT_HASH_THREADS = min(4, os.cpu_count() or 1)
+# Bytes handed to a hashing thread at once.
+DEFAULT_BATCH_SIZE = 8 * 1024 ** 2
+BLOCK_SIZE = 1024 ** 2
+
+
+class HashingPool():
+    """ Dedicated workers for the SHA1s B2 asks for with every upload.
+
+    Streams are hashed in batches of `batch_size` bytes on a private thread
+    pool (hashlib releases the GIL for large buffers), one batch behind the
+    data being sent, so hashing and sending overlap and the default executor
+    stays free. Whole files and file ranges are hashed by path, in a process
+    pool if `processes` is set, which suits many large parts at once.
+
+    stats() reports the hashing throughput and how long streams waited for
+    it, which tells whether hashing or the network is the bottleneck.
+    """
+
+    def __init__(self, threads=DEFAULT_HASH_THREADS, processes=0,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Parameters:
+            threads:        (int) Threads hashing streams and, without
+                            processes, files
+            processes:      (int) Processes hashing files by path; 0 hashes
+                            them on the threads
+            batch_size:     (int) Bytes of a stream hashed per thread hop
+        """
+        self.threads = threads
+        self.processes = processes
+        self.batch_size = batch_size
+        self.bytes_hashed = 0
+        self.hash_seconds = 0.0
+        self.wait_seconds = 0.0
+        self._thread_pool = None
+        self._process_pool = None
+
+    async def update(self, hasher, blocks):
+        """ Feed `blocks` (a list of bytes-like objects) to `hasher` on a
+        hashing thread.
+        """
+        loop = asyncio.get_running_loop()
+        seconds = await loop.run_in_executor(self._threads(), _update,
+                                             hasher, blocks)
+        self._count(sum(len(block) for block in blocks), seconds)
+
+    async def digest(self, blocks):
+        """ Returns the hex SHA1 of the concatenated `blocks`. """
+        hasher = sha1()
+        await self.update(hasher, list(blocks))
+        return hasher.hexdigest()
+
+    async def hash_range(self, path, offset=0, size=None):
+        """ Returns the hex SHA1 of `size` bytes at `offset` in the file at
+        `path` (to the end of the file if `size` is None).
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._processes() if self.processes else self._threads()
+        hex_digest, length, seconds = await loop.run_in_executor(
+            executor, _hash_range, path, offset, size)
+        self._count(length, seconds)
+        return hex_digest
+
+    async def hash_file(self, path):
+        return await self.hash_range(path)
+
+    async def hash_contents(self, contents):
+        """ Returns the hex SHA1 of the rest of a seekable file-like object,
+        read on a hashing thread, leaving its position where it was.
+        """
+        loop = asyncio.get_running_loop()
+        hex_digest, length, seconds = await loop.run_in_executor(
+            self._threads(), _hash_contents, contents)
+        self._count(length, seconds)
+        return hex_digest
+
+    async def stream(self, chunks):
+        """ Yield every chunk of a (sync or async) iterable of bytes-like
+        objects, followed by the hex SHA1 of all of them as bytes, for a
+        `hex_digits_at_end` upload body.
+        """
+        hasher = sha1()
+        async for chunk in self.feed(hasher, chunks):
+            yield chunk
+        yield hasher.hexdigest().encode()
+
+    async def feed(self, hasher, chunks):
+        """ Yield every chunk of a (sync or async) iterable of bytes-like
+        objects, feeding them to `hasher` in batches of `batch_size` bytes.
+
+        A batch is hashed while the chunks after it are consumed; the stream
+        only waits for hashing when the previous batch is still being hashed
+        once the next one is full. `hasher` holds every chunk once the
+        iteration is over.
+        """
+        pending = None
+        batch, batch_bytes = [], 0
+        try:
+            async for chunk in iterate(chunks):
+                batch.append(chunk)
+                batch_bytes += len(chunk)
+                if batch_bytes >= self.batch_size:
+                    await self._wait(pending)
+                    pending = asyncio.ensure_future(self.update(hasher, batch))
+                    batch, batch_bytes = [], 0
+                yield chunk
+            await self._wait(pending)
+            pending = None
+            if batch:
+                await self.update(hasher, batch)
+        finally:
+            # Let a running batch finish before the chunks it holds are
+            # released by the caller.
+            if pending is not None and not pending.done():
+                await asyncio.wait([pending])
+
+    def stats(self):
+        """ Bytes hashed, seconds spent hashing (summed over workers) and
+        waiting for hashing, and the throughput of a single worker in bytes
+        per second.
+        """
+        return {
+            'threads': self.threads,
+            'processes': self.processes,
+            'bytes': self.bytes_hashed,
+            'hash_seconds': self.hash_seconds,
+            'wait_seconds': self.wait_seconds,
+            'throughput': (self.bytes_hashed / self.hash_seconds
+                           if self.hash_seconds else None),
+        }
+
+    def close(self):
+        for pool in (self._thread_pool, self._process_pool):
+            if pool is not None:
+                pool.shutdown(wait=False)
+        self._thread_pool = self._process_pool = None
+
+    async def _wait(self, pending):
+        if pending is None:
+            return
+        started = time.perf_counter()
+        await pending
+        self.wait_seconds += time.perf_counter() - started
+
+    def _count(self, length, seconds):
+        self.bytes_hashed += length
+        self.hash_seconds += seconds
+
+    def _threads(self):
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(
+                self.threads, thread_name_prefix='aiob2-hash')
+        return self._thread_pool
+
+    def _processes(self):
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(self.processes)
+        return self._process_pool
+
+
+def _update(hasher, blocks):
+    started = time.perf_counter()
+    for block in blocks:
+        hasher.update(block)
+    return time.perf_counter() - started
+
+
+def _hash_contents(contents):
+    position = contents.tell()
+    try:
+        return _hash_file(contents)
+    finally:
+        contents.seek(position)
+
+
+def _hash_range(path, offset, size):
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        return _hash_file(file, size)
+
+
+def _hash_file(file, size=None):
+    """ Hashes `size` bytes (or the rest) of `file` from its position. """
+    started = time.perf_counter()
+    hasher = sha1()
+    length = 0
+    while size is None or length < size:
+        want = BLOCK_SIZE if size is None else min(BLOCK_SIZE, size - length)
+        block = file.read(want)
+        if not block:
+            break
+        hasher.update(block)
+        length += len(block)
+    return hasher.hexdigest(), length, time.perf_counter() - started
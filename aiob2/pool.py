@@ -0,0 +1,104 @@
+from aiob2.exceptions import B2UnauthorizedError
+from aiob2.retry import RETRYABLE_ERRORS
+from collections import deque
+import aiohttp
+
+
+DEFAULT_POOL_SIZE = 8
+
+# Errors that invalidate an upload URL. Per the B2 docs, a client that gets
+# one of these back from an upload must discard the URL and request a new one,
+# so a retried upload always goes to a fresh URL.
+DISCARD_ERRORS = (
+    B2UnauthorizedError,
+    aiohttp.ClientError,
+) + RETRYABLE_ERRORS
+
+
+class UploadUrlPool():
+    """ A pool of reusable upload URL/authorization token pairs.
+
+    Upload URLs fetched from b2_get_upload_url or b2_get_upload_part_url stay
+    valid for 24 hours, so there is no need to fetch a new one for every
+    upload. Only one upload may use a given URL at a time, so pairs are
+    checked out for the duration of an upload and returned afterwards.
+    """
+
+    def __init__(self, fetch, size=DEFAULT_POOL_SIZE):
+        """
+        Parameters:
+            fetch:      (coroutine function) Returns a new (url, token) pair
+            size:       (int) Maximum number of idle pairs kept for reuse
+        """
+        self.fetch = fetch
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self._idle = deque()
+
+    def __len__(self):
+        return len(self._idle)
+
+    async def acquire(self):
+        """ Check out a (url, token) pair, fetching a new one if none are
+        idle.
+        """
+        if self._idle:
+            self.hits += 1
+            return self._idle.popleft()
+        self.misses += 1
+        return await self.fetch()
+
+    def release(self, pair):
+        """ Return a pair to the pool after a successful upload. """
+        if len(self._idle) < self.size:
+            self._idle.append(pair)
+
+    def discard(self, pair):
+        """ Drop a pair that B2 has rejected. """
+        self.discarded += 1
+
+    def clear(self):
+        self._idle.clear()
+
+    def checkout(self):
+        """ Check out a pair for use in an `async with` block.
+
+        The pair is returned to the pool when the block exits normally and
+        dropped if the block raises one of `DISCARD_ERRORS`.
+        """
+        return _Checkout(self)
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'idle': len(self._idle),
+            'hits': self.hits,
+            'misses': self.misses,
+            'discarded': self.discarded,
+        }
+
+
+class _Checkout():
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.pair = None
+
+    async def __aenter__(self):
+        self.pair = await self.pool.acquire()
+        return self.pair
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.pool.release(self.pair)
+        elif (issubclass(exc_type, DISCARD_ERRORS) or
+              not issubclass(exc_type, Exception)):
+            # Rejected by B2, or abandoned mid-upload (e.g. cancelled).
+            self.pool.discard(self.pair)
+        else:
+            # Errors unrelated to the URL itself (bad parameters, local I/O
+            # failures) leave the URL usable.
+            self.pool.release(self.pair)
+        return False
@@ -0,0 +1,70 @@
+from aiob2.exceptions import B2InternalError, B2RequestTimeoutError
+from aiob2.exceptions import B2ServiceUnavailableError, B2TooManyRequestsError
+import aiohttp
+import asyncio
+import random
+
+
+# Errors B2 documents as temporary, plus connection failures and timeouts.
+RETRYABLE_ERRORS = (
+    B2RequestTimeoutError,
+    B2TooManyRequestsError,
+    B2InternalError,
+    B2ServiceUnavailableError,
+    aiohttp.ClientConnectionError,
+    asyncio.TimeoutError,
+)
+
+
+class RetryPolicy():
+    """ Retries temporary failures with exponential backoff and jitter.
+
+    The n-th retry waits `base_delay * 2 ** (n - 1)` seconds, capped at
+    `max_delay` and reduced by a random fraction of up to `jitter` so that
+    concurrent clients do not retry in lockstep. If B2 sent a Retry-After
+    header, that delay is used instead.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=64.0,
+                 jitter=0.5, retry_on=RETRYABLE_ERRORS):
+        """
+        Parameters:
+            max_attempts:   (int) Attempts per call, including the first;
+                            1 disables retries
+            base_delay:     (float) Delay before the first retry, in seconds
+            max_delay:      (float) Upper bound of the backoff delay
+            jitter:         (float) Fraction of the delay that is randomized
+            retry_on:       (tuple) Exception types that are retried
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retry_on = retry_on
+
+    def get_delay(self, attempt, error=None):
+        """ Seconds to wait after the `attempt`-th failed attempt. """
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after is not None:
+            return retry_after
+        delay = min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+        return delay * (1 - self.jitter * random.random())
+
+    async def call(self, func, on_retry=None):
+        """ Await `func()` until it succeeds, a non-retryable error is raised
+        or the attempts run out.
+
+        `on_retry(error, attempt, delay)` is called before every retry.
+        """
+        attempt = 1
+        while True:
+            try:
+                return await func()
+            except self.retry_on as error:
+                if attempt >= self.max_attempts:
+                    raise
+                delay = self.get_delay(attempt, error)
+                if on_retry is not None:
+                    on_retry(error, attempt, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
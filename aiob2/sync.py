@@ -0,0 +1,350 @@
+from aiob2.exceptions import B2Exception
+from aiob2.utilities import run_workers
+from collections import Counter, namedtuple
+import aiohttp
+import asyncio
+import os
+import stat
+
+
+DEFAULT_SYNC_CONCURRENCY = 8
+
+# File info key B2 tools use for a file's local modification time.
+MTIME_KEY = 'src_last_modified_millis'
+
+# Errors that fail a single file without stopping the sync: B2 errors, local
+# file errors, and network errors and timeouts left after retries (such as a
+# truncated download, which is not retried).
+FILE_ERRORS = (B2Exception, OSError, aiohttp.ClientError, asyncio.TimeoutError)
+
+# Downloads are written to `<name>.aiob2-partial` and renamed when complete.
+PARTIAL_SUFFIX = '.aiob2-partial'
+
+
+# A regular file found under the local directory. `name` is its path relative
+# to the directory, with '/' separators, as it is named in the bucket.
+LocalFile = namedtuple('LocalFile', ['name', 'path', 'size', 'mtime'])
+
+
+def walk_local(directory):
+    """ Yield a LocalFile for every regular file under `directory`, in the
+    order B2 lists file names (by their UTF-8 bytes).
+
+    Symbolic links to directories are not followed, and partial downloads
+    left by an interrupted sync are skipped.
+    """
+    def walk(path, prefix):
+        with os.scandir(path) as scan:
+            entries = []
+            for entry in scan:
+                if entry.is_dir(follow_symlinks=False):
+                    # Everything under a directory sorts as `name/...`.
+                    entries.append((entry.name + '/', entry, True))
+                elif (entry.is_file() and
+                      not entry.name.endswith(PARTIAL_SUFFIX)):
+                    entries.append((entry.name, entry, False))
+        entries.sort(key=lambda entry: entry[0].encode('utf-8'))
+        for name, entry, is_dir in entries:
+            if is_dir:
+                yield from walk(entry.path, prefix + name)
+                continue
+            info = entry.stat()
+            if stat.S_ISREG(info.st_mode):
+                yield LocalFile(prefix + name, entry.path, info.st_size,
+                                info.st_mtime_ns // 1000000)
+
+    yield from walk(directory, '')
+
+
+def remote_mtime(file):
+    """ The local modification time recorded for a bucket file, in
+    milliseconds, or its upload time if none was recorded.
+    """
+    try:
+        return int(file.file_info[MTIME_KEY])
+    except (KeyError, TypeError, ValueError):
+        return file.uploadTimestamp
+
+
+async def merge(local_files, remote_files, prefix=''):
+    """ Join a sorted local walk with a sorted bucket listing.
+
+    Yields (name, local, remote) for every name found on either side, where
+    the missing side is None. `name` is relative to `prefix`.
+    """
+    remote_files = remote_files.__aiter__()
+
+    async def next_remote():
+        async for file in remote_files:
+            name = file.name[len(prefix):]
+            if name and not name.endswith('/'):
+                return name, file
+        return None, None
+
+    local_files = iter(local_files)
+    local = next(local_files, None)
+    remote_name, remote = await next_remote()
+    while local is not None or remote is not None:
+        if remote is None:
+            order = -1
+        elif local is None:
+            order = 1
+        else:
+            local_key = local.name.encode('utf-8')
+            remote_key = remote_name.encode('utf-8')
+            order = (local_key > remote_key) - (local_key < remote_key)
+
+        if order < 0:
+            yield local.name, local, None
+            local = next(local_files, None)
+        elif order > 0:
+            yield remote_name, None, remote
+            remote_name, remote = await next_remote()
+        else:
+            yield local.name, local, remote
+            local = next(local_files, None)
+            remote_name, remote = await next_remote()
+
+
+class Sync():
+    """ Mirror a local directory to a bucket prefix, or the other way round.
+
+    Both sides are listed in name order and merged as they are read, so
+    neither listing is held in memory. A file is considered unchanged when its
+    size and modification time match (stored in the bucket as the
+    `src_last_modified_millis` file info), or with `compare_sha1`, when its
+    size and SHA1 match. Only changed files are transferred, `concurrency` at
+    a time.
+    """
+
+    def __init__(self, bucket, directory, prefix='', compare_sha1=False,
+                 delete=False, concurrency=DEFAULT_SYNC_CONCURRENCY,
+                 large_file_threshold=None, dry_run=False,
+                 progress_listener=None, hash_cache=None):
+        """
+        Parameters:
+            bucket:                 (B2Bucket) Bucket to sync with
+            directory:              (str) Local directory to sync with
+            prefix:                 (str) Prepended to local names to get
+                                    bucket names, e.g. 'backup/'
+            compare_sha1:           (bool) Compare SHA1s instead of
+                                    modification times
+            delete:                 (bool) Remove files that only exist on
+                                    the destination (hidden in the bucket,
+                                    deleted locally)
+            concurrency:            (int) Number of files transferred at once
+            large_file_threshold:   (int) Files of at least this many bytes
+                                    are sent with upload_large_file and
+                                    fetched with download_parallel (optional,
+                                    defaults to twice recommendedPartSize)
+            dry_run:                (bool) Only count what would be done
+            progress_listener:      (callable) Called with the stats Counter
+                                    after every file
+            hash_cache:             (HashCache) Cache of local SHA1s, so
+                                    unchanged files are not hashed again
+                                    (optional)
+        """
+        self.bucket = bucket
+        self.directory = directory
+        self.prefix = prefix
+        self.compare_sha1 = compare_sha1
+        self.delete = delete
+        self.concurrency = concurrency
+        self.large_file_threshold = large_file_threshold
+        self.dry_run = dry_run
+        self.progress_listener = progress_listener
+        self.hash_cache = hash_cache
+        self.stats = Counter()
+
+    async def to_bucket(self):
+        """ Upload new and changed local files, and with `delete`, hide bucket
+        files that no longer exist locally.
+
+        Calls: b2_list_file_names, b2_upload_file, b2_start_large_file,
+        b2_upload_part, b2_finish_large_file, b2_hide_file
+
+            Returns:
+                (Counter) 'uploaded', 'hidden', 'unchanged' and 'failed'
+        """
+        async def handle(item):
+            name, local, remote = item
+            if local is None:
+                if self.delete:
+                    await self._count('hidden', self._hide(remote))
+                return
+            if remote is not None and await self._unchanged(local, remote):
+                self.stats['unchanged'] += 1
+                self._progress()
+                return
+            await self._count('uploaded', self._upload(local))
+
+        await self._run(handle)
+        return self.stats
+
+    async def to_directory(self):
+        """ Download new and changed bucket files, and with `delete`, remove
+        local files that are not in the bucket.
+
+        Calls: b2_list_file_names, b2_download_file_by_id
+
+            Returns:
+                (Counter) 'downloaded', 'deleted', 'unchanged' and 'failed'
+        """
+        async def handle(item):
+            name, local, remote = item
+            if remote is None:
+                if self.delete:
+                    await self._count('deleted', self._remove(local))
+                return
+            if local is not None and await self._unchanged(local, remote):
+                self.stats['unchanged'] += 1
+                self._progress()
+                return
+            await self._count('downloaded', self._download(name, remote))
+
+        await self._run(handle)
+        return self.stats
+
+    async def _run(self, handle):
+        if os.path.isdir(self.directory):
+            local_files = walk_local(self.directory)
+        else:
+            local_files = ()
+        remote_files = self.bucket.list_files(prefix=self.prefix or None,
+                                              lightweight=True)
+        items = merge(local_files, remote_files, self.prefix)
+        await run_workers(items, handle, self.concurrency)
+
+    async def _count(self, done_key, action):
+        if self.dry_run:
+            action.close()
+            self.stats[done_key] += 1
+        else:
+            try:
+                await action
+            except FILE_ERRORS:
+                self.stats['failed'] += 1
+            else:
+                self.stats[done_key] += 1
+        self._progress()
+
+    def _progress(self):
+        if self.progress_listener is not None:
+            self.progress_listener(self.stats)
+
+    async def _unchanged(self, local, remote):
+        if local.size != remote.content_length:
+            return False
+        remote_sha1 = remote.to_file().expected_sha1
+        if self.compare_sha1 and remote_sha1 is not None:
+            try:
+                return await self._hash(local) == remote_sha1
+            except OSError:
+                return False
+        return local.mtime == remote_mtime(remote)
+
+    async def _hash(self, local):
+        loop = asyncio.get_running_loop()
+        if self.hash_cache is not None:
+            return await loop.run_in_executor(None, self.hash_cache.sha1,
+                                              local.path)
+        return await self.bucket.connector.hashing.hash_file(local.path)
+
+    async def _cache(self, path, key, sha1):
+        """ Remember the SHA1 B2 reported for a file transferred from or to
+        `path`, as it was at `key`.
+        """
+        if self.hash_cache is None or sha1 is None:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.hash_cache.store, path, key,
+                                   sha1)
+
+    def _threshold(self):
+        return (self.large_file_threshold or
+                2 * self.bucket.connector.recommended_part_size)
+
+    async def _upload(self, local):
+        file_name = self.prefix + local.name
+        file_info = {MTIME_KEY: str(local.mtime)}
+        key, content_sha1 = None, None
+        if self.hash_cache is not None:
+            # A cached SHA1 is sent in the header, so the upload does not
+            # hash the file again.
+            loop = asyncio.get_running_loop()
+            key, cached = await loop.run_in_executor(None, _stat_and_lookup,
+                                                     self.hash_cache,
+                                                     local.path)
+            content_sha1 = cached and cached[0]
+        with open(local.path, 'rb') as contents:
+            if local.size < self._threshold():
+                file = await self.bucket.upload_file(
+                    contents, file_name, content_length=local.size,
+                    file_info=file_info, content_sha1=content_sha1)
+                await self._cache(local.path, key, file.expected_sha1)
+                return file
+            # Large files have no SHA1 of their own in B2, so record it for
+            # later comparisons and downloads.
+            if self.compare_sha1:
+                file_info['large_file_sha1'] = await self._hash(local)
+            return await self.bucket.upload_large_file(
+                contents, file_name, content_length=local.size,
+                file_info=file_info, hash_cache=self.hash_cache)
+
+    async def _hide(self, remote):
+        return await remote.to_file().hide()
+
+    async def _download(self, name, remote):
+        path = os.path.join(self.directory, *name.split('/'))
+        if not _is_inside(self.directory, path):
+            raise OSError('refusing to write outside {}: {!r}'.format(
+                self.directory, name))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Download next to the destination and move it into place once it is
+        # complete and verified.
+        temp_path = path + PARTIAL_SUFFIX
+        file = remote.to_file()
+        try:
+            if remote.content_length >= self._threshold():
+                await file.download_parallel(temp_path)
+            else:
+                await file.download_to(temp_path)
+            mtime = remote_mtime(remote)
+            os.utime(temp_path, ns=(mtime * 1000000, mtime * 1000000))
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        # The download was verified against this SHA1.
+        if self.hash_cache is not None:
+            loop = asyncio.get_running_loop()
+            key = await loop.run_in_executor(None, self.hash_cache.stat, path)
+            await self._cache(path, key, file.expected_sha1)
+
+    async def _remove(self, local):
+        os.unlink(local.path)
+
+
+def _stat_and_lookup(hash_cache, path):
+    key = hash_cache.stat(path)
+    return key, hash_cache.lookup(path, key)
+
+
+async def sync_to_bucket(directory, bucket, prefix='', **kwargs):
+    """ Upload `directory` to `prefix` in `bucket`. See Sync for the other
+    parameters.
+    """
+    return await Sync(bucket, directory, prefix, **kwargs).to_bucket()
+
+
+async def sync_to_directory(bucket, directory, prefix='', **kwargs):
+    """ Download `prefix` in `bucket` to `directory`. See Sync for the other
+    parameters.
+    """
+    return await Sync(bucket, directory, prefix, **kwargs).to_directory()
+
+
+def _is_inside(directory, path):
+    directory = os.path.abspath(directory)
+    return os.path.commonpath([directory, os.path.abspath(path)]) == directory
@@ -0,0 +1,220 @@
+from collections import Counter, deque
+import asyncio
+import time
+
+
+# Window over which the request rate is measured, for backing off from an
+# unlimited rate.
+RATE_WINDOW = 5.0
+# Lowest request rate a backoff goes down to.
+MIN_RATE = 0.1
+# Longest a waiting caller sleeps before checking the rate again.
+RECHECK_INTERVAL = 1.0
+
+
+class TokenBucket():
+    """ Allows `rate` units per second on average, with bursts of up to
+    `burst` units (defaulting to one second's worth).
+
+    A caller takes its units right away and then waits until its deficit
+    has been refilled, so amounts larger than the burst still go through,
+    just at the set rate, and concurrent callers are served in the order
+    they arrived. A rate of None means no limit. The rate can be changed at
+    any time; waiting callers check it again at least every
+    RECHECK_INTERVAL seconds and refill at the new rate from then on.
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self._rate = rate
+        self._burst = burst
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        # Units refilled since creation, not capped by the burst.
+        self._filled = 0.0
+        self._times = deque()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate):
+        self._refill()
+        self._rate = rate
+        self.tokens = min(self.tokens, self.burst)
+
+    @property
+    def burst(self):
+        if self._burst is not None:
+            return self._burst
+        return self._rate or 0
+
+    async def acquire(self, amount=1):
+        """ Wait until `amount` units may be used. """
+        self._record(amount)
+        if self._rate is None:
+            return
+        self._refill()
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return
+        target = self._filled - self.tokens
+        while True:
+            self._refill()
+            if self._rate is None or self._filled >= target - 1e-9:
+                return
+            delay = min((target - self._filled) / self._rate,
+                        RECHECK_INTERVAL)
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+    def observed_rate(self):
+        """ Units used per second over the last RATE_WINDOW seconds. """
+        self._trim(time.monotonic())
+        return sum(amount for _, amount in self._times) / RATE_WINDOW
+
+    def _refill(self):
+        now = time.monotonic()
+        if self._rate is not None:
+            refilled = (now - self.updated) * self._rate
+            self._filled += refilled
+            self.tokens = min(self.burst, self.tokens + refilled)
+        self.updated = now
+
+    def _record(self, amount):
+        now = time.monotonic()
+        self._times.append((now, amount))
+        self._trim(now)
+
+    def _trim(self, now):
+        while self._times and self._times[0][0] < now - RATE_WINDOW:
+            self._times.popleft()
+
+
+class Throttle():
+    """ Request rate and bandwidth limits for one B2 client.
+
+    Requests per second are limited separately for API calls, uploads and
+    downloads, and bytes per second for upload and download bodies. All
+    limits default to none and can be changed at runtime with set_rate() and
+    set_bandwidth().
+
+    When B2 answers 429 Too Many Requests, the request rate of that endpoint
+    class is multiplied by `backoff_factor` (starting from the measured rate
+    if it had no limit) and restored `backoff_time` seconds after the last
+    backoff. Only one backoff happens per round trip: 429s to requests sent
+    before the last backoff are ignored.
+    """
+
+    def __init__(self, api_rate=None, upload_rate=None, download_rate=None,
+                 upload_bandwidth=None, download_bandwidth=None,
+                 backoff_factor=0.5, backoff_time=30.0):
+        """
+        Parameters:
+            api_rate:           (float) API calls per second
+            upload_rate:        (float) Upload requests per second
+            download_rate:      (float) Download requests per second
+            upload_bandwidth:   (float) Upload body bytes per second
+            download_bandwidth: (float) Download body bytes per second
+            backoff_factor:     (float) Rate multiplier applied on a 429
+            backoff_time:       (float) Seconds a lowered rate is kept
+        """
+        self.requests = {
+            'api': TokenBucket(api_rate),
+            'upload': TokenBucket(upload_rate),
+            'download': TokenBucket(download_rate),
+        }
+        self.bandwidth = {
+            'upload': TokenBucket(upload_bandwidth),
+            'download': TokenBucket(download_bandwidth),
+        }
+        self.backoff_factor = backoff_factor
+        self.backoff_time = backoff_time
+        self.backoffs = Counter()
+        self._rates = {name: bucket.rate
+                       for name, bucket in self.requests.items()}
+        self._restore = {}
+        self._last_backoff = {}
+
+    def set_rate(self, endpoint_class, rate):
+        """ Set the requests per second for 'api', 'upload' or 'download'
+        (None for no limit). Cancels any backoff in progress.
+        """
+        self._cancel_restore(endpoint_class)
+        self._rates[endpoint_class] = rate
+        self.requests[endpoint_class].rate = rate
+
+    def set_bandwidth(self, direction, bytes_per_second):
+        """ Set the body bytes per second for 'upload' or 'download' (None
+        for no limit).
+        """
+        self.bandwidth[direction].rate = bytes_per_second
+
+    async def request(self, endpoint_class):
+        """ Wait until a request of `endpoint_class` may be sent. """
+        await self.requests[endpoint_class].acquire()
+
+    async def transfer(self, direction, size):
+        """ Wait until `size` body bytes may be sent or received. """
+        await self.bandwidth[direction].acquire(size)
+
+    def limits_bandwidth(self, direction):
+        return self.bandwidth[direction].rate is not None
+
+    def back_off(self, endpoint_class, started=None):
+        """ Lower the request rate of `endpoint_class` after a 429.
+
+        `started` is the time.monotonic() at which the rejected request was
+        sent; the 429 is ignored if that was before the last backoff, which
+        has already accounted for it.
+        """
+        now = time.monotonic()
+        last = self._last_backoff.get(endpoint_class)
+        if started is not None and last is not None and started < last:
+            return
+        self._last_backoff[endpoint_class] = now
+        bucket = self.requests[endpoint_class]
+        rate = bucket.rate
+        if rate is None:
+            rate = bucket.observed_rate() or 1.0
+        bucket.rate = max(rate * self.backoff_factor, MIN_RATE)
+        self.backoffs[endpoint_class] += 1
+        self._cancel_restore(endpoint_class)
+        self._restore[endpoint_class] = asyncio.get_running_loop().call_later(
+            self.backoff_time, self._restore_rate, endpoint_class)
+
+    def stats(self):
+        """ Current limits, the seconds callers spent waiting for them
+        (summed over callers) and the number of 429 backoffs per endpoint
+        class.
+        """
+        return {
+            'requests': {name: bucket.rate
+                         for name, bucket in self.requests.items()},
+            'bandwidth': {name: bucket.rate
+                          for name, bucket in self.bandwidth.items()},
+            'request_waited': {name: bucket.waited
+                               for name, bucket in self.requests.items()},
+            'bandwidth_waited': {name: bucket.waited
+                                 for name, bucket in self.bandwidth.items()},
+            'backoffs': dict(self.backoffs),
+        }
+
+    def _restore_rate(self, endpoint_class):
+        self._restore.pop(endpoint_class, None)
+        self.requests[endpoint_class].rate = self._rates[endpoint_class]
+
+    def _cancel_restore(self, endpoint_class):
+        handle = self._restore.pop(endpoint_class, None)
+        if handle is not None:
+            handle.cancel()
+
+
+def endpoint_class(name):
+    """ The endpoint class of an operation name used for retry counts. """
+    if name in ('upload_file', 'upload_part'):
+        return 'upload'
+    if name == 'download':
+        return 'download'
+    return 'api'
@@ -0,0 +1,104 @@
+import aiohttp
+import socket
+
+
+# Seconds to establish a connection, as in aiohttp's default ClientTimeout.
+DEFAULT_CONNECT_TIMEOUT = 30.0
+# Seconds a socket may go without data before the request fails. There is no
+# total timeout by default, since a large part or download can rightly take
+# far longer than any fixed limit.
+DEFAULT_READ_TIMEOUT = 300.0
+
+
+class TransportConfig():
+    """ Connection pool and timeout settings for one aiohttp session.
+
+    B2 keeps a separate session (and so a separate connection pool) for API
+    calls, uploads and downloads, since they go to different hosts and have
+    very different request sizes. Each can be given its own TransportConfig.
+    """
+
+    def __init__(self, limit=100, limit_per_host=0, keepalive_timeout=30.0,
+                 use_dns_cache=True, ttl_dns_cache=300, tcp_nodelay=True,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, total_timeout=None):
+        """
+        Parameters:
+            limit:              (int) Connections open at once; 0 for no limit
+            limit_per_host:     (int) Connections open at once to any single
+                                host; 0 for no limit
+            keepalive_timeout:  (float) Seconds an idle connection is kept
+            use_dns_cache:      (bool) Cache DNS lookups
+            ttl_dns_cache:      (int) Seconds a DNS lookup is cached
+            tcp_nodelay:        (bool) Set TCP_NODELAY on every connection
+            connect_timeout:    (float) Seconds to establish a connection
+            read_timeout:       (float) Seconds to wait for data on a socket
+            total_timeout:      (float) Seconds for a whole request (optional,
+                                defaults to no limit)
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.use_dns_cache = use_dns_cache
+        self.ttl_dns_cache = ttl_dns_cache
+        self.tcp_nodelay = tcp_nodelay
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+
+    def create_session(self, loop=None):
+        # aiohttp already sets TCP_NODELAY on every connection it makes.
+        connector_class = (aiohttp.TCPConnector if self.tcp_nodelay
+                           else _DelayingTCPConnector)
+        connector = connector_class(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            use_dns_cache=self.use_dns_cache,
+            ttl_dns_cache=self.ttl_dns_cache,
+            loop=loop)
+        timeout = aiohttp.ClientTimeout(total=self.total_timeout,
+                                        sock_connect=self.connect_timeout,
+                                        sock_read=self.read_timeout)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                     loop=loop)
+
+
+def pool_stats(session):
+    """ Limits and current usage of a session's connection pool.
+
+    aiohttp has no public API for the usage, so 'acquired', 'idle' and
+    'hosts' are None if its connector internals are not the expected ones.
+    """
+    connector = session.connector
+    stats = {
+        'limit': getattr(connector, 'limit', None),
+        'limit_per_host': getattr(connector, 'limit_per_host', None),
+        'acquired': None,
+        'idle': None,
+        'hosts': None,
+    }
+    try:
+        stats['acquired'] = len(connector._acquired)
+    except (AttributeError, TypeError):
+        pass
+    try:
+        idle = connector._conns
+        stats['idle'] = sum(len(connections) for connections in idle.values())
+        stats['hosts'] = len(idle)
+    except (AttributeError, TypeError):
+        pass
+    return stats
+
+
+class _DelayingTCPConnector(aiohttp.TCPConnector):
+    """ A TCPConnector that turns TCP_NODELAY back off on its connections. """
+
+    async def _create_connection(self, *args, **kwargs):
+        protocol = await super()._create_connection(*args, **kwargs)
+        transport = getattr(protocol, 'transport', None)
+        sock = transport and transport.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET,
+                                                socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, False)
+        return protocol
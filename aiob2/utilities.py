@@ -1,6 +1,16 @@
+from aiohttp.payload import AsyncIterablePayload
 from hashlib import sha1
 from urllib.parse import quote, unquote_plus
+import asyncio
+import mmap
 import os
+import stat
+
+
+DEFAULT_CHUNK_SIZE = 1024 ** 2
+# Progress is reported at most this often, by default.
+PROGRESS_BYTES = 16 * 1024 ** 2
+PROGRESS_INTERVAL = 0.5
 
 
 def url_encode(s):
@@ -12,11 +22,21 @@ def url_decode(s):
 
 
 def get_content_length(file):
+    if not hasattr(file, 'read'):
+        return len(file)
     if hasattr(file, 'name') and os.path.isfile(file.name):
         return os.path.getsize(file.name)
     raise Exception('Content-Length could not be automatically determined.')
 
 
+def local_path(contents):
+    """ The path `contents` was opened from, if it is a file on disk. """
+    path = getattr(contents, 'name', None)
+    if isinstance(path, str) and os.path.isfile(path):
+        return path
+    return None
+
+
 def get_part_ranges(content_length, part_size):
     next_offest = 0
     while content_length > 0:
@@ -27,62 +47,287 @@ def get_part_ranges(content_length, part_size):
         content_length -= part_size
 
 
-class StreamWithHashProgress:
+async def iterate(items):
+    """ Iterate over a sync or async iterable alike. """
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def run_workers(items, handler, concurrency):
+    """ Call `handler(item)` for every item with at most `concurrency` calls
+    in flight.
+
+    Items are handed to the workers through a bounded queue, so a lazy (sync
+    or async) iterable is only consumed as fast as the workers can keep up.
+    The first error cancels the remaining workers and is re-raised.
+    """
+    queue = asyncio.Queue(maxsize=concurrency)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            await handler(item)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+
+    async def producer():
+        async for item in iterate(items):
+            await queue.put(item)
+        for _ in workers:
+            await queue.put(None)
+
+    tasks = [asyncio.ensure_future(producer())] + workers
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def report_progress(chunks, progress_listener,
+                          progress_bytes=PROGRESS_BYTES,
+                          progress_interval=PROGRESS_INTERVAL):
+    """ Yield every chunk of an async iterable, calling `progress_listener`
+    with the number of bytes yielded so far at most every `progress_interval`
+    seconds or `progress_bytes` bytes, whichever comes first, and once more
+    at the end.
+    """
+    if progress_listener is None:
+        async for chunk in chunks:
+            yield chunk
+        return
+
+    loop = asyncio.get_running_loop()
+    bytes_completed = 0
+    reported_bytes, reported_at = 0, loop.time()
+    async for chunk in chunks:
+        bytes_completed += len(chunk)
+        if (bytes_completed - reported_bytes >= progress_bytes
+                or loop.time() - reported_at >= progress_interval):
+            reported_bytes, reported_at = bytes_completed, loop.time()
+            progress_listener(bytes_completed)
+        yield chunk
+    if reported_bytes != bytes_completed or not reported_bytes:
+        progress_listener(bytes_completed)
+
+
+class FilePartReader:
+    """
+    Reads byte ranges of a file-like object (or bytes) on demand, off the event
+    loop, so that only the parts currently being sent are held in memory.
+    """
+
+    def __init__(self, contents):
+        self.contents = contents
+        self.lock = asyncio.Lock()
+
+    async def read(self, offset, size):
+        if not hasattr(self.contents, 'read'):
+            return memoryview(self.contents)[offset:offset + size]
+        loop = asyncio.get_running_loop()
+        # Reads share the file position, so they have to be serialized.
+        async with self.lock:
+            return await loop.run_in_executor(None, self._read, offset, size)
+
+    def _read(self, offset, size):
+        self.contents.seek(offset)
+        return self.contents.read(size)
+
+    def close(self):
+        pass
+
+
+class MmapPartReader:
+    """
+    Serves byte ranges of an on-disk file as `memoryview` slices of a
+    read-only memory map, so parts are hashed and sent without being copied
+    into new bytes objects.
+    """
+
+    def __init__(self, file):
+        self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+
+    async def read(self, offset, size):
+        return self.view[offset:offset + size]
+
+    def close(self):
+        self.view.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            # A slice is still referenced somewhere; the map is closed once
+            # it is garbage collected.
+            pass
+
+
+def open_part_reader(contents):
+    """ Returns a MmapPartReader for non-empty regular files on disk, and a
+    FilePartReader for anything else.
+    """
+    try:
+        fileno = contents.fileno()
+        file_stat = os.fstat(fileno)
+    except (AttributeError, OSError, ValueError):
+        return FilePartReader(contents)
+    if stat.S_ISREG(file_stat.st_mode) and file_stat.st_size > 0:
+        return MmapPartReader(contents)
+    return FilePartReader(contents)
+
+
+class RangeFileWriter:
+    """
+    Writes byte ranges into a file preallocated to its final size, with
+    `os.pwrite` where available and a memory map otherwise, so ranges can be
+    written concurrently and in any order.
+    """
+
+    def __init__(self, path, size):
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        self.mmap = None
+        try:
+            os.ftruncate(self.fd, size)
+            if not hasattr(os, 'pwrite') and size > 0:
+                self.mmap = mmap.mmap(self.fd, size)
+        except BaseException:
+            os.close(self.fd)
+            raise
+
+    async def write(self, offset, data):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write, offset, data)
+
+    def _write(self, offset, data):
+        if self.mmap is not None:
+            self.mmap[offset:offset + len(data)] = data
+            return
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, offset)
+            view = view[written:]
+            offset += written
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+        os.close(self.fd)
+
+
+class StreamWithHashProgress(AsyncIterablePayload):
     """
-    Wraps a file-like object (read-only), hashes on-the-fly, and
-    updates a progress_listener as data is read.
+    An aiohttp payload that streams a file-like object or a buffer, hashes it
+    on the fly for a `hex_digits_at_end` upload, and reports progress.
+
+    File-like objects are read `chunk_size` bytes at a time off the event
+    loop (or awaited, if `read` is a coroutine function), the next chunk being
+    read while the current one is sent. Buffers are sent as slices, without
+    copying. With `hash_at_end`, the hex SHA1 of the data is sent after it,
+    hashed by `hashing` (a HashingPool) or on the default executor.
+
+    `progress_listener` is called with the number of bytes sent so far at
+    most every `progress_interval` seconds or `progress_bytes` bytes,
+    whichever comes first, and once more at the end. With a `bandwidth`
+    TokenBucket, every chunk waits for its bytes before it is sent.
     """
 
-    def __init__(self, stream, progress_listener=None):
+    def __init__(self, stream, content_length=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, hash_at_end=True,
+                 progress_listener=None, progress_bytes=PROGRESS_BYTES,
+                 progress_interval=PROGRESS_INTERVAL, hashing=None,
+                 bandwidth=None):
         self.stream = stream
+        self.chunk_size = chunk_size
+        self.hash_at_end = hash_at_end
         self.progress_listener = progress_listener
+        self.progress_bytes = progress_bytes
+        self.progress_interval = progress_interval
+        self.hashing = hashing
+        self.bandwidth = bandwidth
         self.bytes_completed = 0
         self.digest = sha1()
         self.hash = None
-        self.hash_read = 0
 
-    def __enter__(self):
-        return self
+        chunks = self._progress(self._read())
+        if hash_at_end:
+            chunks = self._hash(chunks)
+        super().__init__(chunks)
+        if content_length is not None:
+            self._size = content_length + (self.hash_size() if hash_at_end
+                                           else 0)
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        return self.stream.__exit__(exc_type, exc_val, exc_tb)
+    def get_hash(self):
+        return self.hash
 
-    def read(self, size=None):
-        data = b''
-        if self.hash is None:
-            # Read some bytes from stream
-            if size is None:
-                data = self.stream.read()
-            else:
-                data = self.stream.read(size)
+    def hash_size(self):
+        return self.digest.digest_size * 2
 
-            # Update hash
-            self.digest.update(data)
+    async def _read(self):
+        if not hasattr(self.stream, 'read'):
+            # Slice bytes, bytearrays, memoryviews and mmaps in place rather
+            # than copying them through a BytesIO.
+            view = memoryview(self.stream)
+            for offset in range(0, len(view), self.chunk_size):
+                yield view[offset:offset + self.chunk_size]
+            return
 
-            # Check for end of stream
-            if size is None or len(data) < size:
-                self.hash = self.digest.hexdigest()
-                if size is not None:
-                    size -= len(data)
+        if asyncio.iscoroutinefunction(self.stream.read):
+            def read():
+                return self.stream.read(self.chunk_size)
+        else:
+            loop = asyncio.get_running_loop()
 
-            # Update progress listener
-            self._update(len(data))
+            def read():
+                return loop.run_in_executor(None, self.stream.read,
+                                            self.chunk_size)
 
-        else:
-            # The end of stream was reached, return hash now
-            size = size or len(self.hash)
-            data += str.encode(self.hash[self.hash_read:self.hash_read + size])
-            self.hash_read += size
+        pending = asyncio.ensure_future(read())
+        try:
+            while True:
+                chunk = await pending
+                if not chunk:
+                    break
+                pending = asyncio.ensure_future(read())
+                yield chunk
+        finally:
+            # Do not leave a read running on the stream, which a retry is
+            # about to rewind.
+            if not pending.done():
+                await asyncio.wait([pending])
 
-        return data
+    async def _progress(self, chunks):
+        if self.bandwidth is not None:
+            chunks = self._shape(chunks)
+        chunks = report_progress(chunks, self.progress_listener,
+                                 self.progress_bytes, self.progress_interval)
+        async for chunk in chunks:
+            # aiohttp asks for the next chunk once this one is written.
+            self.bytes_completed += len(chunk)
+            yield chunk
 
-    def _update(self, delta):
-        self.bytes_completed += delta
-        if self.progress_listener is not None:
-            self.progress_listener(self.bytes_completed)
+    async def _shape(self, chunks):
+        async for chunk in chunks:
+            await self.bandwidth.acquire(len(chunk))
+            yield chunk
 
-    def get_hash(self):
-        return self.hash
+    async def _hash(self, chunks):
+        if self.hashing is not None:
+            # The pool yields the hex digest after the data.
+            async for chunk in self.hashing.stream(chunks):
+                yield chunk
+            self.hash = chunk.decode()
+            return
 
-    def hash_size(self):
-        return self.digest.digest_size * 2
+        loop = asyncio.get_running_loop()
+        async for chunk in chunks:
+            await loop.run_in_executor(None, self.digest.update, chunk)
+            yield chunk
+        self.hash = self.digest.hexdigest()
+        yield self.hash.encode()
@@ -0,0 +1,77 @@
+""" Compare the memory retained by B2File and B2FileEntry for a listing.
+
+Builds a synthetic listing of b2_list_file_names pages, keeps one object per
+file (as a caller collecting an inventory would) and reports the memory still
+held once the page JSON has been dropped.
+
+    python benchmarks/list_memory.py [number_of_files]
+"""
+import gc
+import os
+import sys
+import tracemalloc
+
+# Run from a checkout without installing the package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiob2.file import B2File, B2FileEntry  # noqa: E402
+
+
+PAGE_SIZE = 10000
+CONTENT_TYPES = ('image/jpeg', 'image/png', 'text/plain',
+                 'application/octet-stream')
+
+
+class _Bucket():
+    connector = None
+
+
+def synthetic_page(start, count):
+    return [{
+        'accountId': '0123456789ab',
+        'action': 'upload',
+        'bucketId': 'e73ede9c9c8412db49f60715',
+        'contentLength': 1024 + index,
+        'contentSha1': '{:040x}'.format(index),
+        'contentType': CONTENT_TYPES[index % len(CONTENT_TYPES)],
+        'fileId': '4_ze73ede9c9c8412db49f60715_f1{:020d}'.format(index),
+        'fileInfo': ({'src_last_modified_millis': str(1500000000000 + index)}
+                     if index % 2 else {}),
+        'fileName': 'thumbnails/{:08d}/image.jpg'.format(index),
+        'uploadTimestamp': 1500000000000 + index,
+    } for index in range(start, start + count)]
+
+
+def measure(file_class, total):
+    bucket = _Bucket()
+    gc.collect()
+    tracemalloc.start()
+    files = []
+    for start in range(0, total, PAGE_SIZE):
+        page = synthetic_page(start, min(PAGE_SIZE, total - start))
+        files.extend(file_class(bucket, file_json) for file_json in page)
+        del page
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del files
+    return retained, peak
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    print('{} files'.format(total))
+    results = {}
+    for file_class in (B2File, B2FileEntry):
+        retained, peak = measure(file_class, total)
+        results[file_class] = retained
+        print('{:<12} retained {:>8.1f} MiB  peak {:>8.1f} MiB  '
+              '({:.0f} bytes/file)'.format(
+                  file_class.__name__, retained / 1024 ** 2,
+                  peak / 1024 ** 2, retained / total))
+    print('B2FileEntry uses {:.1%} of the memory of B2File'.format(
+        results[B2FileEntry] / results[B2File]))
+
+
+if __name__ == '__main__':
+    main()
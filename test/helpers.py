@@ -0,0 +1,388 @@
+""" Helpers for the unit tests: running coroutines as tests, and an in-memory
+fake of the parts of the B2 HTTP API the client uses.
+"""
+from aiob2 import B2
+from aiob2.api import API_VERSION
+from aiob2.retry import RetryPolicy
+from aiohttp import web
+from collections import Counter
+from hashlib import sha1
+from unittest import mock
+from urllib.parse import unquote
+import asyncio
+import functools
+import itertools
+
+
+def async_test(test):
+    """ Run a coroutine test method on a new event loop. """
+    @functools.wraps(test)
+    def run(*args, **kwargs):
+        return asyncio.run(test(*args, **kwargs))
+    return run
+
+
+class FakeB2():
+    """ A B2 server holding one bucket ('bucket1') in memory.
+
+    `calls` counts requests per API name ('upload' and 'upload_part' for the
+    upload URLs, 'download' for b2_download_file_by_id), and `fail[name]` is
+    a list of HTTP statuses, or (status, code) pairs, the next requests to
+    `name` answer with instead.
+
+    `headers` holds the headers of the last upload.
+
+    Use as an `async with` block; clients made with client() are closed when
+    it exits.
+    """
+
+    BUCKET_ID = 'bucket1'
+
+    def __init__(self):
+        self.url = None
+        self.token = None
+        self.files = {}
+        self.large_files = {}
+        self.calls = Counter()
+        self.fail = {}
+        self.headers = None
+        self._ids = itertools.count(1)
+        self._runner = None
+        self._patch = None
+        self._clients = []
+
+    async def __aenter__(self):
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_get(API_VERSION + '/b2_authorize_account',
+                           self.authorize)
+        app.router.add_get(API_VERSION + '/b2_download_file_by_id',
+                           self.download)
+        app.router.add_post(API_VERSION + '/{name}', self.api)
+        app.router.add_post('/upload/{bucket_id}', self.upload)
+        app.router.add_post('/upload_part/{file_id}', self.upload_part)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = 'http://127.0.0.1:{}'.format(port)
+        self._patch = mock.patch('aiob2.connector.BASE_URL',
+                                 self.url + API_VERSION)
+        self._patch.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        for client in self._clients:
+            await client.close()
+        self._patch.stop()
+        await self._runner.cleanup()
+        return False
+
+    async def client(self, **kwargs):
+        """ An authenticated B2 client that retries without delay. """
+        kwargs.setdefault('retry_policy', RetryPolicy(base_delay=0.0))
+        b2 = B2(**kwargs)
+        self._clients.append(b2)
+        await b2.authenticate('key-id', 'application-key')
+        return b2
+
+    async def bucket(self, **kwargs):
+        b2 = await self.client(**kwargs)
+        return await b2.get_bucket(id=self.BUCKET_ID)
+
+    def add_file(self, name, data=b'', action='upload', file_info=None):
+        file_id = 'file{}'.format(next(self._ids))
+        self.files[file_id] = (self._file_json(file_id, name, data, action,
+                                               file_info), data)
+        return file_id
+
+    def data(self, name):
+        """ The data of the latest version of `name`. """
+        versions = [file for file in self.files.values()
+                    if file[0]['fileName'] == name]
+        return max(versions, key=lambda f: f[0]['uploadTimestamp'])[1]
+
+    def _file_json(self, file_id, name, data, action='upload',
+                   file_info=None, content_sha1=None):
+        return {
+            'accountId': 'account1',
+            'bucketId': self.BUCKET_ID,
+            'fileId': file_id,
+            'fileName': name,
+            'action': action,
+            'contentLength': len(data),
+            'contentSha1': content_sha1 or sha1(data).hexdigest(),
+            'contentType': 'b2/x-auto',
+            'fileInfo': file_info or {},
+            'uploadTimestamp': next(self._ids),
+        }
+
+    def _error(self, status, code='error'):
+        return web.json_response({'status': status, 'code': code,
+                                  'message': code}, status=status)
+
+    def _failure(self, name):
+        self.calls[name] += 1
+        statuses = self.fail.get(name)
+        if statuses:
+            status = statuses.pop(0)
+            return self._error(*(status if isinstance(status, tuple)
+                                 else (status,)))
+        return None
+
+    async def authorize(self, request):
+        failure = self._failure('b2_authorize_account')
+        if failure is not None:
+            return failure
+        self.token = 'token{}'.format(next(self._ids))
+        return web.json_response({
+            'accountId': 'account1',
+            'authorizationToken': self.token,
+            'apiUrl': self.url,
+            'downloadUrl': self.url,
+            'recommendedPartSize': 64 * 1024,
+            'absoluteMinimumPartSize': 5 * 1024,
+        })
+
+    async def api(self, request):
+        name = request.match_info['name']
+        failure = self._failure(name)
+        if failure is not None:
+            return failure
+        if request.headers.get('Authorization') != self.token:
+            return self._error(401, 'expired_auth_token')
+        handler = getattr(self, '_' + name[len('b2_'):], None)
+        if handler is None:
+            return self._error(400, 'bad_request')
+        return await handler(await request.json())
+
+    async def _list_buckets(self, params):
+        return web.json_response({'buckets': [{
+            'accountId': 'account1', 'bucketId': self.BUCKET_ID,
+            'bucketName': 'bucket', 'bucketType': 'allPrivate',
+            'bucketInfo': {}, 'lifecycleRules': [], 'corsRules': [],
+            'revision': 1,
+        }]})
+
+    async def _get_upload_url(self, params):
+        return web.json_response({
+            'uploadUrl': '{}/upload/{}'.format(self.url, params['bucketId']),
+            'authorizationToken': 'upload{}'.format(next(self._ids)),
+        })
+
+    async def _get_upload_part_url(self, params):
+        return web.json_response({
+            'uploadUrl': '{}/upload_part/{}'.format(self.url,
+                                                    params['fileId']),
+            'authorizationToken': 'upload{}'.format(next(self._ids)),
+        })
+
+    async def _list_file_names(self, params):
+        latest = {}
+        for file_json, _ in self.files.values():
+            name = file_json['fileName']
+            if name not in latest or (file_json['uploadTimestamp'] >
+                                      latest[name]['uploadTimestamp']):
+                latest[name] = file_json
+        prefix = params.get('prefix', '')
+        start = params.get('startFileName', '')
+        delimiter = params.get('delimiter')
+        entries, folders = [], set()
+        for name in sorted(latest):
+            if not name.startswith(prefix) or name < start or \
+                    latest[name]['action'] != 'upload':
+                continue
+            rest = name[len(prefix):]
+            if delimiter and delimiter in rest:
+                folder = prefix + rest[:rest.index(delimiter) + 1]
+                if folder not in folders and folder >= start:
+                    folders.add(folder)
+                    entries.append(self._file_json(None, folder, b'',
+                                                   'folder'))
+                continue
+            entries.append(latest[name])
+        return self._page(entries, params, {'nextFileName': 'fileName'})
+
+    async def _list_file_versions(self, params):
+        versions = sorted((file_json for file_json, _ in self.files.values()),
+                          key=lambda f: (f['fileName'],
+                                         -f['uploadTimestamp']))
+        prefix = params.get('prefix', '')
+        start = (params.get('startFileName', ''),
+                 params.get('startFileId'))
+        started = start[1] is None
+        entries = []
+        for version in versions:
+            if not version['fileName'].startswith(prefix) or \
+                    version['fileName'] < start[0]:
+                continue
+            started = started or version['fileId'] == start[1] or \
+                version['fileName'] > start[0]
+            if started:
+                entries.append(version)
+        return self._page(entries, params, {'nextFileName': 'fileName',
+                                            'nextFileId': 'fileId'})
+
+    def _page(self, entries, params, cursors):
+        count = params.get('maxFileCount', 100)
+        response = {'files': entries[:count]}
+        for key, field in cursors.items():
+            response[key] = (entries[count][field]
+                             if len(entries) > count else None)
+        return web.json_response(response)
+
+    async def _delete_file_version(self, params):
+        if self.files.pop(params['fileId'], None) is None:
+            return self._error(404, 'file_not_present')
+        return web.json_response({'fileId': params['fileId'],
+                                  'fileName': params['fileName']})
+
+    async def _hide_file(self, params):
+        file_id = self.add_file(params['fileName'], action='hide')
+        return web.json_response(self.files[file_id][0])
+
+    async def _get_file_info(self, params):
+        if params['fileId'] not in self.files:
+            return self._error(404, 'file_not_present')
+        return web.json_response(self.files[params['fileId']][0])
+
+    async def _copy_file(self, params):
+        if params['sourceFileId'] not in self.files:
+            return self._error(400, 'bad_request')
+        source, data = self.files[params['sourceFileId']]
+        content_type, file_info = source['contentType'], source['fileInfo']
+        if params.get('metadataDirective') == 'REPLACE':
+            content_type = params['contentType']
+            file_info = params.get('fileInfo', {})
+        file_id = self.add_file(params['fileName'], data,
+                                file_info=file_info)
+        self.files[file_id][0]['contentType'] = content_type
+        return web.json_response(self.files[file_id][0])
+
+    async def _copy_part(self, params):
+        if params['sourceFileId'] not in self.files:
+            return self._error(400, 'bad_request')
+        data = self.files[params['sourceFileId']][1]
+        start, end = self._range(params['range'], len(data))
+        data = data[start:end + 1]
+        number = params['partNumber']
+        content_sha1 = sha1(data).hexdigest()
+        self.large_files[params['largeFileId']]['parts'][number] = (
+            content_sha1, data)
+        return web.json_response({'fileId': params['largeFileId'],
+                                  'partNumber': number,
+                                  'contentLength': len(data),
+                                  'contentSha1': content_sha1})
+
+    async def _start_large_file(self, params):
+        file_id = 'large{}'.format(next(self._ids))
+        self.large_files[file_id] = {
+            'fileId': file_id,
+            'fileName': params['fileName'],
+            'fileInfo': params.get('fileInfo', {}),
+            'uploadTimestamp': next(self._ids),
+            'parts': {},
+        }
+        return web.json_response({'fileId': file_id})
+
+    async def _list_unfinished_large_files(self, params):
+        prefix = params.get('namePrefix', '')
+        files = [{key: value for key, value in large.items()
+                  if key != 'parts'}
+                 for large in self.large_files.values()
+                 if large['fileName'].startswith(prefix)]
+        return web.json_response({'files': files, 'nextFileId': None})
+
+    async def _list_parts(self, params):
+        parts = self.large_files[params['fileId']]['parts']
+        return web.json_response({
+            'parts': [{'partNumber': number,
+                       'contentLength': len(parts[number][1]),
+                       'contentSha1': parts[number][0]}
+                      for number in sorted(parts)],
+            'nextPartNumber': None,
+        })
+
+    async def _cancel_large_file(self, params):
+        self.large_files.pop(params['fileId'])
+        return web.json_response({'fileId': params['fileId']})
+
+    async def _finish_large_file(self, params):
+        large = self.large_files.pop(params['fileId'])
+        parts = large['parts']
+        numbers = sorted(parts)
+        if numbers != list(range(1, len(numbers) + 1)) or \
+                params['partSha1Array'] != [parts[n][0] for n in numbers]:
+            return self._error(400, 'bad_request')
+        data = b''.join(parts[number][1] for number in numbers)
+        file_json = self._file_json(params['fileId'], large['fileName'],
+                                    data, file_info=large['fileInfo'],
+                                    content_sha1='none')
+        self.files[params['fileId']] = (file_json, data)
+        return web.json_response(file_json)
+
+    async def _read_body(self, request):
+        """ The uploaded data and its SHA1, checked like B2 does. """
+        self.headers = request.headers
+        body = await request.read()
+        content_sha1 = request.headers['X-Bz-Content-Sha1']
+        if content_sha1 == 'hex_digits_at_end':
+            body, content_sha1 = body[:-40], body[-40:].decode()
+        if content_sha1 == 'do_not_verify':
+            content_sha1 = sha1(body).hexdigest()
+        if sha1(body).hexdigest() != content_sha1:
+            return None, None
+        return body, content_sha1
+
+    async def upload(self, request):
+        failure = self._failure('upload')
+        if failure is not None:
+            await request.read()
+            return failure
+        data, content_sha1 = await self._read_body(request)
+        if data is None:
+            return self._error(400, 'bad_request')
+        file_info = {key[len('X-Bz-Info-'):]: unquote(value)
+                     for key, value in request.headers.items()
+                     if key.startswith('X-Bz-Info-')}
+        file_id = self.add_file(unquote(request.headers['X-Bz-File-Name']),
+                                data, file_info=file_info)
+        return web.json_response(self.files[file_id][0])
+
+    async def upload_part(self, request):
+        failure = self._failure('upload_part')
+        if failure is not None:
+            await request.read()
+            return failure
+        data, content_sha1 = await self._read_body(request)
+        if data is None:
+            return self._error(400, 'bad_request')
+        file_id = request.match_info['file_id']
+        number = int(request.headers['X-Bz-Part-Number'])
+        self.large_files[file_id]['parts'][number] = (content_sha1, data)
+        return web.json_response({'fileId': file_id, 'partNumber': number,
+                                  'contentLength': len(data),
+                                  'contentSha1': content_sha1})
+
+    async def download(self, request):
+        failure = self._failure('download')
+        if failure is not None:
+            return failure
+        if request.headers.get('Authorization') != self.token:
+            return self._error(401, 'expired_auth_token')
+        if request.query['fileId'] not in self.files:
+            return self._error(404, 'file_not_present')
+        data = self.files[request.query['fileId']][1]
+        byte_range = request.headers.get('Range')
+        if byte_range is None:
+            return web.Response(body=data)
+        start, end = self._range(byte_range, len(data))
+        if start > end or end >= len(data):
+            return self._error(416, 'range_not_satisfiable')
+        return web.Response(body=data[start:end + 1], status=206, headers={
+            'Content-Range': 'bytes {}-{}/{}'.format(start, end, len(data))})
+
+    def _range(self, byte_range, size):
+        """ The inclusive (start, end) of a 'bytes=start-[end]' range. """
+        start, end = byte_range[len('bytes='):].split('-')
+        return int(start), int(end) if end else size - 1
@@ -0,0 +1,373 @@
+from aiob2.dedupe import DedupeIndex, ManifestIndex
+from aiob2.hash_cache import HashCache
+from hashlib import sha1
+from test.helpers import FakeB2, async_test
+import os
+import tempfile
+import unittest
+
+
+class TestUpload(unittest.TestCase):
+
+    @async_test
+    async def test_upload_file(self):
+        async with FakeB2() as fake:
+            bucket = await fake.bucket()
+            file = await bucket.upload_file(b'hello', 'dir/hello.txt',
+                                            file_info={'key': 'value'})
+            self.assertEqual(file.name, 'dir/hello.txt')
+            self.assertEqual(file.file_info, {'key': 'value'})
+            self.assertEqual(fake.data('dir/hello.txt'), b'hello')
+
+    @async_test
+    async def test_upload_reuses_upload_url(self):
+        async with FakeB2() as fake:
+            bucket = await fake.bucket()
+            for index in range(3):
+                await bucket.upload_file(b'data', 'file{}'.format(index))
+            self.assertEqual(fake.calls['b2_get_upload_url'], 1)
+
+    @async_test
+    async def test_upload_retries_on_a_fresh_url(self):
+        async with FakeB2() as fake:
+            bucket = await fake.bucket()
+            await bucket.upload_file(b'first', 'first')
+            fake.fail['upload'] = [503]
+            await bucket.upload_file(b'second', 'second')
+            self.assertEqual(fake.data('second'), b'second')
+            self.assertEqual(fake.calls['upload'], 3)
+            self.assertEqual(fake.calls['b2_get_upload_url'], 2)
+
+    @async_test
+    async def test_upload_many_reports_failures(self):
+        async with FakeB2() as fake:
+            bucket = await fake.bucket()
+            fake.fail['upload'] = [400]
+            sources = [('file{}'.format(index), b'data')
+                       for index in range(10)]
+            results = [result async for result in
+                       bucket.upload_many(sources, concurrency=3)]
+            self.assertEqual(len(results), 10)
+            failed = [result for result in results if result.error]
+            self.assertEqual(len(failed), 1)
+            self.assertEqual(len(fake.files), 9)
+
+
+class TestDeduplicate(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def _index(self):
+        index = DedupeIndex(os.path.join(self.directory, 'dedupe.sqlite'))
+        self.addCleanup(index.close)
+        return index
+
+    @async_test
+    async def test_copy_file(self):
+        async with FakeB2() as fake:
+            source_id = fake.add_file('source', b'data',
+                                      file_info={'key': 'value'})
+            bucket = await fake.bucket()
+            copy = await bucket.copy_file(source_id, '/copy')
+            self.assertEqual((copy.name, copy.file_info),
+                             ('copy', {'key': 'value'}))
+            self.assertEqual(fake.data('copy'), b'data')
+            copy = await bucket.copy_file(source_id, 'other',
+                                          mime_content_type='text/plain',
+                                          file_info={'n': 1})
+            self.assertEqual((copy.content_type, copy.file_info),
+                             ('text/plain', {'n': '1'}))
+            self.assertEqual(fake.calls['upload'], 0)
+
+    async def _deduplicate(self, index):
+        async with FakeB2() as fake:
+            bucket = await fake.bucket()
+            first = await bucket.upload_deduplicated(b'data', 'a', index)
+            second = await bucket.upload_deduplicated(b'data', 'b', index)
+            self.assertNotEqual(first.id, second.id)
+            self.assertEqual(fake.data('b'), b'data')
+            self.assertEqual(fake.calls['b2_copy_file'], 1)
+
+            # A deleted source is forgotten and the data uploaded again.
+            del fake.files[first.id]
+            third = await bucket.upload_deduplicated(b'data', 'c', index)
+            self.assertEqual(fake.data('c'), b'data')
+            self.assertEqual(fake.calls['b2_copy_file'], 2)
+            self.assertEqual(await index.lookup(
+                bucket, sha1(b'data').hexdigest()), third.id)
+            return fake
+
+    @async_test
+    async def test_dedupe_index(self):
+        fake = await self._deduplicate(self._index())
+        self.assertEqual(fake.calls['upload'], 2)
+
+    @async_test
+    async def test_manifest_index(self):
+        fake = await self._deduplicate(ManifestIndex())
+        manifest = '.aiob2-dedupe/' + sha1(b'data').hexdigest()
+        self.assertEqual(fake.data(manifest), b'')
+        # Two uploads of the data, each recorded in a manifest.
+        self.assertEqual(fake.calls['upload'], 4)
+
+    @async_test
+    async def test_hash_cache_skips_hashing(self):
+        path = os.path.join(self.directory, 'file')
+        with open(path, 'wb') as file:
+            file.write(b'data')
+        hash_cache = HashCache(os.path.join(self.directory, 'hashes'))
+        self.addCleanup(hash_cache.close)
+        index = self._index()
+        async with FakeB2() as fake:
+            bucket = await fake.bucket()
+            for name in ('a', 'b'):
+                with open(path, 'rb') as contents:
+                    await bucket.upload_deduplicated(contents, name, index,
+                                                     hash_cache=hash_cache)
+            self.assertEqual(bucket.connector.hashing.stats()['bytes'], 4)
+            self.assertEqual(fake.calls['upload'], 1)
+            self.assertEqual(fake.calls['b2_copy_file'], 1)
+
+
+class TestLargeFile(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(self.directory, 'large.bin')
+        self.data = os.urandom(5 * 64 * 1024 + 100)
+        with open(self.path, 'wb') as file:
+            file.write(self.data)
+
+    @async_test
+    async def test_upload_large_file(self):
+        async with FakeB2() as fake:
+            bucket = await fake.bucket()
+            with open(self.path, 'rb') as contents:
+                await bucket.upload_large_file(contents, 'large.bin',
+                                               concurrency=3)
+            self.assertEqual(fake.data('large.bin'), self.data)
+            self.assertEqual(fake.calls['upload_part'], 6)
+
+    async def _interrupted_upload(self, fake, bucket, hash_cache=None):
+        """ Upload the first parts, then fail part 4 for good. """
+        connector = bucket.connector
+        upload_part = connector.upload_part
+
+        async def failing_upload_part(file_id, contents, part_number,
+                                      **kwargs):
+            if part_number == 4:
+                raise RuntimeError('interrupted')
+            return await upload_part(file_id, contents, part_number,
+                                     **kwargs)
+
+        connector.upload_part = failing_upload_part
+        try:
+            with open(self.path, 'rb') as contents:
+                with self.assertRaises(RuntimeError):
+                    await bucket.upload_large_file(contents, 'large.bin',
+                                                   concurrency=1,
+                                                   hash_cache=hash_cache)
+        finally:
+            connector.upload_part = upload_part
+
+    @async_test
+    async def test_resume_uploads_only_missing_parts(self):
+        async with FakeB2() as fake:
+            bucket = await fake.bucket()
+            await self._interrupted_upload(fake, bucket)
+            self.assertEqual(len(fake.large_files), 1)
+            fake.calls.clear()
+            with open(self.path, 'rb') as contents:
+                await bucket.upload_large_file(contents, 'large.bin',
+                                               resume=True)
+            self.assertEqual(fake.calls['b2_start_large_file'], 0)
+            self.assertEqual(fake.calls['upload_part'], 3)
+            self.assertEqual(fake.data('large.bin'), self.data)
+
+    @async_test
+    async def test_resume_replaces_mismatched_parts(self):
+        async with FakeB2() as fake:
+            bucket = await fake.bucket()
+            await self._interrupted_upload(fake, bucket)
+            large_file = next(iter(fake.large_files.values()))
+            large_file['parts'][2] = ('0' * 40, b'x' * 64 * 1024)
+            fake.calls.clear()
+            with open(self.path, 'rb') as contents:
+                await bucket.upload_large_file(contents, 'large.bin',
+                                               resume=True)
+            self.assertEqual(fake.calls['upload_part'], 4)
+            self.assertEqual(fake.data('large.bin'), self.data)
+
+    @async_test
+    async def test_resume_verifies_cached_parts_without_hashing(self):
+        hash_cache = HashCache(os.path.join(self.directory, 'hashes'))
+        self.addCleanup(hash_cache.close)
+        async with FakeB2() as fake:
+            bucket = await fake.bucket()
+            await self._interrupted_upload(fake, bucket, hash_cache)
+            part_sha1s = hash_cache.lookup(self.path)[2]
+            self.assertEqual(part_sha1s[3:], [None, None, None])
+            self.assertNotIn(None, part_sha1s[:3])
+
+            hashed = []
+            hashing = bucket.connector.hashing
+            hash_range = hashing.hash_range
+
+            async def counting_hash_range(path, offset=0, size=None):
+                hashed.append(offset)
+                return await hash_range(path, offset, size)
+
+            hashing.hash_range = counting_hash_range
+            with open(self.path, 'rb') as contents:
+                await bucket.upload_large_file(contents, 'large.bin',
+                                               resume=True,
+                                               hash_cache=hash_cache)
+            self.assertEqual(hashed, [])
+            self.assertEqual(fake.data('large.bin'), self.data)
+            self.assertNotIn(None, hash_cache.lookup(self.path)[2])
+
+
+class TestList(unittest.TestCase):
+
+    NAMES = sorted(['a/1', 'a/2', 'b/1', 'b/c/1', 'top', 'z/1'] +
+                   ['m/{:02}'.format(index) for index in range(20)])
+
+    async def _bucket(self, fake):
+        for name in self.NAMES:
+            fake.add_file(name, name.encode())
+        return await fake.bucket()
+
+    @async_test
+    async def test_list_files_pages(self):
+        async with FakeB2() as fake:
+            bucket = await self._bucket(fake)
+            names = [file.name async for file in
+                     bucket.list_files(page_size=4)]
+            self.assertEqual(names, self.NAMES)
+            self.assertEqual(fake.calls['b2_list_file_names'], 7)
+
+    @async_test
+    async def test_list_files_limit_and_prefix(self):
+        async with FakeB2() as fake:
+            bucket = await self._bucket(fake)
+            names = [file.name async for file in
+                     bucket.list_files(prefix='m/', limit=5, page_size=2)]
+            self.assertEqual(names, ['m/{:02}'.format(index)
+                                     for index in range(5)])
+
+    @async_test
+    async def test_list_files_sharded(self):
+        async with FakeB2() as fake:
+            bucket = await self._bucket(fake)
+            for page_size in (3, 100):
+                names = [file.name async for file in
+                         bucket.list_files_sharded(page_size=page_size)]
+                self.assertEqual(names, self.NAMES)
+            names = [file.name async for file in bucket.list_files_sharded(
+                boundaries=['b', 'n'], ordered=False, page_size=3)]
+            self.assertEqual(sorted(names), self.NAMES)
+
+    @async_test
+    async def test_list_files_sharded_flat_bucket(self):
+        async with FakeB2() as fake:
+            names = ['file{:02}'.format(index) for index in range(30)]
+            for name in names:
+                fake.add_file(name)
+            bucket = await fake.bucket()
+            listed = [file.name async for file in
+                      bucket.list_files_sharded(page_size=10)]
+            self.assertEqual(listed, names)
+            # One page to look for folders, then a single plain listing.
+            self.assertLessEqual(fake.calls['b2_list_file_names'], 5)
+
+    @async_test
+    async def test_list_file_versions(self):
+        async with FakeB2() as fake:
+            old = fake.add_file('a', b'old')
+            new = fake.add_file('a', b'new')
+            fake.add_file('b', b'b')
+            bucket = await fake.bucket()
+            versions = [(file.name, file.id) async for file in
+                        bucket.list_file_versions(page_size=1)]
+            self.assertEqual(versions, [('a', new), ('a', old),
+                                        ('b', versions[2][1])])
+
+
+class TestPurge(unittest.TestCase):
+
+    async def _bucket(self, fake):
+        self.old = fake.add_file('p/a', b'old')
+        fake.add_file('p/a', b'new')
+        fake.add_file('p/b')
+        self.other = fake.add_file('q')
+        return await fake.bucket()
+
+    def _names(self, fake):
+        return sorted(json['fileName'] for json, _ in fake.files.values()
+                      if json['action'] == 'upload')
+
+    @async_test
+    async def test_delete_prefix(self):
+        async with FakeB2() as fake:
+            bucket = await self._bucket(fake)
+            progress = []
+            stats = await bucket.delete_prefix(
+                'p/', concurrency=2,
+                progress_listener=lambda stats: progress.append(dict(stats)))
+            self.assertEqual(stats, {'listed': 3, 'deleted': 3, 'failed': 0})
+            self.assertEqual(self._names(fake), ['q'])
+            self.assertEqual(len(progress), 3)
+
+    @async_test
+    async def test_delete_prefix_latest(self):
+        async with FakeB2() as fake:
+            bucket = await self._bucket(fake)
+            stats = await bucket.delete_prefix('p/', versions='latest')
+            self.assertEqual(stats, {'listed': 2, 'deleted': 2, 'failed': 0})
+            self.assertEqual(list(fake.files), [self.old, self.other])
+            with self.assertRaises(ValueError):
+                await bucket.delete_prefix('p/', versions='oldest')
+
+    @async_test
+    async def test_delete_prefix_dry_run(self):
+        async with FakeB2() as fake:
+            bucket = await self._bucket(fake)
+            stats = await bucket.delete_prefix('p/', dry_run=True)
+            self.assertEqual(stats, {'listed': 3, 'deleted': 0, 'failed': 0})
+            self.assertEqual(len(fake.files), 4)
+            self.assertEqual(fake.calls['b2_delete_file_version'], 0)
+
+    @async_test
+    async def test_delete_prefix_counts_failures(self):
+        async with FakeB2() as fake:
+            bucket = await self._bucket(fake)
+            fake.fail['b2_delete_file_version'] = [400, 503]
+            stats = await bucket.delete_prefix('p/', concurrency=1)
+            # The 503 is retried, the 400 is not.
+            self.assertEqual(stats, {'listed': 3, 'deleted': 2, 'failed': 1})
+            self.assertEqual(len(fake.files), 2)
+
+    @async_test
+    async def test_hide_prefix(self):
+        async with FakeB2() as fake:
+            bucket = await self._bucket(fake)
+            stats = await bucket.hide_prefix('p/', dry_run=True)
+            self.assertEqual(stats, {'listed': 2, 'hidden': 0, 'failed': 0})
+            self.assertEqual(fake.calls['b2_hide_file'], 0)
+            fake.fail['b2_hide_file'] = [400]
+            stats = await bucket.hide_prefix('p/', concurrency=1)
+            self.assertEqual(stats, {'listed': 2, 'hidden': 1, 'failed': 1})
+            names = [file.name async for file in bucket.list_files()]
+            self.assertEqual(len(names), 2)
+            self.assertIn('q', names)
+            # Hiding keeps every version.
+            self.assertEqual(len(self._names(fake)), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+from aiob2.concurrency import AdaptiveLimiter, limit_concurrency
+from aiob2.exceptions import B2RequestError, B2TooManyRequestsError
+from test.helpers import async_test
+from unittest import mock
+import asyncio
+import unittest
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch('aiob2.concurrency.time.monotonic',
+                             lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def complete(self, limiter, latency=1.0, error=None):
+        """ Run one operation taking `latency` seconds and failing with
+        `error`, if given.
+        """
+        try:
+            async with limiter.slot():
+                self.now += latency
+                if error is not None:
+                    raise error
+        except Exception as raised:
+            if raised is not error:
+                raise
+
+    @async_test
+    async def test_increases_while_throughput_holds(self):
+        limits = []
+        limiter = AdaptiveLimiter(initial=2, maximum=4,
+                                  listener=limits.append)
+        for _ in range(20):
+            await self.complete(limiter)
+        self.assertEqual(limits, [3, 4])
+        self.assertEqual(limiter.limit, 4)
+
+    @async_test
+    async def test_holds_when_throughput_drops(self):
+        limiter = AdaptiveLimiter(initial=2, latency_factor=100)
+        await self.complete(limiter)
+        await self.complete(limiter)
+        self.assertEqual(limiter.limit, 3)
+        for _ in range(3):
+            await self.complete(limiter, latency=2.0)
+        self.assertEqual(limiter.limit, 3)
+
+    @async_test
+    async def test_decreases_on_backoff_errors(self):
+        limiter = AdaptiveLimiter(initial=8)
+        await self.complete(limiter, error=B2TooManyRequestsError())
+        self.assertEqual(limiter.limit, 4)
+        await self.complete(limiter, error=asyncio.TimeoutError())
+        self.assertEqual(limiter.limit, 2)
+        self.assertEqual(limiter.in_flight, 0)
+
+    @async_test
+    async def test_ignores_other_errors(self):
+        limiter = AdaptiveLimiter(initial=8)
+        await self.complete(limiter, error=B2RequestError())
+        self.assertEqual(limiter.limit, 8)
+
+    @async_test
+    async def test_decreases_on_reported_congestion(self):
+        limiter = AdaptiveLimiter(initial=8)
+        count = [0]
+
+        async def operation():
+            async with limiter.slot(lambda: count[0]):
+                count[0] += 1
+
+        await operation()
+        self.assertEqual(limiter.limit, 4)
+
+    @async_test
+    async def test_decreases_on_latency_spike(self):
+        limiter = AdaptiveLimiter(initial=8, maximum=8)
+        for _ in range(10):
+            await self.complete(limiter, latency=1.0)
+        await self.complete(limiter, latency=5.0)
+        self.assertEqual(limiter.limit, 4)
+
+    @async_test
+    async def test_decreases_once_per_round_trip(self):
+        limiter = AdaptiveLimiter(initial=8, minimum=2)
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def throttled():
+            async with limiter.slot():
+                started.set()
+                await release.wait()
+                raise B2TooManyRequestsError()
+
+        tasks = [asyncio.ensure_future(throttled()) for _ in range(4)]
+        await started.wait()
+        self.now += 1
+        release.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.decreases, 1)
+        # An operation started after the decrease may decrease again.
+        await self.complete(limiter, error=B2TooManyRequestsError())
+        self.assertEqual(limiter.limit, 2)
+        await self.complete(limiter, error=B2TooManyRequestsError())
+        self.assertEqual(limiter.limit, 2)
+
+    @async_test
+    async def test_limits_operations_in_flight(self):
+        limiter = AdaptiveLimiter(initial=2, maximum=2)
+        running, peak = [0], [0]
+
+        async def operation(item):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0)
+            running[0] -= 1
+
+        handler, workers = limit_concurrency(operation, limiter)
+        self.assertEqual(workers, limiter.maximum)
+        await asyncio.gather(*[handler(item) for item in range(10)])
+        self.assertEqual(peak[0], 2)
+
+    def test_fixed_concurrency_is_unchanged(self):
+        async def handler(item):
+            pass
+        self.assertEqual(limit_concurrency(handler, 5), (handler, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
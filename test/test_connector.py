@@ -0,0 +1,226 @@
+from aiob2.auth_cache import AuthCache
+from aiob2.connector import DO_NOT_VERIFY, PRECOMPUTE_SHA1, _map_file
+from aiob2.exceptions import B2RequestError, B2UnauthorizedError
+from aiob2.utilities import StreamWithHashProgress
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+from test.helpers import FakeB2, async_test
+import asyncio
+import io
+import os
+import tempfile
+import unittest
+
+
+class Unseekable(io.RawIOBase):
+    """ A readable stream that cannot seek. """
+
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.data.readinto(buffer)
+
+
+class TestReauthorize(unittest.TestCase):
+
+    @async_test
+    async def test_concurrent_expired_tokens_reauthorize_once(self):
+        async with FakeB2() as fake:
+            b2 = await fake.client()
+            fake.token = 'rotated'
+            await asyncio.gather(*[b2.list_buckets().__anext__()
+                                   for _ in range(10)])
+            self.assertEqual(fake.calls['b2_authorize_account'], 2)
+            self.assertEqual(b2.connector.auth_token, fake.token)
+
+    @async_test
+    async def test_refresh_keeps_newer_token(self):
+        async with FakeB2() as fake:
+            b2 = await fake.client()
+            stale = b2.connector.auth_token
+            await b2.connector.reauthorize(stale_token=stale)
+            await b2.connector.reauthorize(stale_token=stale)
+            self.assertEqual(fake.calls['b2_authorize_account'], 2)
+
+    @async_test
+    async def test_expired_token_replays_downloads(self):
+        data = os.urandom(3 * 64 * 1024)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'download.bin')
+            async with FakeB2() as fake:
+                file_id = fake.add_file('file', data)
+                bucket = await fake.bucket()
+                file = await bucket.get_file(file_id=file_id)
+                fake.token = 'rotated'
+
+                async def iterate():
+                    return b''.join([chunk async for chunk in
+                                     file.iter_chunks()])
+
+                chunks, _ = await asyncio.gather(
+                    iterate(), file.download_parallel(path, concurrency=3))
+                self.assertEqual(chunks, data)
+                with open(path, 'rb') as downloaded:
+                    self.assertEqual(downloaded.read(), data)
+                self.assertEqual(fake.calls['b2_authorize_account'], 2)
+                self.assertEqual(file.connector.retry_counts['download'], 0)
+
+    @async_test
+    async def test_expired_upload_token_replays_upload(self):
+        async with FakeB2() as fake:
+            bucket = await fake.bucket()
+            fake.fail['upload'] = [(401, 'expired_auth_token')]
+            await bucket.upload_file(io.BytesIO(b'data'), 'file',
+                                     content_length=4)
+            self.assertEqual(fake.data('file'), b'data')
+            self.assertEqual(fake.calls['upload'], 2)
+
+    @async_test
+    async def test_expired_upload_token_fails_unrewindable_stream(self):
+        async with FakeB2() as fake:
+            bucket = await fake.bucket()
+            fake.fail['upload'] = [(401, 'expired_auth_token')]
+            with self.assertRaises(B2UnauthorizedError):
+                await asyncio.wait_for(bucket.upload_file(
+                    Unseekable(b'data'), 'file', content_length=4), 10)
+            self.assertEqual(fake.calls['upload'], 1)
+
+
+class TestUploadBody(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'file')
+        self.data = os.urandom(100000)
+        with open(self.path, 'wb') as file:
+            file.write(self.data)
+        self.sha1 = sha1(self.data).hexdigest()
+
+    def test_map_file(self):
+        self.assertIs(_map_file(self.data, 10), self.data)
+        with open(self.path, 'rb') as file:
+            file.seek(1000)
+            mapped = _map_file(file, 500)
+            self.assertIsInstance(mapped, memoryview)
+            self.assertEqual(mapped, self.data[1000:1500])
+            mapped.release()
+        self.assertIsNone(_map_file(io.BytesIO(self.data), 10))
+
+    @async_test
+    async def test_create_body(self):
+        async with FakeB2() as fake:
+            connector = (await fake.client()).connector
+            body = connector._create_body(self.data, len(self.data), None)
+            self.assertIsInstance(body, StreamWithHashProgress)
+            self.assertTrue(body.hash_at_end)
+            body = connector._create_body(self.data, len(self.data),
+                                          self.sha1)
+            self.assertIs(body, self.data)
+            with open(self.path, 'rb') as file:
+                body = connector._create_body(file, len(self.data),
+                                              self.sha1)
+                self.assertEqual(body, self.data)
+                body.release()
+                body = connector._create_body(file, len(self.data),
+                                              self.sha1, print)
+                self.assertIsInstance(body, StreamWithHashProgress)
+                self.assertFalse(body.hash_at_end)
+            body = connector._create_body(io.BytesIO(self.data),
+                                          len(self.data), DO_NOT_VERIFY)
+            self.assertIsInstance(body, StreamWithHashProgress)
+            self.assertFalse(body.hash_at_end)
+
+    @async_test
+    async def test_upload_with_sha1_in_header(self):
+        async with FakeB2() as fake:
+            b2 = await fake.client()
+            connector = b2.connector
+            with open(self.path, 'rb') as file:
+                for index, content_sha1 in enumerate(
+                        [self.sha1, PRECOMPUTE_SHA1, DO_NOT_VERIFY]):
+                    for contents in (self.data, io.BytesIO(self.data), file):
+                        file.seek(0)
+                        name = 'file{}'.format(index)
+                        response = await connector.upload_file(
+                            fake.BUCKET_ID, contents, name,
+                            content_length=len(self.data),
+                            content_sha1=content_sha1)
+                        self.assertEqual(response['contentSha1'], self.sha1)
+                        self.assertEqual(fake.data(name), self.data)
+            self.assertEqual(fake.headers['X-Bz-Content-Sha1'],
+                             DO_NOT_VERIFY)
+            with self.assertRaises(B2RequestError):
+                await connector.upload_file(fake.BUCKET_ID, self.data,
+                                            'bad', content_sha1='0' * 40)
+
+    @async_test
+    async def test_precompute_sha1(self):
+        async with FakeB2() as fake:
+            connector = (await fake.client()).connector
+            with open(self.path, 'rb') as file:
+                file.seek(10)
+                self.assertEqual(await connector.precompute_sha1(file, 20),
+                                 sha1(self.data[10:30]).hexdigest())
+                self.assertEqual(file.tell(), 10)
+            stream = io.BytesIO(self.data)
+            stream.seek(10)
+            self.assertEqual(await connector.precompute_sha1(stream),
+                             sha1(self.data[10:]).hexdigest())
+            self.assertEqual(stream.tell(), 10)
+            self.assertEqual(connector.hashing.stats()['bytes'],
+                             20 + len(self.data) - 10)
+            with self.assertRaises(ValueError):
+                await connector.precompute_sha1(Unseekable(self.data))
+
+
+class TestAuthCache(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'auth.json')
+
+    @async_test
+    async def test_clients_share_one_authorization(self):
+        # Few executor threads, so waiting for the lock must not hold one.
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(2))
+        async with FakeB2() as fake:
+            shared = AuthCache(self.path)
+            caches = [AuthCache(self.path) for _ in range(3)] + [shared] * 3
+            clients = await asyncio.wait_for(asyncio.gather(
+                *[fake.client(auth_cache=cache) for cache in caches]), 10)
+            self.assertEqual(fake.calls['b2_authorize_account'], 1)
+            tokens = {client.connector.auth_token for client in clients}
+            self.assertEqual(tokens, {fake.token})
+
+    @async_test
+    async def test_waits_for_other_processes(self):
+        async with FakeB2() as fake:
+            cache = AuthCache(self.path)
+            lock_file = cache.acquire()
+            client = asyncio.ensure_future(fake.client(auth_cache=cache))
+            await asyncio.sleep(0.2)
+            self.assertFalse(client.done())
+            cache.release(lock_file)
+            await asyncio.wait_for(client, 5)
+            self.assertEqual(fake.calls['b2_authorize_account'], 1)
+
+    def test_keys_are_not_stored(self):
+        cache = AuthCache(self.path)
+        cache.store('key-id', 'secret-key', {'authorizationToken': 't'})
+        with open(self.path) as file:
+            contents = file.read()
+        self.assertNotIn('secret-key', contents)
+        self.assertEqual(cache.load('key-id', 'secret-key')[0],
+                         {'authorizationToken': 't'})
+        self.assertEqual(cache.load('key-id', 'other'), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
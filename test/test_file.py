@@ -0,0 +1,291 @@
+from aiob2.concurrency import AdaptiveLimiter
+from aiob2.connector import check_download
+from aiob2.exceptions import B2HashMismatchError, B2OutOfRangeError
+from aiob2.exceptions import B2RequestError
+from test.helpers import FakeB2, async_test
+import asyncio
+import io
+import os
+import tempfile
+import unittest
+
+
+class TestDownload(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'download.bin')
+        self.data = os.urandom(5 * 64 * 1024 + 100)
+
+    async def _file(self, fake, data=None):
+        file_id = fake.add_file('file', self.data if data is None else data)
+        bucket = await fake.bucket()
+        return await bucket.get_file(file_id=file_id)
+
+    def _read(self):
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+    @async_test
+    async def test_download(self):
+        async with FakeB2() as fake:
+            file = await self._file(fake)
+            async with file.download() as response:
+                await check_download(response)
+                self.assertEqual(await response.read(), self.data)
+
+    @async_test
+    async def test_download_range(self):
+        async with FakeB2() as fake:
+            file = await self._file(fake)
+            for start, end, expected in ((2, 5, self.data[2:6]),
+                                         (None, 9, self.data[:10]),
+                                         (100, None, self.data[100:])):
+                async with file.download(start, end) as response:
+                    await check_download(response)
+                    self.assertEqual(response.status, 206)
+                    self.assertEqual(await response.read(), expected)
+
+    @async_test
+    async def test_download_out_of_range(self):
+        async with FakeB2() as fake:
+            file = await self._file(fake)
+            for start, end in ((-1, 5), (6, 5),
+                               (0, len(self.data)), (len(self.data), None)):
+                with self.assertRaises(B2OutOfRangeError):
+                    file.download(start, end)
+            self.assertEqual(fake.calls['download'], 0)
+            # B2 answers 416 for a range it cannot serve.
+            async with file.connector.download_file(
+                    file.id, (len(self.data), None)) as response:
+                with self.assertRaises(B2OutOfRangeError):
+                    await check_download(response)
+
+    @async_test
+    async def test_download_parallel(self):
+        async with FakeB2() as fake:
+            file = await self._file(fake)
+            await file.download_parallel(self.path, concurrency=3)
+            self.assertEqual(self._read(), self.data)
+            self.assertEqual(fake.calls['download'], 6)
+
+    @async_test
+    async def test_download_parallel_retries_failed_ranges(self):
+        async with FakeB2() as fake:
+            file = await self._file(fake)
+            fake.fail['download'] = [503, 500]
+            await file.download_parallel(self.path, part_size=100 * 1024)
+            self.assertEqual(self._read(), self.data)
+            self.assertEqual(fake.calls['download'], 6)
+            self.assertEqual(file.connector.retry_counts['download'], 2)
+
+    @async_test
+    async def test_download_parallel_overwrites_existing_file(self):
+        with open(self.path, 'wb') as existing:
+            existing.write(b'x' * (2 * len(self.data)))
+        async with FakeB2() as fake:
+            file = await self._file(fake)
+            await file.download_parallel(self.path)
+            self.assertEqual(self._read(), self.data)
+
+    @async_test
+    async def test_download_parallel_checks_sha1(self):
+        async with FakeB2() as fake:
+            file = await self._file(fake)
+            json, data = fake.files[file.id]
+            fake.files[file.id] = (json, b'X' + data[1:])
+            with self.assertRaises(B2HashMismatchError):
+                await file.download_parallel(self.path)
+            await file.download_parallel(self.path, verify=False)
+            self.assertEqual(self._read(), b'X' + self.data[1:])
+
+    @async_test
+    async def test_large_file_sha1(self):
+        async with FakeB2() as fake:
+            file = await self._file(fake)
+            file.content_sha1 = 'none'
+            self.assertIsNone(file.expected_sha1)
+            file.file_info = {'large_file_sha1': 'a' * 40}
+            self.assertEqual(file.expected_sha1, 'a' * 40)
+            with self.assertRaises(B2HashMismatchError):
+                await file.download_parallel(self.path)
+
+
+class TestCopy(unittest.TestCase):
+
+    def setUp(self):
+        self.data = os.urandom(5 * 64 * 1024 + 100)
+
+    async def _file(self, fake, data=None):
+        file_id = fake.add_file('source', self.data if data is None else data,
+                                file_info={'key': 'value'})
+        bucket = await fake.bucket()
+        return await bucket.get_file(file_id=file_id)
+
+    @async_test
+    async def test_copy_small_file(self):
+        async with FakeB2() as fake:
+            file = await self._file(fake, b'data')
+            copy = await file.copy_to('copy')
+            self.assertEqual(fake.data('copy'), b'data')
+            self.assertEqual(copy.file_info, {'key': 'value'})
+            self.assertEqual(fake.calls['b2_copy_file'], 1)
+            self.assertEqual(fake.calls['b2_copy_part'], 0)
+
+    @async_test
+    async def test_copy_large_file_in_parts(self):
+        async with FakeB2() as fake:
+            file = await self._file(fake)
+            copy = await file.copy_to('copy', concurrency=3)
+            self.assertEqual(fake.data('copy'), self.data)
+            self.assertEqual(copy.file_info, {'key': 'value'})
+            self.assertEqual(fake.calls['b2_copy_part'], 6)
+            self.assertEqual(fake.calls['b2_copy_file'], 0)
+            copy = await file.copy_to('limited', part_size=100 * 1024,
+                                      concurrency=AdaptiveLimiter(initial=2))
+            self.assertEqual(fake.data('limited'), self.data)
+
+    @async_test
+    async def test_failed_copy_cancels_large_file(self):
+        async with FakeB2() as fake:
+            file = await self._file(fake)
+            fake.fail['b2_copy_part'] = [400]
+            with self.assertRaises(B2RequestError):
+                await file.copy_to('copy', concurrency=2)
+            self.assertEqual(fake.calls['b2_cancel_large_file'], 1)
+            self.assertEqual(fake.large_files, {})
+            self.assertNotIn('copy', [json['fileName'] for json, _ in
+                                      fake.files.values()])
+
+
+class TestStreamingDownload(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'download.bin')
+        self.data = os.urandom(3 * 64 * 1024 + 100)
+
+    async def _file(self, fake, corrupt=False):
+        file_id = fake.add_file('file', self.data)
+        if corrupt:
+            json, data = fake.files[file_id]
+            fake.files[file_id] = (json, b'X' + data[1:])
+        bucket = await fake.bucket()
+        return await bucket.get_file(file_id=file_id)
+
+    @async_test
+    async def test_iter_chunks(self):
+        async with FakeB2() as fake:
+            file = await self._file(fake)
+            chunks = [chunk async for chunk in
+                      file.iter_chunks(chunk_size=64 * 1024)]
+            self.assertEqual(b''.join(chunks), self.data)
+            self.assertLessEqual(max(len(chunk) for chunk in chunks),
+                                 64 * 1024)
+
+    @async_test
+    async def test_iter_chunks_hashes_in_batches(self):
+        async with FakeB2() as fake:
+            file = await self._file(fake)
+            hashing = file.connector.hashing
+            hashing.batch_size = 128 * 1024
+            update = hashing.update
+            batches = []
+
+            async def counting_update(hasher, blocks):
+                batches.append(sum(len(block) for block in blocks))
+                await update(hasher, blocks)
+
+            hashing.update = counting_update
+            chunks = [chunk async for chunk in
+                      file.iter_chunks(chunk_size=16 * 1024)]
+            self.assertEqual(b''.join(chunks), self.data)
+            self.assertEqual(sum(batches), len(self.data))
+            self.assertLess(len(batches), len(chunks))
+            self.assertEqual(hashing.stats()['bytes'], len(self.data))
+
+    @async_test
+    async def test_iter_chunks_limits_progress_calls(self):
+        async with FakeB2() as fake:
+            file = await self._file(fake)
+            progress = []
+            chunks = [chunk async for chunk in file.iter_chunks(
+                chunk_size=16 * 1024, progress_listener=progress.append,
+                progress_bytes=64 * 1024, progress_interval=3600)]
+            self.assertGreater(len(chunks), len(progress))
+            self.assertEqual(progress[-1], len(self.data))
+            steps = [after - before for before, after
+                     in zip([0] + progress, progress[:-1])]
+            self.assertTrue(all(step >= 64 * 1024 for step in steps))
+
+    @async_test
+    async def test_iter_chunks_checks_sha1_after_last_chunk(self):
+        async with FakeB2() as fake:
+            file = await self._file(fake, corrupt=True)
+            received = []
+            with self.assertRaises(B2HashMismatchError):
+                async for chunk in file.iter_chunks():
+                    received.append(chunk)
+            self.assertEqual(len(b''.join(received)), len(self.data))
+            chunks = [chunk async for chunk in file.iter_chunks(verify=False)]
+            self.assertEqual(b''.join(chunks), b'X' + self.data[1:])
+
+    @async_test
+    async def test_download_to_path(self):
+        async with FakeB2() as fake:
+            file = await self._file(fake)
+            await file.download_to(self.path, chunk_size=10000)
+            with open(self.path, 'rb') as downloaded:
+                self.assertEqual(downloaded.read(), self.data)
+
+    @async_test
+    async def test_download_to_writers(self):
+        class Writer():
+            def __init__(self):
+                self.buffer = io.BytesIO()
+
+            def write(self, chunk):
+                self.buffer.write(chunk)
+
+        class AsyncWriter(Writer):
+            async def write(self, chunk):
+                await asyncio.sleep(0)
+                self.buffer.write(chunk)
+
+        async with FakeB2() as fake:
+            file = await self._file(fake)
+            for writer in (Writer(), AsyncWriter()):
+                await file.download_to(writer)
+                self.assertEqual(writer.buffer.getvalue(), self.data)
+
+    @async_test
+    async def test_download_to_checks_sha1(self):
+        async with FakeB2() as fake:
+            file = await self._file(fake, corrupt=True)
+            with self.assertRaises(B2HashMismatchError):
+                await file.download_to(self.path)
+
+
+class TestFileEntry(unittest.TestCase):
+
+    @async_test
+    async def test_file_info_is_read_only(self):
+        async with FakeB2() as fake:
+            fake.add_file('file', b'data', file_info={'key': 'value'})
+            bucket = await fake.bucket()
+            entry, = [entry async for entry in
+                      bucket.list_files(lightweight=True)]
+            self.assertEqual(entry.file_info, {'key': 'value'})
+            with self.assertRaises(TypeError):
+                entry.file_info['key'] = 'changed'
+            file = entry.to_file()
+            file.file_info['key'] = 'changed'
+            self.assertEqual(entry.file_info, {'key': 'value'})
+            self.assertEqual(entry.to_json()['fileInfo'], {'key': 'value'})
+            self.assertEqual(file.content_sha1, entry.content_sha1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+from aiob2.exceptions import B2RequestError, B2ServiceUnavailableError
+from aiob2.exceptions import B2UnauthorizedError
+from aiob2.pool import UploadUrlPool
+from test.helpers import async_test
+import aiohttp
+import asyncio
+import unittest
+
+
+class TestUploadUrlPool(unittest.TestCase):
+
+    def setUp(self):
+        self.fetched = 0
+
+        async def fetch():
+            self.fetched += 1
+            return ('url{}'.format(self.fetched), 'token')
+
+        self.pool = UploadUrlPool(fetch, size=2)
+
+    async def use(self, error=None):
+        """ Check out a pair, raising `error` inside the block. """
+        try:
+            async with self.pool.checkout() as pair:
+                if error is not None:
+                    raise error
+                return pair
+        except BaseException as raised:
+            if raised is not error:
+                raise
+
+    @async_test
+    async def test_reuses_released_pairs(self):
+        first = await self.use()
+        second = await self.use()
+        self.assertEqual(first, second)
+        self.assertEqual(self.pool.stats()['hits'], 1)
+        self.assertEqual(self.pool.stats()['misses'], 1)
+
+    @async_test
+    async def test_keeps_at_most_size_idle_pairs(self):
+        pairs = [await self.pool.acquire() for _ in range(3)]
+        for pair in pairs:
+            self.pool.release(pair)
+        self.assertEqual(len(self.pool), 2)
+
+    @async_test
+    async def test_discards_on_upload_errors(self):
+        errors = [B2UnauthorizedError(), B2ServiceUnavailableError(),
+                  aiohttp.ClientConnectionError(), asyncio.TimeoutError(),
+                  asyncio.CancelledError()]
+        for error in errors:
+            await self.use(error)
+            self.assertEqual(len(self.pool), 0, error)
+        self.assertEqual(self.pool.stats()['discarded'], len(errors))
+        self.assertEqual(self.fetched, len(errors))
+
+    @async_test
+    async def test_keeps_pair_on_unrelated_errors(self):
+        for error in (B2RequestError(), OSError(), ValueError()):
+            await self.use(error)
+            self.assertEqual(len(self.pool), 1, error)
+        self.assertEqual(self.fetched, 1)
+        self.assertEqual(self.pool.stats()['discarded'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
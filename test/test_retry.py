@@ -0,0 +1,78 @@
+from aiob2.exceptions import B2ServiceUnavailableError, B2RequestError
+from aiob2.retry import RetryPolicy
+from test.helpers import async_test
+from unittest import mock
+import unittest
+
+
+class TestGetDelay(unittest.TestCase):
+
+    def test_exponential_backoff(self):
+        policy = RetryPolicy(base_delay=1.0, max_delay=64.0, jitter=0.0)
+        delays = [policy.get_delay(attempt) for attempt in range(1, 9)]
+        self.assertEqual(delays, [1, 2, 4, 8, 16, 32, 64, 64])
+
+    def test_jitter_reduces_delay(self):
+        policy = RetryPolicy(base_delay=4.0, jitter=0.5)
+        with mock.patch('random.random', return_value=1.0):
+            self.assertEqual(policy.get_delay(1), 2.0)
+        with mock.patch('random.random', return_value=0.0):
+            self.assertEqual(policy.get_delay(1), 4.0)
+
+    def test_retry_after_overrides_backoff(self):
+        policy = RetryPolicy(base_delay=1.0)
+        error = B2ServiceUnavailableError()
+        error.retry_after = 7.0
+        self.assertEqual(policy.get_delay(3, error), 7.0)
+
+
+class TestCall(unittest.TestCase):
+
+    def setUp(self):
+        self.attempts = 0
+        self.retries = []
+
+    def failing(self, failures, error_class=B2ServiceUnavailableError):
+        async def func():
+            self.attempts += 1
+            if self.attempts <= failures:
+                raise error_class()
+            return 'done'
+        return func
+
+    def on_retry(self, error, attempt, delay):
+        self.retries.append((type(error), attempt, delay))
+
+    @async_test
+    async def test_retries_until_success(self):
+        policy = RetryPolicy(base_delay=0.0)
+        result = await policy.call(self.failing(2), on_retry=self.on_retry)
+        self.assertEqual(result, 'done')
+        self.assertEqual(self.attempts, 3)
+        self.assertEqual([attempt for _, attempt, _ in self.retries], [1, 2])
+
+    @async_test
+    async def test_gives_up_after_max_attempts(self):
+        policy = RetryPolicy(max_attempts=3, base_delay=0.0)
+        with self.assertRaises(B2ServiceUnavailableError):
+            await policy.call(self.failing(5), on_retry=self.on_retry)
+        self.assertEqual(self.attempts, 3)
+        self.assertEqual(len(self.retries), 2)
+
+    @async_test
+    async def test_does_not_retry_other_errors(self):
+        policy = RetryPolicy(base_delay=0.0)
+        with self.assertRaises(B2RequestError):
+            await policy.call(self.failing(1, B2RequestError))
+        self.assertEqual(self.attempts, 1)
+
+    @async_test
+    async def test_max_attempts_one_disables_retries(self):
+        policy = RetryPolicy(max_attempts=1)
+        with self.assertRaises(B2ServiceUnavailableError):
+            await policy.call(self.failing(1))
+        self.assertEqual(self.attempts, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
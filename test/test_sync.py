@@ -0,0 +1,99 @@
+from aiob2.sync import MTIME_KEY, PARTIAL_SUFFIX, LocalFile
+from aiob2.sync import merge, sync_to_bucket, sync_to_directory, walk_local
+from test.helpers import FakeB2, async_test
+from unittest import mock
+import aiohttp
+import os
+import tempfile
+import unittest
+
+
+class Remote():
+
+    def __init__(self, name):
+        self.name = name
+
+
+async def listing(names):
+    for name in names:
+        yield Remote(name)
+
+
+class TestSyncOrder(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, data=b''):
+        path = os.path.join(self.directory, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(data)
+
+    def test_walk_local_uses_b2_name_order(self):
+        # '-' < '/' < '0' in UTF-8, so 'a-b' and 'a0' surround 'a/...' even
+        # though a plain directory walk would list 'a/' first or last.
+        for name in ('a0', 'a/x', 'a-b', 'a/y/z', 'b', 'é',
+                     'c' + PARTIAL_SUFFIX):
+            self.write(name, b'data')
+        names = [local.name for local in walk_local(self.directory)]
+        self.assertEqual(names, ['a-b', 'a/x', 'a/y/z', 'a0', 'b', 'é'])
+
+    def test_walk_local_records_size_and_mtime(self):
+        self.write('file', b'12345')
+        path = os.path.join(self.directory, 'file')
+        os.utime(path, ns=(1500000000123000000, 1500000000123000000))
+        self.assertEqual(list(walk_local(self.directory)),
+                         [LocalFile('file', path, 5, 1500000000123)])
+
+    @async_test
+    async def test_merge(self):
+        local = [LocalFile(name, None, 0, 0) for name in ('a', 'c', 'd')]
+        remote = listing(['p/a', 'p/b', 'p/d', 'p/e', 'p/folder/'])
+        merged = [(name, local is not None, remote is not None)
+                  async for name, local, remote in merge(local, remote, 'p/')]
+        self.assertEqual(merged, [('a', True, True), ('b', False, True),
+                                  ('c', True, False), ('d', True, True),
+                                  ('e', False, True)])
+
+
+class TestSync(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    @async_test
+    async def test_to_bucket_uploads_only_changes(self):
+        for name in ('a', 'b'):
+            with open(os.path.join(self.directory, name), 'wb') as file:
+                file.write(name.encode())
+        async with FakeB2() as fake:
+            bucket = await fake.bucket()
+            stats = await sync_to_bucket(self.directory, bucket, 'backup/')
+            self.assertEqual(stats['uploaded'], 2)
+            stats = await sync_to_bucket(self.directory, bucket, 'backup/')
+            self.assertEqual(stats, {'unchanged': 2})
+            self.assertEqual(fake.data('backup/a'), b'a')
+
+    @async_test
+    async def test_network_errors_fail_single_files(self):
+        async with FakeB2() as fake:
+            for name in ('a', 'b', 'c'):
+                fake.add_file(name, name.encode(),
+                              file_info={MTIME_KEY: '1000'})
+            bucket = await fake.bucket()
+
+            async def truncated(self, *args, **kwargs):
+                raise aiohttp.ClientPayloadError('truncated')
+
+            with mock.patch('aiob2.sync.Sync._download', truncated):
+                stats = await sync_to_directory(bucket, self.directory)
+            self.assertEqual(stats, {'failed': 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+from aiob2.throttle import Throttle, TokenBucket, endpoint_class
+from test.helpers import FakeB2, async_test
+from unittest import mock
+import asyncio
+import time
+import unittest
+
+
+# asyncio.sleep itself, which the tests replace with FakeClock.sleep.
+real_sleep = asyncio.sleep
+
+
+class FakeClock():
+    """ time.monotonic and asyncio.sleep that advance a counter. """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.slept.append(delay)
+        self.now += delay
+        await real_sleep(0)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        for target, replacement in (
+                ('aiob2.throttle.time.monotonic', self.clock.monotonic),
+                ('aiob2.throttle.asyncio.sleep', self.clock.sleep)):
+            patcher = mock.patch(target, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @async_test
+    async def test_no_rate_never_waits(self):
+        bucket = TokenBucket()
+        for _ in range(100):
+            await bucket.acquire()
+        self.assertEqual(self.clock.slept, [])
+
+    @async_test
+    async def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=10)
+        for _ in range(10):
+            await bucket.acquire()
+        self.assertEqual(self.clock.slept, [])
+        await bucket.acquire()
+        self.assertAlmostEqual(self.clock.slept[0], 0.1)
+
+    @async_test
+    async def test_large_amounts_pass_at_the_rate(self):
+        bucket = TokenBucket(rate=100, burst=10)
+        await bucket.acquire(210)
+        self.assertAlmostEqual(sum(self.clock.slept), 2.0)
+        self.assertAlmostEqual(bucket.waited, 2.0)
+
+    @async_test
+    async def test_refills_over_time(self):
+        bucket = TokenBucket(rate=10)
+        await bucket.acquire(10)
+        self.clock.now += 0.5
+        await bucket.acquire(5)
+        self.assertEqual(self.clock.slept, [])
+
+    @async_test
+    async def test_waiting_callers_follow_rate_changes(self):
+        bucket = TokenBucket(rate=10, burst=1)
+        await bucket.acquire()
+        waiter = asyncio.ensure_future(bucket.acquire(20))
+        await real_sleep(0)
+        self.assertEqual(self.clock.slept, [1.0])
+        bucket.rate = 100
+        await waiter
+        # The first second refilled 10 units, the other 10 came at 100/s.
+        self.assertAlmostEqual(sum(self.clock.slept), 1.1)
+
+    def test_observed_rate(self):
+        bucket = TokenBucket()
+        bucket._record(50)
+        self.assertEqual(bucket.observed_rate(), 10.0)
+        self.clock.now += 10
+        self.assertEqual(bucket.observed_rate(), 0.0)
+
+
+class TestThrottle(unittest.TestCase):
+
+    @async_test
+    async def test_back_off_halves_and_restores_rate(self):
+        throttle = Throttle(api_rate=20, backoff_time=0.05)
+        throttle.back_off('api')
+        self.assertEqual(throttle.requests['api'].rate, 10)
+        throttle.back_off('api')
+        self.assertEqual(throttle.requests['api'].rate, 5)
+        self.assertEqual(throttle.stats()['backoffs'], {'api': 2})
+        await asyncio.sleep(0.1)
+        self.assertEqual(throttle.requests['api'].rate, 20)
+
+    @async_test
+    async def test_back_off_without_limit_uses_observed_rate(self):
+        throttle = Throttle(backoff_time=0.05)
+        for _ in range(50):
+            await throttle.request('upload')
+        throttle.back_off('upload')
+        self.assertEqual(throttle.requests['upload'].rate, 5.0)
+        await asyncio.sleep(0.1)
+        self.assertIsNone(throttle.requests['upload'].rate)
+
+    @async_test
+    async def test_back_off_once_per_round_trip(self):
+        throttle = Throttle(api_rate=50)
+        sent = time.monotonic()
+        for _ in range(16):
+            throttle.back_off('api', sent)
+        self.assertEqual(throttle.requests['api'].rate, 25)
+        throttle.back_off('api', time.monotonic())
+        self.assertEqual(throttle.requests['api'].rate, 12.5)
+        self.assertEqual(throttle.stats()['backoffs'], {'api': 2})
+
+    @async_test
+    async def test_concurrent_429s_back_off_once(self):
+        async with FakeB2() as fake:
+            throttle = Throttle(api_rate=50)
+            b2 = await fake.client(throttle=throttle)
+            fake.fail['b2_list_buckets'] = [429] * 8
+            await asyncio.gather(*[b2.list_buckets().__anext__()
+                                   for _ in range(8)])
+            self.assertEqual(throttle.stats()['backoffs'], {'api': 1})
+            self.assertEqual(throttle.requests['api'].rate, 25)
+
+    @async_test
+    async def test_set_rate_cancels_back_off(self):
+        throttle = Throttle(api_rate=20, backoff_time=0.05)
+        throttle.back_off('api')
+        throttle.set_rate('api', 50)
+        await asyncio.sleep(0.1)
+        self.assertEqual(throttle.requests['api'].rate, 50)
+
+    def test_endpoint_class(self):
+        self.assertEqual(endpoint_class('upload_part'), 'upload')
+        self.assertEqual(endpoint_class('download'), 'download')
+        self.assertEqual(endpoint_class('/b2_list_file_names'), 'api')
+
+
+if __name__ == '__main__':
+    unittest.main()
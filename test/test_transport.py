@@ -0,0 +1,58 @@
+from aiob2.transport import TransportConfig, pool_stats
+from test.helpers import FakeB2, async_test
+import aiohttp
+import socket
+import unittest
+
+
+class TestTransportConfig(unittest.TestCase):
+
+    @async_test
+    async def test_default_timeouts_are_finite(self):
+        session = TransportConfig().create_session()
+        try:
+            self.assertEqual(session.timeout.sock_connect, 30.0)
+            self.assertEqual(session.timeout.sock_read, 300.0)
+            self.assertIsNone(session.timeout.total)
+        finally:
+            await session.close()
+
+    @async_test
+    async def test_tcp_nodelay(self):
+        async with FakeB2() as fake:
+            for tcp_nodelay in (True, False):
+                session = TransportConfig(
+                    tcp_nodelay=tcp_nodelay).create_session()
+                try:
+                    async with session.get(fake.url) as response:
+                        await response.read()
+                    # The connection is idle in the pool by now.
+                    (protocol, _), = next(iter(
+                        session.connector._conns.values()))
+                    sock = protocol.transport.get_extra_info('socket')
+                    self.assertEqual(bool(sock.getsockopt(
+                        socket.IPPROTO_TCP, socket.TCP_NODELAY)), tcp_nodelay)
+                finally:
+                    await session.close()
+
+    @async_test
+    async def test_pool_stats(self):
+        async with FakeB2() as fake:
+            b2 = await fake.client(transport=TransportConfig(limit=7))
+            stats = b2.pool_stats()['api']
+            self.assertEqual(stats['limit'], 7)
+            self.assertEqual(stats['acquired'], 0)
+            self.assertEqual((stats['idle'], stats['hosts']), (1, 1))
+
+    @async_test
+    async def test_pool_stats_without_connector_internals(self):
+        session = aiohttp.ClientSession(connector=aiohttp.BaseConnector())
+        try:
+            stats = pool_stats(session)
+            self.assertEqual(stats['limit'], 100)
+        finally:
+            await session.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
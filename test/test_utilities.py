@@ -0,0 +1,128 @@
+from aiob2.hashing import HashingPool
+from aiob2.throttle import TokenBucket
+from aiob2.utilities import StreamWithHashProgress
+from hashlib import sha1
+from test.helpers import async_test
+from unittest import mock
+import asyncio
+import io
+import unittest
+
+
+class Writer():
+    """ Collects what a payload writes. """
+
+    def __init__(self):
+        self.chunks = []
+
+    async def write(self, chunk):
+        self.chunks.append(bytes(chunk))
+
+
+class AsyncStream():
+    """ A stream with a coroutine read(). """
+
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+        self.reads = 0
+
+    async def read(self, size):
+        self.reads += 1
+        return self.data.read(size)
+
+
+class TestStreamWithHashProgress(unittest.TestCase):
+
+    DATA = bytes(range(40))
+
+    async def send(self, payload):
+        writer = Writer()
+        await payload.write(writer)
+        return writer.chunks
+
+    @async_test
+    async def test_sources(self):
+        for source in (self.DATA, memoryview(self.DATA),
+                       io.BytesIO(self.DATA), AsyncStream(self.DATA)):
+            payload = StreamWithHashProgress(source, len(self.DATA),
+                                             chunk_size=16)
+            self.assertEqual(payload.size, len(self.DATA) + 40)
+            chunks = await self.send(payload)
+            self.assertEqual([len(chunk) for chunk in chunks],
+                             [16, 16, 8, 40])
+            self.assertEqual(b''.join(chunks[:-1]), self.DATA)
+            self.assertEqual(chunks[-1], sha1(self.DATA).hexdigest().encode())
+            self.assertEqual(payload.get_hash(), sha1(self.DATA).hexdigest())
+
+    @async_test
+    async def test_hashing_pool(self):
+        hashing = HashingPool(threads=1)
+        self.addCleanup(hashing.close)
+        payload = StreamWithHashProgress(io.BytesIO(self.DATA), chunk_size=16,
+                                         hashing=hashing)
+        chunks = await self.send(payload)
+        self.assertEqual(chunks[-1], sha1(self.DATA).hexdigest().encode())
+        self.assertEqual(hashing.stats()['bytes'], len(self.DATA))
+
+    @async_test
+    async def test_without_hash(self):
+        payload = StreamWithHashProgress(self.DATA, len(self.DATA),
+                                         chunk_size=16, hash_at_end=False)
+        self.assertEqual(payload.size, len(self.DATA))
+        self.assertEqual(b''.join(await self.send(payload)), self.DATA)
+        self.assertIsNone(payload.get_hash())
+
+    @async_test
+    async def test_progress_limited_by_bytes(self):
+        progress = []
+        payload = StreamWithHashProgress(
+            self.DATA, chunk_size=4, progress_listener=progress.append,
+            progress_bytes=10, progress_interval=60)
+        await self.send(payload)
+        self.assertEqual(progress, [12, 24, 36, 40])
+
+    @async_test
+    async def test_progress_limited_by_time(self):
+        now = [0.0]
+
+        class SlowWriter(Writer):
+            async def write(self, chunk):
+                await super().write(chunk)
+                now[0] += 0.2
+
+        progress = []
+        payload = StreamWithHashProgress(
+            self.DATA, chunk_size=4, progress_listener=progress.append,
+            progress_bytes=1000, progress_interval=0.5)
+        loop = asyncio.get_running_loop()
+        with mock.patch.object(loop, 'time', lambda: now[0]):
+            await payload.write(SlowWriter())
+        # Every chunk takes 0.2 seconds to send, so every third one reports.
+        self.assertEqual(progress, [16, 28, 40])
+
+    @async_test
+    async def test_progress_for_empty_stream(self):
+        progress = []
+        payload = StreamWithHashProgress(b'',
+                                         progress_listener=progress.append)
+        await self.send(payload)
+        self.assertEqual(progress, [0])
+
+    @async_test
+    async def test_bandwidth(self):
+        bandwidth = TokenBucket()
+        acquired = []
+
+        async def acquire(amount=1):
+            acquired.append(amount)
+
+        bandwidth.acquire = acquire
+        payload = StreamWithHashProgress(self.DATA, chunk_size=16,
+                                         bandwidth=bandwidth)
+        await self.send(payload)
+        # The SHA1 at the end is not part of the shaped data.
+        self.assertEqual(acquired, [16, 16, 8])
+
+
+if __name__ == '__main__':
+    unittest.main()